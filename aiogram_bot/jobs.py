@@ -0,0 +1,128 @@
+# aiogram_bot/jobs.py
+# фоновые задачи бота (анализ, удаления): id, состояние, прогресс, отмена, конфликты
+import asyncio
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_TITLES = {
+    "running": "выполняется",
+    "stopping": "останавливается",
+    "done": "завершена",
+    "stopped": "остановлена",
+    "failed": "ошибка",
+}
+
+
+# ключи ресурсов задач
+ANALYSIS_KEY = "analysis"
+DELETION_KEYS = {"chat": "deletion:chat", "messages": "deletion:messages", "contacts": "deletion:contacts"}
+
+
+def chat_key(chat_id):
+    # чат, который меняет задача (анализ такие чаты пропускает)
+    return f"chat:{chat_id}"
+
+
+class JobConflict(Exception):
+    # задача не запущена: мешает уже выполняющаяся
+    def __init__(self, job):
+        super().__init__(f"задача #{job.id} ({job.title}) уже выполняется")
+        self.job = job
+
+
+class Job:
+    """
+    cancel - кооперативный токен отмены (asyncio.Event): задачи telethon проверяют его
+    между чатами/пачками и возвращают то, что успели (частичный результат).
+    keys - ресурсы задачи: задачи с общими ключами одновременно не выполняются.
+    """
+    __slots__ = ("id", "kind", "title", "keys", "state", "started_at", "finished_at", "cancel", "progress", "task", "error")
+
+    def __init__(self, job_id, kind, title, keys):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        self.keys = frozenset(keys)
+        self.state = "running"
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.cancel = asyncio.Event()
+        self.progress = None # ProgressReporter задачи (если есть)
+        self.task = None
+        self.error = None
+
+    @property
+    def active(self):
+        return self.state in ("running", "stopping")
+
+    def duration(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+class JobManager:
+
+    def __init__(self, keep_finished=10):
+        self.jobs = {} # {id: Job}
+        self.keep_finished = keep_finished
+        self._ids = itertools.count(1)
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.active]
+
+    def conflict(self, keys):
+        # первая активная задача, которой мешают ключи keys (None - можно запускать)
+        keys = frozenset(keys)
+        for job in self.active_jobs():
+            if job.keys & keys: return job
+        return None
+
+    def is_locked(self, key):
+        return any(key in job.keys for job in self.active_jobs())
+
+    def start(self, kind, title, job_func, keys=()):
+        """
+        Запускает await job_func(job) в фоне. Бросает JobConflict, если
+        ресурсы keys заняты другой задачей.
+        """
+        blocking = self.conflict(keys)
+        if blocking: raise JobConflict(blocking)
+        job = Job(next(self._ids), kind, title, keys)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, job_func))
+        logger.info(f"задача #{job.id} ({title}) запущена.")
+        return job
+
+    async def _run(self, job, job_func):
+        try:
+            await job_func(job)
+            job.state = "stopped" if job.cancel.is_set() else "done"
+        except asyncio.CancelledError:
+            job.state = "stopped"
+            raise
+        except Exception as e:
+            job.state = "failed"; job.error = str(e)
+            logger.exception(f"задача #{job.id} ({job.title}) завершилась с ошибкой")
+        finally:
+            job.finished_at = time.monotonic()
+            logger.info(f"задача #{job.id} ({job.title}): {STATE_TITLES[job.state]}, {job.duration():.0f}с.")
+            self._prune()
+
+    def stop(self, job_id):
+        # кооперативная остановка: задача доделывает текущий шаг и сохраняет частичные результаты
+        job = self.jobs.get(job_id)
+        if job is None or not job.active: return None
+        job.state = "stopping"
+        job.cancel.set()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if not job.active]
+        for job in finished[:-self.keep_finished]:
+            del self.jobs[job.id]
+
+
+# общий менеджер задач бота
+job_manager = JobManager()
@@ -0,0 +1,120 @@
+# aiogram_bot/progress.py
+# прогресс длительных задач: одно сообщение на задачу, редактируется не чаще раза в несколько секунд
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.utils.text_decorations import html_decoration
+
+import config
+from .bot_instance import bot
+
+logger = logging.getLogger(__name__)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60: return f"{seconds}с"
+    if seconds < 3600: return f"{seconds // 60}м {seconds % 60}с"
+    return f"{seconds // 3600}ч {seconds % 3600 // 60}м"
+
+
+class ProgressReporter:
+    """
+    Задача только меняет счетчики (update) - это синхронно и ничего не ждет.
+    Отправкой занимается отдельная корутина: первое изменение создает сообщение,
+    дальнейшие склеиваются и применяются правкой того же сообщения не чаще
+    раза в min_interval секунд. 429 от Bot API задерживает только показ прогресса.
+    Объект можно передавать как status_callback: await reporter("текст") - последнее событие.
+    """
+
+    def __init__(self, chat_id, title, unit="", min_interval=None, bot_instance=None):
+        self.bot = bot_instance or bot
+        self.chat_id = chat_id
+        self.title = title
+        self.unit = unit
+        self.min_interval = config.PROGRESS_UPDATE_INTERVAL if min_interval is None else min_interval
+        self.total = None
+        self.done = 0
+        self.failed = 0
+        self.last_note = None
+        self.started_at = time.monotonic()
+        self.message_id = None
+        self._changed = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+
+    # --- вызывается из задач (без ожидания) ---
+
+    def update(self, total=None, done=0, failed=0, note=None):
+        if total is not None: self.total = total
+        self.done += done
+        self.failed += failed
+        if note: self.last_note = note
+        if self._closing.is_set(): return
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def __call__(self, text):
+        self.update(note=text)
+
+    # --- отображение и отправка ---
+
+    def render(self, final=False):
+        elapsed = time.monotonic() - self.started_at
+        processed = self.done + self.failed
+        lines = [f"<b>{html_decoration.quote(self.title)}</b>" + (" - завершено" if final else "")]
+        counter = f"{processed}/{self.total}" if self.total else f"{processed}"
+        if self.total: counter += f" ({processed * 100 // max(1, self.total)}%)"
+        lines.append(f"Обработано: {counter} {self.unit}".rstrip() + (f", ошибок: {self.failed}" if self.failed else ""))
+        rate = processed / elapsed if elapsed > 0 else 0
+        timing = f"Прошло: {_format_duration(elapsed)}"
+        if rate and not final: timing += f", скорость: {rate:.1f}/с"
+        if rate and self.total and not final and self.total > processed:
+            timing += f", осталось ~{_format_duration((self.total - processed) / rate)}"
+        lines.append(timing)
+        if self.last_note: lines.append(f"<i>{html_decoration.quote(self.last_note)}</i>")
+        return "\n".join(lines)
+
+    async def _send(self, text):
+        try:
+            if self.message_id is None:
+                self.message_id = (await self.bot.send_message(self.chat_id, text)).message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+        except TelegramRetryAfter as e:
+            # слишком часто - пропускаем эту правку, следующая покажет актуальное состояние
+            logger.warning(f"прогресс '{self.title}': Bot API просит подождать {e.retry_after}с")
+            self._changed.set()
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e): logger.warning(f"прогресс '{self.title}': не удалось обновить сообщение: {e}")
+        except Exception as e:
+            logger.warning(f"прогресс '{self.title}': не удалось отправить сообщение: {e}")
+
+    async def _run(self):
+        while not self._closing.is_set():
+            await self._changed.wait()
+            if self._closing.is_set(): break
+            self._changed.clear()
+            await self._send(self.render())
+            try: # пауза между правками (прерывается при завершении)
+                await asyncio.wait_for(self._closing.wait(), timeout=self.min_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @property
+    def finished(self):
+        return self._closing.is_set()
+
+    async def finish(self, note=None):
+        # финальное состояние (ждет отправки последней правки); повторный вызов ничего не делает
+        if self.finished: return
+        if note: self.last_note = note
+        self._closing.set()
+        self._changed.set()
+        if self._task is None: return # прогресс ни разу не показывался - и итог не нужен
+        await self._task
+        await self._send(self.render(final=True))
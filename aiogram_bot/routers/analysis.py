@@ -3,28 +3,29 @@ import asyncio
 import logging
 import os
 from aiogram import Router, F, Bot
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.types import Message, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.text_decorations import html_decoration
 
 import config
 from ..bot_instance import bot
-from telethon_client import analyzer, utils, actions
+from ..progress import ProgressReporter
+from ..jobs import job_manager, JobConflict, ANALYSIS_KEY, chat_key
+from telethon_client import analyzer, utils, actions, exports, thresholds
 from telethon_client.client_instance import get_telethon_client
+from telethon_client.term_index import get_term_index, get_whitelist_index
+from telethon_client.deletion_queue import get_deletion_queue
+from telethon_client.analysis_store import get_analysis_store
 
 logger = logging.getLogger(__name__)
 router = Router()
 router.message.filter(F.from_user.id == config.ADMIN_ID)
 
-# кэш анализа (в памяти)
+# кэш анализа (в памяти); сами итоги анализа - в хранилище (get_analysis_store), кандидаты выбираются запросами
 analysis_cache = {
-    "analysis_results": None,
-    "messages_with_triggers": None,
-    "candidates_for_chat_deletion": None,
-    "candidates_for_msg_deletion": None,
+    "report": None, # utils.ReportDocument последнего анализа (строки - в хранилище; после перезапуска - get_report)
     "permanent_whitelist_ids": set(),
-    "is_busy": False,
     "terms": [],
     "whitelist_names": []
 }
@@ -32,85 +33,133 @@ analysis_cache = {
 @router.message(Command("clearcache"), StateFilter(None))
 async def cmd_clear_cache(message: Message):
     # очистка кэша
-    global analysis_cache
-    if analysis_cache["is_busy"]:
-        await message.answer("Бот занят, подождите.")
+    running = job_manager.conflict({ANALYSIS_KEY})
+    if running:
+        await message.answer(f"Идет анализ (задача #{running.id}), подождите или остановите: /stop {running.id}")
         return
-    analysis_cache = { # сброс кэша
-        "analysis_results": None, "messages_with_triggers": None,
-        "candidates_for_chat_deletion": None, "candidates_for_msg_deletion": None,
-        "permanent_whitelist_ids": set(), "is_busy": False,
+    analysis_cache.update({ # сброс кэша (тот же объект - его импортируют другие роутеры)
+        "report": None, "permanent_whitelist_ids": set(),
         "terms": [], "whitelist_names": []
-    }
+    })
+    get_analysis_store().clear()
     await message.answer("Кэш анализа очищен.")
     logger.info("aiogram: кэш анализа очищен.")
 
-async def run_analysis_background(chat_id: int, bot_instance: Bot):
-    # фоновая задача анализа
-    global analysis_cache
+def get_report():
+    # отчет последнего анализа: из памяти или (после перезапуска) по строкам хранилища с учетом сделанных удалений
+    if analysis_cache["report"] is not None: return analysis_cache["report"]
+    store = get_analysis_store()
+    run = store.latest_run()
+    if run is None: return None
+    report = utils.ReportDocument(store, run["id"], set(run.get("whitelist_ids", ())), run.get("whitelist_names", []), run.get("terms", []),
+                                  run.get("duplicates"), policy=store.policy())
+    analysis_cache["report"] = report
+    return report
+
+def candidates_summary(split):
+    # строки о кандидатах по разбиению thresholds.ThresholdSplit (итог анализа и /threshold)
+    text = ""
+    if split.full:
+        text += f"Найдено <b>{len(split.full)}</b> чатов для ПОЛНОГО удаления ({split.policy.describe()}).\n"
+    if split.messages:
+        text += f"Найдено <b>{len(split.messages)}</b> чатов для удаления ОТДЕЛЬНЫХ сообщений ({sum(split.messages.values())} шт.) ({split.policy.describe_below()}).\n"
+    if split.uncertain:
+        text += (f"<i>{len(split.uncertain)} чатов ниже порога, но загружены не полностью (остановка на прежнем пороге): "
+                 f"точное число триггеров даст новый <code>/analyze</code>.</i>\n")
+    return text
+
+async def run_analysis_background(chat_id: int, bot_instance: Bot, job=None, resume: bool = False):
+    # фоновая задача анализа (job - задача job_manager: отмена через /stop; resume - продолжить с контрольной точки)
+    progress = ProgressReporter(chat_id, "Анализ чатов", "диалогов", bot_instance=bot_instance)
+    if job: job.progress = progress
+    partial_path = None # частичный отчет, если анализ не дошел до полного
     try:
-        analysis_cache["terms"] = utils.load_list_from_file(config.TERMS_FILE)
-        analysis_cache["whitelist_names"] = utils.load_list_from_file(config.WHITELIST_FILE)
+        store = get_analysis_store()
+        policy = store.policy() # текущий порог удаления (/threshold)
+        # скомпилированные списки (пересобираются только после правки файлов)
+        term_index = get_term_index()
+        analysis_cache["terms"] = term_index.items
+        analysis_cache["whitelist_names"] = get_whitelist_index()
         analysis_cache["permanent_whitelist_ids"] = await analyzer.find_whitelisted_ids(analysis_cache["whitelist_names"])
 
+        # итоги чатов пишутся в хранилище анализов по мере сканирования (переживают перезапуск), в памяти не копятся;
+        # рядом дописывается частичный html-отчет по уже просмотренным чатам
+        run_writer = store.begin_run(analysis_cache["permanent_whitelist_ids"])
+        partial = utils.PartialReport(len(analysis_cache["terms"]), policy)
+        await partial.open()
+
+        async def store_chat(position, chat_info, trigger_ids, history):
+            run_writer.add(position, chat_info, trigger_ids, history)
+            await partial.add(chat_info)
+
         # --- Получаем оба результата анализа ---
-        analysis_results, messages_with_triggers = await analyzer.analyze_chats_job(
-            analysis_cache["terms"],
-            analysis_cache["permanent_whitelist_ids"],
-            config.FETCH_MESSAGE_LIMIT
-        )
-        analysis_cache["analysis_results"] = analysis_results
-        analysis_cache["messages_with_triggers"] = messages_with_triggers
-        # --- ---
+        try:
+            results = await analyzer.analyze_chats_job(
+                analysis_cache["terms"],
+                analysis_cache["permanent_whitelist_ids"],
+                config.FETCH_MESSAGE_LIMIT,
+                progress=progress,
+                cancel_token=job.cancel if job else None,
+                # чаты, которые сейчас удаляются другими задачами, не сканируем
+                is_excluded=lambda peer_id: job_manager.is_locked(chat_key(peer_id)),
+                resume=resume,
+                matcher=term_index.matcher,
+                policy=policy,
+                sink=store_chat
+            )
+        except BaseException:
+            run_writer.discard() # отчет и кандидаты остаются от прошлого анализа
+            partial_path = await partial.finish()
+            raise
+        await progress.finish("Остановлено." if results.stopped else None)
+        run_id = run_writer.finish(results, {
+            "terms": list(analysis_cache["terms"]), "whitelist_names": list(analysis_cache["whitelist_names"]),
+            "whitelist_ids": sorted(analysis_cache["permanent_whitelist_ids"])})
+        summary = store.summary(run_id)
 
-        # --- Определение кандидатов на разные действия ---
-        candidates_chat_del = []
-        candidates_msg_del = {} # {chat_id: msg_count}
-        if analysis_results:
-            for chat_info in analysis_results:
-                 is_whitelisted_by_id = chat_info["id"] in analysis_cache["permanent_whitelist_ids"]
-                 is_whitelisted_flag = chat_info.get("is_whitelisted", False)
-                 if is_whitelisted_by_id or is_whitelisted_flag:
-                     continue # Пропускаем белые списки
-
-                 count = chat_info['count']
-                 current_chat_id = chat_info['id']
-                 trigger_msg_ids = messages_with_triggers.get(current_chat_id, [])
-
-                 if count > config.DELETION_THRESHOLD:
-                     candidates_chat_del.append(chat_info)
-                 elif 1 <= count <= config.DELETION_THRESHOLD and trigger_msg_ids:
-                     # Кандидат на удаление сообщений, только если есть ID сообщений
-                     candidates_msg_del[current_chat_id] = len(trigger_msg_ids)
-
-        analysis_cache["candidates_for_chat_deletion"] = candidates_chat_del
-        analysis_cache["candidates_for_msg_deletion"] = candidates_msg_del
-        logger.info(f"aiogram: кандидаты на удаление чатов: {len(candidates_chat_del)}")
-        logger.info(f"aiogram: кандидаты на удаление сообщений: {len(candidates_msg_del)} чатов ({sum(candidates_msg_del.values())} сообщений)")
+        # --- Кандидаты на разные действия (разбиение колонок запуска по порогу; белые списки исключены) ---
+        split = store.split(run_id, policy)
+        logger.info(f"aiogram: кандидаты на удаление чатов: {len(split.full)}")
+        logger.info(f"aiogram: кандидаты на удаление сообщений: {len(split.messages)} чатов ({sum(split.messages.values())} сообщений)")
         # --- ---
 
-        # --- Генерация отчета (используем candidates_chat_del для подсветки) ---
-        report_filepath = utils.generate_html_report(
-            analysis_results=analysis_results if analysis_results else [],
+        # --- Генерация отчета (кандидаты подсвечиваются по тому же порогу) ---
+        # отчет хранится в кэше: после удалений перерисовываются только строки затронутых чатов
+        report = utils.ReportDocument(
+            store, run_id,
             permanent_whitelist_ids=analysis_cache["permanent_whitelist_ids"],
             permanent_whitelist_names=analysis_cache["whitelist_names"],
-            candidates_for_deletion=candidates_chat_del, # Передаем только кандидатов на удаление чатов
-            final_deleted_ids=set(),
-            terms_list=analysis_cache["terms"]
+            terms_list=analysis_cache["terms"],
+            duplicates=results.duplicates,
+            policy=policy
         )
+        analysis_cache["report"] = report
+        report_filepath = await asyncio.to_thread(report.save) # пишется в рабочем потоке, бот не ждет
+        await partial.finish()
+        partial.discard()
 
         # --- Формирование итогового сообщения ---
         final_message = "Анализ завершен.\n"
-        if candidates_chat_del:
-            final_message += f"Найдено <b>{len(candidates_chat_del)}</b> чатов для ПОЛНОГО удаления (>{config.DELETION_THRESHOLD} триггеров).\n"
-        if candidates_msg_del:
-             total_msgs = sum(candidates_msg_del.values())
-             final_message += f"Найдено <b>{len(candidates_msg_del)}</b> чатов для удаления ОТДЕЛЬНЫХ сообщений ({total_msgs} шт.) (1-{config.DELETION_THRESHOLD} триггеров).\n"
+        if results.stopped:
+            final_message = "Анализ остановлен: результаты <b>частичные</b> (просмотрены не все чаты).\n"
+        elif results.resumable:
+            final_message = "Анализ прерван ошибкой получения диалогов: результаты <b>частичные</b>.\n"
+        if results.sampled:
+            sampled_chats = summary["sampled"]
+            final_message += f"Двухфазный анализ: {sampled_chats} чатов проверено только выборкой последних сообщений, остальные просканированы полностью.\n"
+        if results.resumed_chats:
+            final_message += f"Продолжен с контрольной точки: итоги {results.resumed_chats} чатов взяты из нее.\n"
+        final_message += candidates_summary(split)
+        lower_bound_chats = summary["lower_bound"]
+        if split.full and lower_bound_chats:
+            final_message += f"<i>В {lower_bound_chats} чатах загрузка остановлена на пороге, число триггеров - нижняя оценка.</i>\n"
 
-        if not candidates_chat_del and not candidates_msg_del:
+        if not split.full and not split.messages:
             final_message += "Чатов/сообщений для удаления по результатам анализа нет.\n"
         else:
              final_message += f"Используйте <code>/delete</code> для просмотра и подтверждения.\n"
+        if results.resumable:
+            final_message += "Продолжить анализ с места остановки: <code>/analyze resume</code>\n"
         # --- ---
 
         # Отправка отчета и сообщения
@@ -129,16 +178,23 @@ async def run_analysis_background(chat_id: int, bot_instance: Bot):
         await bot_instance.send_message(chat_id, f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}")
     except Exception as e:
         logger.exception("aiogram: ошибка фонового анализа")
-        await bot_instance.send_message(chat_id, f"<b>Ошибка анализа:</b>\n{html_decoration.quote(str(e))}")
+        await bot_instance.send_message(chat_id, f"<b>Ошибка анализа:</b>\n{html_decoration.quote(str(e))}\n"
+                                                 f"Просканированные чаты сохранены, продолжить: <code>/analyze resume</code>")
+        if partial_path and os.path.exists(partial_path):
+            try:
+                await bot_instance.send_document(chat_id, FSInputFile(partial_path), caption="Частичный отчет по просмотренным до ошибки чатам.")
+            except Exception as send_error:
+                logger.error(f"aiogram: не удалось отправить частичный отчет: {send_error}")
     finally:
-        analysis_cache["is_busy"] = False
+        await progress.finish("Прервано.") # после успешного завершения ничего не делает
 
 @router.message(Command("analyze"), StateFilter(None))
-async def cmd_analyze(message: Message):
-    # запуск анализа
-    global analysis_cache
-    if analysis_cache["is_busy"]:
-        await message.answer("Анализ уже запущен.")
+async def cmd_analyze(message: Message, command: CommandObject):
+    # запуск анализа (/analyze resume - продолжить прерванный)
+    resume = (command.args or "").strip().lower() == "resume"
+    running = job_manager.conflict({ANALYSIS_KEY})
+    if running:
+        await message.answer(f"Анализ уже запущен (задача #{running.id}).")
         return
 
     try: get_telethon_client()
@@ -149,7 +205,68 @@ async def cmd_analyze(message: Message):
          await message.answer(f"<b>Критическая ошибка Telethon:</b>\n{html_decoration.quote(str(e))}")
          logger.error(f"ошибка проверки telethon: {e}"); return
 
-    analysis_cache["is_busy"] = True
-    await message.answer("Начинаю анализ через Telethon... Это может занять много времени.\nОтчет придет по завершении.")
-    logger.info("aiogram: запущен /analyze")
-    asyncio.create_task(run_analysis_background(message.chat.id, bot))
\ No newline at end of file
+    chat_id = message.chat.id
+    try:
+        job = job_manager.start("analysis", "Анализ чатов", lambda job: run_analysis_background(chat_id, bot, job, resume), keys={ANALYSIS_KEY})
+    except JobConflict as e:
+        await message.answer(f"Анализ уже запущен (задача #{e.job.id})."); return
+    await message.answer(f"{'Продолжаю прерванный' if resume else 'Начинаю'} анализ через Telethon (задача #{job.id})... Это может занять много времени.\n"
+                         f"Отчет придет по завершении. Остановить: <code>/stop {job.id}</code>")
+    logger.info(f"aiogram: запущен /analyze{' resume' if resume else ''} (задача #{job.id})")
+
+@router.message(Command("export"), StateFilter(None))
+async def cmd_export(message: Message, command: CommandObject):
+    # выгрузка результатов последнего анализа: /export [jsonl|csv|snapshot]
+    fmt = (command.args or "jsonl").strip().lower()
+    if fmt not in exports.EXPORT_FORMATS:
+        await message.answer(f"Формат: <code>/export {'|'.join(exports.EXPORT_FORMATS)}</code> (по умолчанию jsonl).")
+        return
+    store = get_analysis_store()
+    run = store.latest_run()
+    if run is None:
+        await message.answer("Сначала запустите <code>/analyze</code>.")
+        return
+    try:
+        # чаты читаются из хранилища страницами в потоке выгрузки, event loop не занят
+        path, count = await asyncio.to_thread(exports.export_run, fmt, store, run["id"], get_deletion_queue().chat_outcomes())
+        await message.answer_document(FSInputFile(path), caption=f"Выгрузка {fmt}: {count} чатов.")
+        logger.info(f"aiogram: выгрузка {path} отправлена.")
+    except Exception as e:
+        logger.exception("aiogram: ошибка выгрузки")
+        await message.answer(f"<b>Ошибка выгрузки:</b>\n{html_decoration.quote(str(e))}")
+
+@router.message(Command("threshold"), StateFilter(None))
+async def cmd_threshold(message: Message, command: CommandObject):
+    # порог удаления: /threshold N - больше N триггеров, /threshold density 2% - доля просмотренных сообщений с триггерами
+    # кандидаты последнего анализа разбиваются заново по колонкам в памяти (без сканирования), отчет перерисовывается
+    store = get_analysis_store()
+    args = (command.args or "").split()
+    if args:
+        try: policy = thresholds.ThresholdPolicy.parse(args)
+        except ValueError:
+            await message.answer("Формат: <code>/threshold 5</code> (больше 5 триггеров) или <code>/threshold density 2%</code> "
+                                 "(доля просмотренных сообщений с триггерами). Без аргументов - текущий порог.")
+            return
+        store.set_policy(policy)
+        logger.info(f"aiogram: порог удаления: {policy.describe()}")
+    else:
+        policy = store.policy()
+    run = store.latest_run()
+    if run is None:
+        await message.answer(f"Порог удаления: <b>{policy.describe()}</b>.\nКандидаты появятся после <code>/analyze</code>.")
+        return
+    split = store.split(run["id"], policy)
+    text = (f"Порог удаления: <b>{policy.describe()}</b>\n" + candidates_summary(split)
+            + f"Без действий: {split.clean} чатов.\n<i>Разбиение итогов анализа: {split.elapsed * 1000:.1f} мс.</i>\n")
+    if split.full or split.messages: text += "Просмотр и подтверждение: <code>/delete</code>\n"
+    report = get_report()
+    if report is None or not report.set_policy(policy):
+        await message.answer(text)
+        return
+    # перерисовываются только строки, у которых сменился статус
+    report_filepath = await asyncio.to_thread(report.save)
+    if report_filepath and os.path.exists(report_filepath):
+        await message.answer_document(FSInputFile(report_filepath), caption=text)
+        logger.info(f"aiogram: отчет с новым порогом {report_filepath} отправлен ({report.rendered_rows} строк перерисовано).")
+    else:
+        await message.answer(text + "\n<i>Не удалось создать HTML-отчет.</i>")
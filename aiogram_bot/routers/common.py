@@ -1,10 +1,14 @@
 # aiogram_bot/routers/common.py
 from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.types import Message
+from aiogram.utils.text_decorations import html_decoration
 from aiogram.fsm.context import FSMContext
 
 import config
+from telethon_client.rate_limiter import rate_limiter
+from ..jobs import job_manager, STATE_TITLES
+from ..progress import _format_duration
 
 router = Router()
 # фильтр на сообщения только от админа
@@ -18,9 +22,16 @@ async def cmd_start(message: Message):
         "Бот использует ваш аккаунт для анализа и действий.\n\n"
         "<b>Команды:</b>\n"
         "<code>/analyze</code> - Запустить анализ чатов (Telethon).\n"
+        "<code>/analyze resume</code> - Продолжить прерванный анализ с контрольной точки.\n"
+        "<code>/export [jsonl|csv|snapshot]</code> - Выгрузить результаты анализа в машиночитаемом виде.\n"
+        "<code>/threshold [N | density X%]</code> - Показать или изменить порог удаления (без повторного анализа).\n"
         "<code>/delete</code> - Показать чаты для удаления и запросить подтверждение (Telethon).\n"
         "<code>/deletecontacts</code> - Показать контакты для удаления и запросить подтверждение (Telethon).\n"
         "<code>/clearcache</code> - Очистить результаты последнего анализа.\n"
+        "<code>/rates</code> - Текущие скорости запросов Telethon по методам.\n"
+        "<code>/retryfailed</code> - Повторить неудавшиеся удаления из очереди.\n"
+        "<code>/jobs</code> - Фоновые задачи (анализ, удаления) и их прогресс.\n"
+        "<code>/stop N</code> - Остановить задачу #N (сделанное сохраняется).\n"
         "<code>/help</code> - Показать это сообщение.\n\n"
         "<b>ВНИМАНИЕ:</b> Команды <code>/delete</code> и <code>/deletecontacts</code> выполняют необратимые действия!"
     )
@@ -38,4 +49,55 @@ async def cmd_cancel(message: Message, state: FSMContext):
         return
 
     await state.clear()
-    await message.answer("Операция отменена.")
\ No newline at end of file
+    await message.answer("Операция отменена.")
+
+@router.message(Command("rates"))
+async def cmd_rates(message: Message):
+    # текущие бюджеты запросов telethon (скорость подстраивается по floodwait)
+    snapshot = rate_limiter.snapshot()
+    if not snapshot:
+        await message.answer("Запросов через планировщик еще не было.")
+        return
+    lines = ["<b>Скорости запросов Telethon:</b>"]
+    for method, info in snapshot.items():
+        line = f"<code>{method}</code>: {info['rate']}/с, вызовов {info['calls']}, floodwait {info['flood_waits']}"
+        if info["ceiling"]: line += f", потолок {info['ceiling']}/с"
+        if info["blocked_for"]: line += f", пауза еще {info['blocked_for']}с"
+        lines.append(line)
+    await message.answer("\n".join(lines))
+
+@router.message(Command("jobs"))
+async def cmd_jobs(message: Message):
+    # активные и недавно завершенные фоновые задачи
+    jobs = list(job_manager.jobs.values())
+    if not jobs:
+        await message.answer("Фоновых задач не было.")
+        return
+    lines = ["<b>Задачи:</b>"]
+    for job in jobs:
+        line = f"#{job.id} {job.title} - {STATE_TITLES[job.state]}, {_format_duration(job.duration())}"
+        if job.progress is not None:
+            processed = job.progress.done + job.progress.failed
+            line += f", обработано {processed}/{job.progress.total}" if job.progress.total else f", обработано {processed}"
+            if job.progress.failed: line += f", ошибок {job.progress.failed}"
+        if job.error: line += f" ({html_decoration.quote(job.error[:100])})"
+        lines.append(line)
+    if job_manager.active_jobs(): lines.append("\nОстановить: <code>/stop N</code>")
+    await message.answer("\n".join(lines))
+
+@router.message(Command("stop"))
+async def cmd_stop(message: Message, command: CommandObject):
+    # кооперативная остановка задачи: текущий шаг доделывается, результаты частичные
+    if not command.args or not command.args.strip().isdigit():
+        active = job_manager.active_jobs()
+        if len(active) != 1:
+            await message.answer("Укажите номер задачи: <code>/stop N</code> (список - <code>/jobs</code>).")
+            return
+        job_id = active[0].id
+    else:
+        job_id = int(command.args.strip())
+    job = job_manager.stop(job_id)
+    if job is None:
+        await message.answer(f"Задача #{job_id} не найдена или уже завершена.")
+        return
+    await message.answer(f"Останавливаю задачу #{job.id} ({job.title})...")
@@ -12,10 +12,18 @@ from aiogram.exceptions import TelegramBadRequest
 
 import config
 from ..bot_instance import bot
+from ..progress import ProgressReporter
+from ..jobs import job_manager, JobConflict, ANALYSIS_KEY, DELETION_KEYS, chat_key
 from ..states import DeletionStates
-from .analysis import analysis_cache
+from .analysis import analysis_cache, get_report
 from telethon_client import actions, utils, analyzer
 from telethon_client.client_instance import get_telethon_client
+from telethon_client.term_index import get_whitelist_index
+from telethon_client.scan_state import get_scan_state
+from telethon_client.analysis_checkpoint import get_analysis_checkpoint
+from telethon_client.deletion_queue import get_deletion_queue
+from telethon_client.analysis_store import get_analysis_store
+from telethon_client.deletion_planner import plan_message_deletion, plan_totals, METHOD_TITLES
 
 import shared_state
 
@@ -27,12 +35,36 @@ router.message.filter(F.from_user.id == config.ADMIN_ID)
 router.callback_query.filter(F.from_user.id == config.ADMIN_ID)
 
 
-async def deletion_status_callback(chat_id: int, status_message: str):
-    # отправка статуса удаления (без изменений)
-    try:
-        await bot.send_message(chat_id, f"<code>{html_decoration.quote(status_message)}</code>")
-    except Exception as e:
-        logger.warning(f"не удалось отправить статус удаления в чат {chat_id}: {e}")
+def forget_scanned(chat_ids):
+    # итоги этих чатов изменились: пересканируем при следующем анализе (и при /analyze resume)
+    chat_ids = set(chat_ids)
+    get_scan_state().forget(chat_ids)
+    get_analysis_checkpoint().forget(chat_ids)
+
+
+def mark_in_report(results):
+    # итоги удаления -> в хранилище анализов (удаленное больше не кандидат) и в отчет (перерисуются только строки затронутых чатов)
+    store = get_analysis_store()
+    run = store.latest_run()
+    if run is not None:
+        store.mark_chats_deleted(run["id"], results.get("deleted_ids", ()))
+        store.mark_messages_deleted(run["id"], results.get("deleted_by_chat", {}))
+    report = analysis_cache.get("report") # не построен - get_report соберет его из хранилища уже с этими итогами
+    if report is None: return
+    report.mark_chats_deleted(results.get("deleted_ids", ()))
+    report.mark_messages_deleted(results.get("deleted_by_chat", {}))
+    report.mark_contacts_deleted(results.get("deleted_contacts", ()))
+
+
+async def send_with_report(chat_id: int, text: str) -> Message:
+    # итоговое сообщение + обновленный отчет, если есть результаты анализа
+    report = get_report()
+    if report is None: return await bot.send_message(chat_id, text)
+    report_filepath = await asyncio.to_thread(report.save) # пишется в рабочем потоке, бот не ждет
+    if report_filepath and os.path.exists(report_filepath):
+        return await bot.send_document(chat_id, FSInputFile(report_filepath), caption=f"{text}\nОбновленный отчет:")
+    return await bot.send_message(chat_id, text + "\n<i>Не удалось создать/отправить отчет.</i>")
+
 
 # --- Хелпер для отправки промпта очистки/остановки ---
 async def offer_cleanup_and_stop(dp: Dispatcher, chat_id: int, user_id: int, final_status_message: Message | None = None):
@@ -60,41 +92,30 @@ async def offer_cleanup_and_stop(dp: Dispatcher, chat_id: int, user_id: int, fin
         logger.error(f"Не удалось предложить очистку/остановку в чате {chat_id}: {e}")
 
 
-async def run_chat_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, chats_list: list[dict]):
+async def run_chat_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, chats_list: list[dict], job=None):
     # фоновое удаление ЧАТОВ
-    global analysis_cache
-    analysis_cache["is_busy"] = True
     final_status_msg = None
     success = False
+    progress = ProgressReporter(chat_id_to_notify, "Удаление чатов", "чатов")
+    if job: job.progress = progress
     try:
         get_telethon_client()
         chat_ids = [chat['id'] for chat in chats_list]
-        results = await actions.delete_chats_job(
-            chat_ids, lambda status: deletion_status_callback(chat_id_to_notify, status)
-        )
+        results = await actions.delete_chats_job(chat_ids, progress, job.cancel if job else None)
+        stopped = results.get("stopped", False)
+        await progress.finish("Остановлено." if stopped else None)
         deleted_ids = results.get("deleted_ids", set())
+        forget_scanned(deleted_ids) # удаленные чаты не держим в инкрементальном состоянии
         deleted_count = results.get('deleted', 0)
         failed_count = results.get('failed', 0)
         success = failed_count == 0 # Считаем успехом, если не было ошибок
-
-        if analysis_cache.get("analysis_results") is not None:
-            report_filepath = utils.generate_html_report(
-                 analysis_results=analysis_cache["analysis_results"],
-                 permanent_whitelist_ids=analysis_cache["permanent_whitelist_ids"],
-                 permanent_whitelist_names=analysis_cache["whitelist_names"],
-                 candidates_for_deletion=[], final_deleted_ids=deleted_ids,
-                 terms_list=analysis_cache.get("terms", [])
-            )
-            final_report_msg_text = f"Удаление ЧАТОВ завершено.\nУдалено: {deleted_count}\nОшибок: {failed_count}\nОбновленный отчет:"
-            if report_filepath and os.path.exists(report_filepath):
-                 final_status_msg = await bot.send_document(chat_id_to_notify, FSInputFile(report_filepath), caption=final_report_msg_text)
-            else:
-                 final_status_msg = await bot.send_message(chat_id_to_notify, final_report_msg_text + "\n<i>Не удалось создать/отправить отчет.</i>")
-        else:
-             final_status_msg = await bot.send_message(chat_id_to_notify, f"Удаление ЧАТОВ завершено.\nУдалено: {deleted_count}\nОшибок: {failed_count}")
+        outcome = "остановлено (оставшиеся - в <code>/retryfailed</code>)" if stopped else "завершено"
+        # отчет обновляется на месте: перерисовываются только строки удаленных чатов
+        mark_in_report(results)
+        final_status_msg = await send_with_report(chat_id_to_notify, f"Удаление ЧАТОВ {outcome}.\nУдалено: {deleted_count}\nОшибок: {failed_count}")
 
         # Предлагаем очистку после завершения
-        await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
+        if not stopped: await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
 
     except ConnectionError as e:
         logger.error(f"ошибка telethon при удалении чатов: {e}")
@@ -103,27 +124,28 @@ async def run_chat_deletion_background(dp: Dispatcher, chat_id_to_notify: int, u
         logger.exception("aiogram: ошибка фонового удаления чатов")
         await bot.send_message(chat_id_to_notify, f"<b>Ошибка удаления чатов:</b>\n{html_decoration.quote(str(e))}")
     finally:
-        analysis_cache["candidates_for_chat_deletion"] = []
-        # Не сбрасываем is_busy здесь, ждем реакции пользователя на cleanup
-        # analysis_cache["is_busy"] = False
+        await progress.finish("Прервано.")
 
-async def run_message_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, messages_dict: dict[int, list[int]]):
+async def run_message_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, messages_dict: dict, history: dict | None = None, job=None):
     # фоновое удаление СООБЩЕНИЙ
-    global analysis_cache
-    analysis_cache["is_busy"] = True
     final_status_msg = None
     success = False
+    progress = ProgressReporter(chat_id_to_notify, "Удаление сообщений", "сообщений")
+    if job: job.progress = progress
     try:
         get_telethon_client()
-        results = await actions.delete_messages_job(
-             messages_dict, lambda status: deletion_status_callback(chat_id_to_notify, status)
-        )
+        results = await actions.delete_messages_job(messages_dict, progress, history=history, cancel_token=job.cancel if job else None)
+        stopped = results.get("stopped", False)
+        await progress.finish("Остановлено." if stopped else None)
+        forget_scanned(messages_dict.keys()) # итоги этих чатов изменились, пересканируем при следующем анализе
         deleted_count = results.get('deleted', 0)
         failed_count = results.get('failed', 0)
         success = failed_count == 0
-        final_status_msg = await bot.send_message(chat_id_to_notify, f"Удаление СООБЩЕНИЙ завершено.\nУдалено: {deleted_count}\nОшибок: {failed_count}")
+        outcome = "остановлено (оставшиеся - в <code>/retryfailed</code>)" if stopped else "завершено"
+        mark_in_report(results)
+        final_status_msg = await send_with_report(chat_id_to_notify, f"Удаление СООБЩЕНИЙ {outcome}.\nУдалено: {deleted_count}\nОшибок: {failed_count}")
         # Предлагаем очистку
-        await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
+        if not stopped: await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
     except ConnectionError as e:
         logger.error(f"ошибка telethon при удалении сообщений: {e}")
         await bot.send_message(chat_id_to_notify, f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}")
@@ -131,27 +153,27 @@ async def run_message_deletion_background(dp: Dispatcher, chat_id_to_notify: int
         logger.exception("aiogram: ошибка фонового удаления сообщений")
         await bot.send_message(chat_id_to_notify, f"<b>Ошибка удаления сообщений:</b>\n{html_decoration.quote(str(e))}")
     finally:
-        analysis_cache["candidates_for_msg_deletion"] = {}
-        # Не сбрасываем is_busy
-        # analysis_cache["is_busy"] = False
+        await progress.finish("Прервано.")
 
-async def run_contact_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, contacts_list: list):
+async def run_contact_deletion_background(dp: Dispatcher, chat_id_to_notify: int, user_id: int, contacts_list: list, job=None):
     # фоновое удаление КОНТАКТОВ
-    global analysis_cache
-    analysis_cache["is_busy"] = True
     final_status_msg = None
     success = False
+    progress = ProgressReporter(chat_id_to_notify, "Удаление контактов", "контактов")
+    if job: job.progress = progress
     try:
         get_telethon_client()
-        results = await actions.delete_contacts_job(
-             contacts_list, lambda status: deletion_status_callback(chat_id_to_notify, status)
-        )
+        results = await actions.delete_contacts_job(contacts_list, progress, job.cancel if job else None)
+        stopped = results.get("stopped", False)
+        await progress.finish("Остановлено." if stopped else None)
         deleted_count = results.get('deleted', 0)
         failed_count = results.get('failed', 0)
         success = failed_count == 0
-        final_status_msg = await bot.send_message(chat_id_to_notify, f"Удаление КОНТАКТОВ завершено.\nУспешно удалено: {deleted_count}\nОшибок/пропущено: {failed_count}")
+        outcome = "остановлено (оставшиеся - в <code>/retryfailed</code>)" if stopped else "завершено"
+        mark_in_report(results)
+        final_status_msg = await send_with_report(chat_id_to_notify, f"Удаление КОНТАКТОВ {outcome}.\nУспешно удалено: {deleted_count}\nОшибок/пропущено: {failed_count}")
         # Предлагаем очистку
-        await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
+        if not stopped: await offer_cleanup_and_stop(dp, chat_id_to_notify, user_id, final_status_msg)
     except ConnectionError as e:
         logger.error(f"ошибка telethon при удалении контактов: {e}")
         await bot.send_message(chat_id_to_notify, f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}")
@@ -159,51 +181,61 @@ async def run_contact_deletion_background(dp: Dispatcher, chat_id_to_notify: int
         logger.exception("aiogram: ошибка фонового удаления контактов")
         await bot.send_message(chat_id_to_notify, f"<b>Ошибка удаления контактов:</b>\n{html_decoration.quote(str(e))}")
     finally:
-        # Не сбрасываем is_busy
-        # analysis_cache["is_busy"] = False
+        await progress.finish("Прервано.")
 
 # --- Обработчик команды /delete (без изменений в логике показа) ---
 @router.message(Command("delete"), StateFilter(None))
 async def cmd_delete(message: Message, state: FSMContext):
     # показать кандидатов на удаление чатов и сообщений
-    global analysis_cache
-    if analysis_cache["is_busy"]: await message.answer("Бот занят."); return
-    if analysis_cache["analysis_results"] is None: await message.answer("Сначала запустите <code>/analyze</code>."); return
+    running = job_manager.conflict({ANALYSIS_KEY})
+    if running: await message.answer(f"Идет анализ (задача #{running.id}), результаты еще не готовы."); return
+    store = get_analysis_store()
+    run = store.latest_run()
+    if run is None: await message.answer("Сначала запустите <code>/analyze</code>."); return
 
-    candidates_chat = analysis_cache.get("candidates_for_chat_deletion", [])
-    candidates_msg = analysis_cache.get("candidates_for_msg_deletion", {})
-    messages_with_triggers = analysis_cache.get("messages_with_triggers", {})
+    # кандидаты - из хранилища по текущему порогу (/threshold; уже удаленное и белые списки исключены)
+    run_id = run["id"]
+    candidates_chat = store.chat_candidates(run_id)
+    candidates_msg = store.message_candidates(run_id)
 
     if not candidates_chat and not candidates_msg:
         await message.answer("Нет объектов для удаления."); return
 
     response = "<b>Объекты для удаления:</b>\n"
-    action_planned = False; chats_to_delete_full = []; msgs_to_delete_dict = {}
+    action_planned = False; chats_to_delete_full = []; msgs_to_delete_chat_ids = []
 
     if candidates_chat:
         action_planned = True; response += "\n<b>--- ЧАТЫ НА ПОЛНОЕ УДАЛЕНИЕ ---</b>\n"
         for idx, chat_info in enumerate(candidates_chat):
-            safe_title = html_decoration.quote(chat_info.get('title', 'N/A')); chat_id_str = f"<code>{chat_info.get('id', 'N/A')}</code>"; count_str = chat_info.get('count', 0)
+            safe_title = html_decoration.quote(chat_info.get('title', 'N/A')); chat_id_str = f"<code>{chat_info.get('id', 'N/A')}</code>"; count_str = ("≥" if chat_info.get('count_lower_bound') else "") + str(chat_info.get('count', 0))
             response += f"{idx + 1}. <b>{safe_title}</b> (ID: {chat_id_str}) - Триггеров: {count_str}\n"
             chats_to_delete_full.append(chat_info)
 
     if candidates_msg:
         action_planned = True; response += "\n<b>--- ЧАТЫ С УДАЛЕНИЕМ СООБЩЕНИЙ ---</b>\n"
-        chat_titles = {res['id']: res['title'] for res in analysis_cache.get("analysis_results", [])}
+        chat_titles = store.titles(run_id, candidates_msg)
+        messages_with_triggers = store.trigger_ids(run_id, candidates_msg)
+        # план удаления (способ и число запросов по каждому чату) - до подтверждения
+        plans = plan_message_deletion(
+            {chat_id: messages_with_triggers.get(chat_id) or [] for chat_id in candidates_msg},
+            store.history(run_id, candidates_msg))
         idx = 0
         for chat_id, expected_msg_count in candidates_msg.items():
             actual_message_ids = messages_with_triggers.get(chat_id)
             if not actual_message_ids: continue # Пропускаем, если нет ID
             idx += 1; safe_title = html_decoration.quote(chat_titles.get(chat_id, f'ID {chat_id}')); chat_id_str = f"<code>{chat_id}</code>"; actual_msg_count = len(actual_message_ids)
-            response += f"{idx}. <b>{safe_title}</b> (ID: {chat_id_str}) - Сообщений: {actual_msg_count}\n"
-            msgs_to_delete_dict[chat_id] = actual_message_ids
+            plan = plans[chat_id]
+            response += f"{idx}. <b>{safe_title}</b> (ID: {chat_id_str}) - Сообщений: {actual_msg_count}, способ: {METHOD_TITLES[plan.method]}, запросов: ~{plan.rpc_estimate}\n"
+            msgs_to_delete_chat_ids.append(chat_id) # сами ID берутся из результатов анализа при подтверждении
+        rpc_estimate, chunk_rpc = plan_totals(plans)
+        response += f"<i>Запросов на удаление сообщений: ~{rpc_estimate} (пачками по 100 было бы {chunk_rpc}).</i>\n"
 
     if not action_planned: await message.answer("Нет действий для выполнения."); return
 
     response += f"\n<b>ВНИМАНИЕ!</b> Действия необратимы!\nДля подтверждения отправьте:\n<code>{config.CHAT_DELETION_CONFIRMATION_PHRASE}</code>\nИли <code>/cancel</code> для отмены."
-    await state.update_data(chats_to_delete_full=chats_to_delete_full, msgs_to_delete_dict=msgs_to_delete_dict)
+    await state.update_data(run_id=run_id, chats_to_delete_full=chats_to_delete_full, msgs_to_delete_chat_ids=msgs_to_delete_chat_ids)
     await state.set_state(DeletionStates.pending_chat_deletion)
-    await message.answer(response); logger.info(f"aiogram: запрошено подтверждение удаления {len(chats_to_delete_full)} чатов и сообщений в {len(msgs_to_delete_dict)} чатах.")
+    await message.answer(response); logger.info(f"aiogram: запрошено подтверждение удаления {len(chats_to_delete_full)} чатов и сообщений в {len(msgs_to_delete_chat_ids)} чатах.")
 
 
 # --- Обработчик подтверждения удаления (/delete) ---
@@ -219,58 +251,66 @@ async def confirm_delete_actions(message: Message, state: FSMContext):
         logger.error(f"Критическая ошибка: не удалось получить диспетчер для FSM: {e}")
         await message.answer("Внутренняя ошибка: не удалось получить доступ к хранилищу состояний.")
         await state.clear()
-        analysis_cache["is_busy"] = False # Освобождаем на всякий случай
         return
 
-    if analysis_cache["is_busy"]: await message.answer("Бот занят."); return
-
     user_data = await state.get_data()
     chats_to_delete_full = user_data.get("chats_to_delete_full", [])
-    msgs_to_delete_dict = user_data.get("msgs_to_delete_dict", {})
+    msgs_to_delete_chat_ids = user_data.get("msgs_to_delete_chat_ids", [])
     await state.clear()
+    # id сообщений и сведения об истории - из хранилища анализов (в FSM только id чатов)
+    store = get_analysis_store()
+    run_id = user_data.get("run_id")
+    msgs_to_delete_dict = store.trigger_ids(run_id, msgs_to_delete_chat_ids) if run_id is not None and msgs_to_delete_chat_ids else {}
+    history = store.history(run_id, msgs_to_delete_dict) if msgs_to_delete_dict else {}
 
     if not chats_to_delete_full and not msgs_to_delete_dict:
         await message.answer("Ошибка: не найдены объекты для удаления."); logger.warning("aiogram: нет объектов в FSM.")
         return
 
-    tasks_to_run = []
+    chat_id, user_id = message.chat.id, message.from_user.id
+    # (вид, название, функция задачи, ключи): задачи с общими ключами (тот же вид удаления или те же чаты) не запускаются
+    jobs_to_start = []
     if chats_to_delete_full:
         logger.warning(f"aiogram: подтверждено удаление {len(chats_to_delete_full)} чатов.")
-        # Передаем dp в фоновую задачу
-        tasks_to_run.append(run_chat_deletion_background(dp, message.chat.id, message.from_user.id, chats_to_delete_full))
+        keys = {DELETION_KEYS["chat"]} | {chat_key(chat["id"]) for chat in chats_to_delete_full}
+        jobs_to_start.append(("delete_chats", "Удаление чатов",
+                              lambda job: run_chat_deletion_background(dp, chat_id, user_id, chats_to_delete_full, job), keys))
 
     if msgs_to_delete_dict:
         total_msgs = sum(len(ids) for ids in msgs_to_delete_dict.values())
         logger.warning(f"aiogram: подтверждено удаление {total_msgs} сообщений в {len(msgs_to_delete_dict)} чатах.")
-        # Передаем dp в фоновую задачу
-        tasks_to_run.append(run_message_deletion_background(dp, message.chat.id, message.from_user.id, msgs_to_delete_dict))
+        keys = {DELETION_KEYS["messages"]} | {chat_key(peer_id) for peer_id in msgs_to_delete_dict}
+        jobs_to_start.append(("delete_messages", "Удаление сообщений",
+                              lambda job: run_message_deletion_background(dp, chat_id, user_id, msgs_to_delete_dict, history, job), keys))
 
-    if tasks_to_run:
-        await message.answer(f"Подтверждено. Запускаю {len(tasks_to_run)} фоновых задач удаления...")
-        # Запускаем задачи. is_busy будет установлен внутри них.
-        for task in tasks_to_run:
-            asyncio.create_task(task)
-    else: await message.answer("Нет действий для выполнения.")
+    if not jobs_to_start: await message.answer("Нет действий для выполнения."); return
+    lines = []
+    for kind, title, job_func, keys in jobs_to_start:
+        try:
+            job = job_manager.start(kind, title, job_func, keys=keys)
+            lines.append(f"{title}: задача #{job.id} (остановить: <code>/stop {job.id}</code>)")
+        except JobConflict as e:
+            lines.append(f"{title}: не запущено - занято задачей #{e.job.id} ({html_decoration.quote(e.job.title)})")
+    await message.answer("Подтверждено.\n" + "\n".join(lines))
 
 
 # --- Команда /deletecontacts и её подтверждение ---
 @router.message(Command("deletecontacts"), StateFilter(None))
 async def cmd_delete_contacts(message: Message, state: FSMContext):
     # показать кандидатов на удаление контактов (код как раньше)
-    global analysis_cache
-    if analysis_cache["is_busy"]: await message.answer("Бот занят."); return
-    analysis_cache["is_busy"] = True
+    running = job_manager.conflict({DELETION_KEYS["contacts"]})
+    if running: await message.answer(f"Контакты уже удаляются (задача #{running.id})."); return
     await message.answer("Получаю контакты через Telethon...")
     logger.info("aiogram: запрошено /deletecontacts")
     try:
         get_telethon_client()
-        if not analysis_cache.get("permanent_whitelist_ids"): # Проверка наличия ключа
-             analysis_cache["whitelist_names"] = utils.load_list_from_file(config.WHITELIST_FILE)
+        whitelist = get_whitelist_index()
+        if not analysis_cache.get("permanent_whitelist_ids") or analysis_cache.get("whitelist_names") is not whitelist: # нет id или white_list.txt изменился
+             analysis_cache["whitelist_names"] = whitelist
              analysis_cache["permanent_whitelist_ids"] = await analyzer.find_whitelisted_ids(analysis_cache["whitelist_names"])
         contacts_to_delete = await actions.get_contacts_for_deletion(analysis_cache.get("permanent_whitelist_ids", set()))
         if not contacts_to_delete:
-            await message.answer("Контактов для удаления нет."); logger.info("aiogram: нет контактов для удаления.")
-            analysis_cache["is_busy"] = False; return
+            await message.answer("Контактов для удаления нет."); logger.info("aiogram: нет контактов для удаления."); return
         response = f"<b>Найдено {len(contacts_to_delete)} контактов для удаления:</b>\n\n"
         for idx, user in enumerate(contacts_to_delete[:20]):
             display_name = await utils.get_user_display_name(user); username = f"(@{user.username})" if user.username else ""
@@ -280,30 +320,111 @@ async def cmd_delete_contacts(message: Message, state: FSMContext):
         response += f"\n<b>!!! ВНИМАНИЕ !!!</b> Удаление контактов <b>НЕОБРАТИМО</b>!\nДля подтверждения отправьте:\n<code>{config.CONTACT_DELETION_CONFIRMATION_PHRASE}</code>\nИли <code>/cancel</code> для отмены."
         await state.update_data(contacts_to_delete=contacts_to_delete); await state.set_state(DeletionStates.pending_contact_deletion)
         await message.answer(response); logger.warning(f"aiogram: запрошено подтверждение удаления {len(contacts_to_delete)} контактов.")
-    except ConnectionError as e: logger.error(f"ошибка telethon при получении контактов: {e}"); await message.answer(f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}"); analysis_cache["is_busy"] = False
-    except Exception as e: logger.exception("aiogram: ошибка при получении контактов"); await message.answer(f"<b>Ошибка получения контактов:</b>\n{html_decoration.quote(str(e))}"); analysis_cache["is_busy"] = False
+    except ConnectionError as e: logger.error(f"ошибка telethon при получении контактов: {e}"); await message.answer(f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}")
+    except Exception as e: logger.exception("aiogram: ошибка при получении контактов"); await message.answer(f"<b>Ошибка получения контактов:</b>\n{html_decoration.quote(str(e))}")
 
 @router.message(StateFilter(DeletionStates.pending_contact_deletion), F.text == config.CONTACT_DELETION_CONFIRMATION_PHRASE)
 async def confirm_delete_contacts(message: Message, state: FSMContext):
     # подтверждение удаления контактов
-    global analysis_cache
     try: # Получаем dp
         dp = Dispatcher.get_current()
         if not dp: raise RuntimeError("Не удалось получить диспетчер")
     except Exception as e:
         logger.error(f"Критическая ошибка: не удалось получить диспетчер для FSM: {e}")
         await message.answer("Внутренняя ошибка: не удалось получить доступ к хранилищу состояний.")
-        await state.clear(); analysis_cache["is_busy"] = False; return
+        await state.clear(); return
 
-    # is_busy уже True
     user_data = await state.get_data(); contacts_to_delete = user_data.get("contacts_to_delete"); await state.clear()
     if not contacts_to_delete:
         await message.answer("Ошибка: не найден список контактов."); logger.warning("aiogram: нет contacts_to_delete в FSM.")
-        analysis_cache["is_busy"] = False; return
-    await message.answer(f"Подтверждено. Запускаю <b>НЕОБРАТИМОЕ</b> удаление {len(contacts_to_delete)} контактов...")
+        return
+    chat_id, user_id = message.chat.id, message.from_user.id
+    try:
+        job = job_manager.start("delete_contacts", "Удаление контактов",
+                                lambda job: run_contact_deletion_background(dp, chat_id, user_id, contacts_to_delete, job),
+                                keys={DELETION_KEYS["contacts"]})
+    except JobConflict as e:
+        await message.answer(f"Не запущено: контакты уже удаляются (задача #{e.job.id})."); return
+    await message.answer(f"Подтверждено. Запускаю <b>НЕОБРАТИМОЕ</b> удаление {len(contacts_to_delete)} контактов (задача #{job.id}, остановить: <code>/stop {job.id}</code>)...")
     logger.warning(f"!!! aiogram: ПОДТВЕРЖДЕНО УДАЛЕНИЕ {len(contacts_to_delete)} КОНТАКТОВ !!!")
-    # Передаем dp в фоновую задачу
-    asyncio.create_task(run_contact_deletion_background(dp, message.chat.id, message.from_user.id, contacts_to_delete))
+
+
+# --- Очередь удаления: возобновление после перезапуска и /retryfailed ---
+QUEUE_KIND_TITLES = {"chat": "Чаты", "messages": "Сообщения", "contacts": "Контакты"}
+
+async def run_queue_background(chat_id_to_notify: int, title: str, job=None):
+    # выполняет все pending-элементы постоянной очереди удаления
+    cancel_token = job.cancel if job else None
+    try:
+        get_telethon_client()
+        summary = []
+        for kind in get_deletion_queue().pending_kinds():
+            runner = actions.QUEUE_RUNNERS.get(kind)
+            if runner is None: continue
+            if cancel_token is not None and cancel_token.is_set():
+                get_deletion_queue().cancel_pending(kind) # до этого вида удаления очередь не дошла
+                continue
+            progress = ProgressReporter(chat_id_to_notify, f"{title}: {QUEUE_KIND_TITLES.get(kind, kind).lower()}")
+            if job: job.progress = progress
+            try:
+                results = await runner(None, progress, cancel_token)
+            finally:
+                await progress.finish()
+            forget_scanned(results.get("deleted_ids", set()) | results.get("chat_ids", set()))
+            mark_in_report(results)
+            summary.append(f"{QUEUE_KIND_TITLES.get(kind, kind)}: удалено {results.get('deleted', 0)}, ошибок {results.get('failed', 0)}")
+        dead = sum(kind_counts.get("dead", 0) for kind_counts in get_deletion_queue().counts().values())
+        text = f"{title} {'остановлено' if cancel_token is not None and cancel_token.is_set() else 'завершено'}.\n" + ("\n".join(summary) or "Нечего выполнять.")
+        if dead: text += f"\nНе удалось выполнить: {dead} (повтор: <code>/retryfailed</code>)"
+        await send_with_report(chat_id_to_notify, text)
+    except ConnectionError as e:
+        logger.error(f"ошибка telethon при выполнении очереди удаления: {e}")
+        await bot.send_message(chat_id_to_notify, f"<b>Ошибка:</b> Клиент Telethon не активен.\n{html_decoration.quote(str(e))}")
+    except Exception as e:
+        logger.exception("aiogram: ошибка выполнения очереди удаления")
+        await bot.send_message(chat_id_to_notify, f"<b>Ошибка очереди удаления:</b>\n{html_decoration.quote(str(e))}")
+
+
+def start_queue_job(chat_id_to_notify: int, title: str):
+    # выполнение очереди затрагивает все виды удаления; JobConflict, если какое-то уже идет
+    return job_manager.start("deletion_queue", title, lambda job: run_queue_background(chat_id_to_notify, title, job),
+                             keys=set(DELETION_KEYS.values()))
+
+
+async def resume_deletion_queue():
+    # вызывается при старте: дочищает то, что не успели удалить до падения/перезапуска
+    queue = get_deletion_queue()
+    interrupted = queue.requeue_interrupted()
+    queue.prune()
+    pending = {kind: kind_counts.get("pending", 0) for kind, kind_counts in queue.counts().items() if kind_counts.get("pending")}
+    if not pending: return
+    logger.warning(f"aiogram: возобновляю очередь удаления: {pending} (прервано: {interrupted})")
+    details = ", ".join(f"{QUEUE_KIND_TITLES.get(kind, kind)}: {count}" for kind, count in pending.items())
+    try:
+        await bot.send_message(config.ADMIN_ID, f"Найдена незавершенная очередь удаления ({details}). Продолжаю...")
+    except Exception as e:
+        logger.warning(f"не удалось уведомить о возобновлении очереди удаления: {e}")
+    await start_queue_job(config.ADMIN_ID, "Возобновленное удаление").task
+
+
+@router.message(Command("retryfailed"), StateFilter(None))
+async def cmd_retry_failed(message: Message):
+    # повтор элементов из dead-letter списка (и оставшихся pending)
+    running = job_manager.conflict(DELETION_KEYS.values())
+    if running: await message.answer(f"Занято: идет задача #{running.id} ({html_decoration.quote(running.title)})."); return
+    queue = get_deletion_queue()
+    dead_items = queue.dead_items(limit=10)
+    retried = queue.retry_dead()
+    pending = sum(kind_counts.get("pending", 0) for kind_counts in queue.counts().values())
+    if not pending:
+        await message.answer("Очередь удаления пуста, повторять нечего."); return
+    response = f"Повторяю элементов очереди: {pending} (из них неудачных: {retried}).\n"
+    for item in dead_items:
+        response += f"\n• {QUEUE_KIND_TITLES.get(item.kind, item.kind)} {item.chat_id or ''} - <i>{html_decoration.quote(item.last_error or '')}</i>"
+    await message.answer(response)
+    job = start_queue_job(message.chat.id, "Повторное удаление")
+    await message.answer(f"Задача #{job.id}, остановить: <code>/stop {job.id}</code>")
+    logger.warning(f"aiogram: /retryfailed, повтор {pending} элементов очереди удаления (задача #{job.id}).")
 
 
 
@@ -311,12 +432,10 @@ async def confirm_delete_contacts(message: Message, state: FSMContext):
 @router.callback_query(StateFilter(DeletionStates.confirm_cleanup_stop), F.data == "confirm_cleanup_stop")
 async def handle_confirm_cleanup_stop(callback_query: CallbackQuery, state: FSMContext):
     """Обрабатывает подтверждение очистки и остановки."""
-    global analysis_cache
     user_data = await state.get_data()
     prompt_msg_id = user_data.get("cleanup_prompt_msg_id")
     final_status_msg_id = user_data.get("final_status_msg_id")
     await state.clear()
-    analysis_cache["is_busy"] = False # Считаем операцию завершенной
 
     await callback_query.answer("Остановка бота...") # Ответ на колбек
     logger.warning(f"Пользователь {callback_query.from_user.id} подтвердил очистку и остановку.")
@@ -342,11 +461,9 @@ async def handle_confirm_cleanup_stop(callback_query: CallbackQuery, state: FSMC
 @router.callback_query(StateFilter(DeletionStates.confirm_cleanup_stop), F.data == "cancel_cleanup")
 async def handle_cancel_cleanup(callback_query: CallbackQuery, state: FSMContext):
     """Обрабатывает отмену очистки и остановки."""
-    global analysis_cache
     user_data = await state.get_data()
     prompt_msg_id = user_data.get("cleanup_prompt_msg_id")
     await state.clear()
-    analysis_cache["is_busy"] = False # Считаем операцию завершенной
 
     await callback_query.answer("Отменено") # Ответ на колбек
     logger.info(f"Пользователь {callback_query.from_user.id} отменил очистку и остановку.")
@@ -363,9 +480,7 @@ async def handle_cancel_cleanup(callback_query: CallbackQuery, state: FSMContext
 @router.message(StateFilter(DeletionStates.confirm_cleanup_stop))
 async def handle_text_while_confirming_cleanup(message: Message, state: FSMContext):
     """Ловит текстовые сообщения в состоянии ожидания подтверждения очистки."""
-    global analysis_cache
     await state.clear()
-    analysis_cache["is_busy"] = False
     await message.answer("Ожидалось нажатие кнопки. Операция очистки и остановки отменена.")
     logger.info("Операция очистки/остановки отменена из-за текстового сообщения.")
 
@@ -0,0 +1,77 @@
+# benchmarks/normalize_speed.py
+# скорость нормализации текста: прежний clean_text_for_matching (str.maketrans на каждый вызов) против normalizer
+#
+# запуск из корня проекта:
+#   python benchmarks/normalize_speed.py                  # 200k сообщений по ~120 символов
+#   python benchmarks/normalize_speed.py --messages 50000 --batch 500
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon_client.normalizer import normalize_text, normalize_batch
+from telethon_client.matcher import TermMatcher
+
+
+def legacy_clean(text):
+    # как было в telethon_client/utils.py
+    if not text: return ""
+    text_lower = text.lower()
+    translator = str.maketrans('', '', string.punctuation.replace('-', ''))
+    return text_lower.translate(translator)
+
+
+WORDS = ["привет", "как", "дела", "дроп", "мамонт", "обычный", "текст", "канал", "ok", "Ссылка:", "—", "🔥", "дpoп", "ЁЛКА", "кто-то", "https://t.me/x"]
+
+
+def build_messages(count, seed=1):
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 25))) for _ in range(count)]
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="нормализация текста: прежняя очистка против normalizer")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=200, help="размер пачки для normalize_batch (как MATCH_BATCH_SIZE)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages)
+    batches = [messages[i:i + args.batch] for i in range(0, len(messages), args.batch)]
+    matcher = TermMatcher(["дроп", "мамонт", "как дела", "елка"])
+    # первый вариант в группе - прежний способ, с ним сравниваются остальные
+    groups = (
+        ("очистка", (
+            ("legacy clean_text", lambda: [legacy_clean(text) for text in messages]),
+            ("normalize_text", lambda: [normalize_text(text) for text in messages]),
+            ("normalize_batch", lambda: [normalize_batch(batch) for batch in batches]),
+        )),
+        ("очистка + поиск", (
+            ("legacy clean + find", lambda: [matcher.find(legacy_clean(text)) for text in messages]),
+            ("match", lambda: [matcher.match(text) for text in messages]),
+            ("match_batch", lambda: [matcher.match_batch(batch) for batch in batches]),
+        )),
+    )
+    print(f"{args.messages} сообщений, средняя длина {sum(map(len, messages)) / len(messages):.0f} символов, пачка {args.batch}")
+    for title, cases in groups:
+        print(f"{title}:")
+        baseline = None
+        for name, func in cases:
+            best = min(timed(func) for _ in range(args.repeat))
+            per_message = best / args.messages * 1e6
+            if baseline is None: baseline = per_message
+            print(f"  {name:<20} {per_message:>8.2f} мкс/сообщение ({baseline / per_message:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
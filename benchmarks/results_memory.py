@@ -0,0 +1,59 @@
+# benchmarks/results_memory.py
+# сравнение памяти: {chat_id: [int, ...]} + список словарей против AnalysisResults (array('q') + __slots__)
+#
+# запуск из корня проекта:
+#   python benchmarks/results_memory.py                   # 10k чатов x 10k сообщений (с экстраполяцией)
+#   python benchmarks/results_memory.py --sample 0        # построить все целиком (нужно много памяти)
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon_client.results import AnalysisResults, ChatResult, id_buffer
+
+
+def build_legacy(chats, ids_per_chat):
+    analysis_results, messages_with_triggers = [], {}
+    for chat_id in range(chats):
+        analysis_results.append({"id": -1000000000000 - chat_id, "title": f"chat {chat_id}", "count": ids_per_chat,
+                                 "message_count": ids_per_chat, "found_triggers": ["дроп", "мамонт"], "is_whitelisted": False})
+        messages_with_triggers[-1000000000000 - chat_id] = list(range(1000000, 1000000 + ids_per_chat))
+    return analysis_results, messages_with_triggers
+
+
+def build_compact(chats, ids_per_chat):
+    results = AnalysisResults()
+    for chat_id in range(chats):
+        results.add_chat(ChatResult(-1000000000000 - chat_id, f"chat {chat_id}", ids_per_chat, ids_per_chat, ("дроп", "мамонт")),
+                         id_buffer(range(1000000, 1000000 + ids_per_chat)))
+    return results
+
+
+def measure(builder, chats, ids_per_chat):
+    tracemalloc.start()
+    obj = builder(chats, ids_per_chat)
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="память результатов анализа: старый формат против AnalysisResults")
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--ids", type=int, default=10_000, help="id сообщений с триггерами на чат")
+    parser.add_argument("--sample", type=int, default=100, help="сколько чатов строить реально (0 = все), остальное экстраполируется")
+    args = parser.parse_args()
+
+    built = args.chats if args.sample <= 0 else min(args.sample, args.chats)
+    scale = args.chats / built
+    print(f"{args.chats} чатов x {args.ids} id (построено {built} чатов, множитель {scale:g})")
+    for name, builder in (("dict + list[int]", build_legacy), ("AnalysisResults", build_compact)):
+        size = measure(builder, built, args.ids) * scale
+        print(f"  {name:<18} {size / 1024 / 1024:>10.1f} MiB ({size / (args.chats * args.ids):.1f} байт на id)")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,10 +15,49 @@ TERMS_FILE = 'terms.txt'
 WHITELIST_FILE = 'white_list.txt'
 REPORTS_DIR = 'reports'
 REPORT_FILENAME_TEMPLATE = os.path.join(REPORTS_DIR, 'svoboda_report_{timestamp}.html')
+REPORT_GZIP = False # отчет сохраняется и отправляется сжатым (.html.gz): большие отчеты в разы меньше
+REPORT_WRITE_BUFFER = 1024 * 1024 # байт буфера записи отчета на диск
+REPORT_PARTIAL_ROWS = 200 # строк, после которых частичный отчет дописывается на диск во время анализа
+REPORT_VIRTUAL_MIN_CHATS = 2000 # больше чатов - таблица отчета строится в браузере из JSON (виртуальная прокрутка, фильтры); 0 - всегда
+EXPORT_FILENAME_TEMPLATE = os.path.join(REPORTS_DIR, 'svoboda_export_{timestamp}.{ext}') # /export: jsonl, csv, svsnap
+SCAN_STATE_FILE = 'scan_state.json' # отметки инкрементального анализа по чатам
+ENTITY_CACHE_FILE = 'entity_cache.json' # названия и access_hash чатов/пользователей
+DELETION_QUEUE_DB = 'deletion_queue.sqlite3' # постоянная очередь удаления (возобновляется после перезапуска)
+DELETION_RETRY_BACKOFF = 5.0 # сек паузы перед повторным проходом по временно неудавшимся удалениям (удваивается с каждым проходом)
+ANALYSIS_STORE_DB = 'analysis_store.sqlite3' # итоги анализов: кандидаты на удаление, id сообщений (переживают перезапуск)
+ANALYSIS_STORE_KEEP_RUNS = 3 # сколько последних анализов хранить
+ANALYSIS_STORE_BATCH = 500 # чатов в одной транзакции записи итогов во время анализа (столько держится в памяти)
+ANALYSIS_CHECKPOINT_FILE = 'analysis_checkpoint.jsonl' # контрольная точка анализа (/analyze resume)
+CONTACTS_SNAPSHOT_FILE = 'contacts_snapshot.json' # последний список контактов и его hash (GetContacts без изменений не загружается)
+LIST_INDEX_SUFFIX = '.index' # скомпилированный индекс terms.txt/white_list.txt рядом с файлом (terms.txt.index)
 
 # --- настройки анализа (telethon) ---
 DELETION_THRESHOLD = 3
+DELETION_POLICY = "count" # порог по умолчанию: "count" - больше DELETION_THRESHOLD триггеров, "density" - доля (меняется командой /threshold)
+DENSITY_THRESHOLD = 0.02 # для "density": триггеров на одно просмотренное сообщение, выше - чат удаляется целиком
 FETCH_MESSAGE_LIMIT = 500 # None = все
+ANALYSIS_CONCURRENCY = 1 # сколько чатов сканировать одновременно (1 = последовательно)
+FLOOD_WAIT_RESCANS = 2 # сколько раз сканировать чат заново после floodwait посреди загрузки (дальше число триггеров - нижняя оценка)
+INCREMENTAL_ANALYSIS = True # при повторном /analyze дочитывать только новые сообщения
+SCAN_STRATEGY = "full" # "full" - загрузка истории, "search" - серверный поиск по триггерам, "auto" - выбор для каждого чата
+MATCH_WORKERS = 0 # поиск триггеров в отдельных процессах: 0 = в основном потоке, -1 = по числу ядер
+MATCH_EXECUTOR = "process" # "process" или "thread"
+MATCH_BATCH_SIZE = 200 # сообщений в одной пачке для пула поиска
+MATCH_CACHE_BYTES = 32 * 1024 * 1024 # кэш совпадений по тексту (пересланный спам проверяется один раз), 0 = выключен
+DUPLICATE_MIN_CHATS = 3 # в отчет попадают тексты с триггерами, встреченные хотя бы в стольких чатах
+SAMPLE_PRESCAN = False # двухфазный анализ: сначала выборка последних сообщений всех чатов, полностью - только подозрительные
+SAMPLE_SIZE = 50 # сообщений в выборке одного чата
+SAMPLE_BATCH = 10 # запросов GetHistory в одном контейнере
+SAMPLE_SUSPICION = 0.0 # доля сообщений с триггерами в выборке, выше которой чат сканируется полностью
+EARLY_STOP_SCAN = False # прекращать загрузку чата, как только триггеров больше DELETION_THRESHOLD (число в отчете - нижняя оценка)
+CHECKPOINT_FLUSH_EVERY = 5 # сбрасывать контрольную точку на диск раз в столько чатов
+CHECKPOINT_POSITION_MESSAGES = 2000 # в длинном чате сохранять позицию каждые столько сообщений
+
+# --- темп запросов telethon ---
+RATE_LIMITS = {} # переопределение начальной скорости по методам, например {"DeleteMessages": (1.25, 2)} - (запросов/с, пачка)
+
+# --- прогресс задач (aiogram) ---
+PROGRESS_UPDATE_INTERVAL = 3.0 # не чаще одной правки сообщения о прогрессе за столько секунд
 
 # --- фразы подтверждения (aiogram) ---
 CHAT_DELETION_CONFIRMATION_PHRASE = "ДА ПОДТВЕРЖДАЮ УДАЛЕНИЕ ЧАТОВ"
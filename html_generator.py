@@ -74,46 +74,47 @@ def generate_html_report(analysis_results, permanent_whitelist_ids, permanent_wh
         -x['count']
     ))
 
-    for i, chat_info in enumerate(analysis_results):
-        chat_id = chat_info['id']
-        title = chat_info['title']
-        count = chat_info['count']
-        found_triggers = chat_info.get('found_triggers', set())
-        msg_count = chat_info['message_count']
-        is_permanent_whitelist = chat_id in permanent_whitelist_ids
-        is_candidate = count > DELETION_THRESHOLD and not is_permanent_whitelist
-        is_deleted = chat_id in final_deleted_ids
+    try:
+        # документ пишется в файл по частям: шапка, строки по одной, подвал - целиком в памяти не собирается
+        with open(REPORT_FILE, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+            f.write(html)
+            for i, chat_info in enumerate(analysis_results):
+                chat_id = chat_info['id']
+                title = chat_info['title']
+                count = chat_info['count']
+                found_triggers = chat_info.get('found_triggers', set())
+                msg_count = chat_info['message_count']
+                is_permanent_whitelist = chat_id in permanent_whitelist_ids
+                is_candidate = count > DELETION_THRESHOLD and not is_permanent_whitelist
+                is_deleted = chat_id in final_deleted_ids
 
-        status_text = ""
-        status_class = ""
-        if is_deleted:
-            status_text = "УДАЛЕН"
-            status_class = "deleted danger-high"
-        elif is_permanent_whitelist:
-            status_text = "Белый список (сохранен)"
-            status_class = "whitelist"
-        elif is_candidate:
-            status_text = f"Кандидат >{DELETION_THRESHOLD} (сохранен)"
-            status_class = "kept danger-high"
-        elif count > 0 :
-             status_text = f"Триггеры <= {DELETION_THRESHOLD} (сохранен)"
-             status_class = "kept danger-medium"
-        else:
-             status_text = "Нет триггеров (сохранен)"
-             status_class = "kept neutral"
+                status_text = ""
+                status_class = ""
+                if is_deleted:
+                    status_text = "УДАЛЕН"
+                    status_class = "deleted danger-high"
+                elif is_permanent_whitelist:
+                    status_text = "Белый список (сохранен)"
+                    status_class = "whitelist"
+                elif is_candidate:
+                    status_text = f"Кандидат >{DELETION_THRESHOLD} (сохранен)"
+                    status_class = "kept danger-high"
+                elif count > 0 :
+                     status_text = f"Триггеры <= {DELETION_THRESHOLD} (сохранен)"
+                     status_class = "kept danger-medium"
+                else:
+                     status_text = "Нет триггеров (сохранен)"
+                     status_class = "kept neutral"
 
-        danger_class = "neutral"
-        if count > DELETION_THRESHOLD: danger_class = "danger-high"
-        elif 1 <= count <= DELETION_THRESHOLD: danger_class = "danger-medium"
-        elif count == 0 and msg_count > 0: danger_class = "danger-low"
+                danger_class = "neutral"
+                if count > DELETION_THRESHOLD: danger_class = "danger-high"
+                elif 1 <= count <= DELETION_THRESHOLD: danger_class = "danger-medium"
+                elif count == 0 and msg_count > 0: danger_class = "danger-low"
 
-        triggers_str = ', '.join(sorted(list(found_triggers))) if found_triggers else 'Нет'
-        html += f"""<tr class="{status_class}"><td>{i+1}</td><td>{title}</td><td>{chat_id}</td><td class="{danger_class}">{count}</td><td class="trigger-list">{triggers_str}</td><td>{status_text}</td></tr>"""
+                triggers_str = ', '.join(sorted(list(found_triggers))) if found_triggers else 'Нет'
+                f.write(f"""<tr class="{status_class}"><td>{i+1}</td><td>{title}</td><td>{chat_id}</td><td class="{danger_class}">{count}</td><td class="trigger-list">{triggers_str}</td><td>{status_text}</td></tr>""")
 
-    html += """</tbody></table></div></body></html>"""
-    try:
-        with open(REPORT_FILE, 'w', encoding='utf-8') as f:
-            f.write(html)
+            f.write("""</tbody></table></div></body></html>""")
         logger.info(f"html-отчет сохранен: {REPORT_FILE}")
         return REPORT_FILE # возвращаем имя файла для отправки
     except Exception as e:
@@ -13,6 +13,9 @@ import config
 from aiogram_bot.bot_instance import bot
 from aiogram_bot.dispatcher import dp
 from telethon_client.client_instance import init_telethon_client, stop_telethon_client
+from telethon_client.entity_cache import warm_up_entity_cache
+from telethon_client.term_index import get_term_index, get_whitelist_index
+from aiogram_bot.routers.deletion import resume_deletion_queue
 
 import shared_state
 
@@ -57,34 +60,47 @@ async def main():
         os.makedirs(config.REPORTS_DIR, exist_ok=True)
     except OSError as e:
          logger.error(f"Не удалось создать папку {config.REPORTS_DIR}: {e}")
+    # индексы списков: из файлов .index, если terms.txt/white_list.txt не менялись
+    logger.info(f"триггеров: {len(get_term_index())}, в белом списке: {len(get_whitelist_index())}.")
 
 
     # инициализация telethon
     try:
-        await init_telethon_client()
+        client = await init_telethon_client()
     except Exception as e:
         logger.critical(f"не удалось инициализировать telethon: {e}")
         return
+    background_tasks = [
+        # прогрев кэша сущностей одним проходом по диалогам (в фоне, не задерживает запуск)
+        asyncio.create_task(warm_up_entity_cache(client)),
+        # незавершенная очередь удаления (после падения/перезапуска) продолжается сама
+        asyncio.create_task(resume_deletion_queue()),
+    ]
 
-    # запуск aiogram polling
-    logger.info("запуск aiogram polling...")
-    polling_task = asyncio.create_task(dp.start_polling(bot, skip_updates=True))
-    # Ждем сигнала на остановку
-    await shared_state.shutdown_event.wait()
-    logger.info("получен сигнал на остановку...")
-
-    # корректное завершение
-    logger.info("остановка polling...")
-    polling_task.cancel()
     try:
-        await polling_task
-    except asyncio.CancelledError:
-        logger.info("polling task отменен.")
-
-    logger.info("остановка бота...")
-    await stop_telethon_client()
-    await bot.session.close()
-    logger.info("бот остановлен.")
+        # запуск aiogram polling
+        logger.info("запуск aiogram polling...")
+        polling_task = asyncio.create_task(dp.start_polling(bot, skip_updates=True))
+        # Ждем сигнала на остановку
+        await shared_state.shutdown_event.wait()
+        logger.info("получен сигнал на остановку...")
+
+        # корректное завершение
+        logger.info("остановка polling...")
+        polling_task.cancel()
+        try:
+            await polling_task
+        except asyncio.CancelledError:
+            logger.info("polling task отменен.")
+    finally:
+        # фоновые задачи запуска не должны пережить клиент: прерванное удаление продолжится при следующем запуске
+        for task in background_tasks: task.cancel()
+        for result in await asyncio.gather(*background_tasks, return_exceptions=True):
+            if isinstance(result, Exception): logger.error(f"ошибка фоновой задачи запуска: {result}")
+        logger.info("остановка бота...")
+        await stop_telethon_client()
+        await bot.session.close()
+        logger.info("бот остановлен.")
 
 
 if __name__ == "__main__":
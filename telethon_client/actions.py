@@ -1,203 +1,385 @@
 # telethon_client/actions.py
 import asyncio
 import logging
+import config
 from telethon import errors, functions
 from telethon.tl.types import User, InputUser, InputPeerUser
 
 from .client_instance import get_telethon_client
-from .utils import get_user_display_name, get_entity_title
+from .utils import get_user_display_name
+from .entity_cache import get_entity_cache
+from .rate_limiter import rate_limiter
+from .deletion_queue import get_deletion_queue, MAX_ATTEMPTS
+from .contact_snapshot import get_contact_snapshot
+from .deletion_planner import plan_message_deletion, plan_totals
 
 logger = logging.getLogger(__name__)
 
+CONTACT_PIPELINE_DEPTH = 3 # сколько пачек DeleteContacts в работе одновременно
 
-async def delete_chats_job(chat_ids_to_delete: list[int], status_callback=None):
 
+def _report(status_callback, total=None, done=0, failed=0):
+    # счетчики для ProgressReporter (aiogram_bot/progress.py); простой текстовый колбек их не принимает
+    update = getattr(status_callback, "update", None)
+    if update: update(total=total, done=done, failed=failed)
+
+
+def _cancelled(cancel_token):
+    # cancel_token - asyncio.Event задачи (aiogram_bot/jobs.py); невыполненные элементы остаются в очереди
+    return cancel_token is not None and cancel_token.is_set()
+
+
+async def _pause(cancel_token, seconds):
+    # пауза между проходами; True - задачу остановили во время паузы
+    if cancel_token is None:
+        await asyncio.sleep(seconds)
+        return False
+    try:
+        await asyncio.wait_for(cancel_token.wait(), seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+class _QueuePasses:
+    """
+    Выборка элементов задания проходами: внутри прохода элементы идут по возрастанию id
+    (неудачный элемент не повторяется сразу же), временно неудавшиеся (снова pending)
+    повторяются следующим проходом после паузы DELETION_RETRY_BACKOFF (удваивается),
+    всего не больше MAX_ATTEMPTS проходов. Один объект на задание - общий для всех воркеров.
+    """
+
+    def __init__(self, queue, kind, batch, cancel_token):
+        self.queue = queue
+        self.kind = kind
+        self.batch = batch
+        self.cancel_token = cancel_token
+        self.number = 1 # номер текущего прохода
+        self._last_id = 0
+        self._lock = asyncio.Lock()
+
+    async def next(self):
+        # следующий элемент (уже running) или None, если задание закончено или остановлено
+        async with self._lock:
+            while not _cancelled(self.cancel_token):
+                item = self.queue.claim_next(self.kind, self.batch, self._last_id)
+                if item is not None:
+                    self._last_id = item.id
+                    return item
+                pending = self.queue.counts(self.batch).get(self.kind, {}).get("pending", 0)
+                if not pending or self.number >= MAX_ATTEMPTS: return None
+                delay = config.DELETION_RETRY_BACKOFF * 2 ** (self.number - 1)
+                logger.warning(f"telethon: {pending} элементов '{self.kind}' не удались временно, повтор через {delay:g}с (проход {self.number + 1}/{MAX_ATTEMPTS}).")
+                if await _pause(self.cancel_token, delay): return None
+                self.number += 1
+                self._last_id = 0
+            return None
+
+    def finish(self):
+        # невыполненное к концу задания - в dead (повтор только через /retryfailed), а не в автоматическое возобновление
+        stopped = _cancelled(self.cancel_token)
+        left = self.queue.cancel_pending(self.kind, self.batch, "остановлено" if stopped else "не удалось за все проходы")
+        if left and not stopped: logger.warning(f"telethon: {left} элементов '{self.kind}' не выполнены за задание, отложены в /retryfailed.")
+        return stopped
+
+
+async def delete_chats_job(chat_ids_to_delete: list[int], status_callback=None, cancel_token=None):
+    # ставит чаты в постоянную очередь и выполняет их
+    batch = get_deletion_queue().enqueue_chats(chat_ids_to_delete)
+    return await run_chat_items(batch, status_callback, cancel_token)
+
+
+async def run_chat_items(batch=None, status_callback=None, cancel_token=None):
+    # выполняет pending-элементы "chat" из очереди (одного задания или все, если batch=None)
     client = get_telethon_client()
+    queue = get_deletion_queue()
     deleted_count = 0
     failed_count = 0
     deleted_ids = set()
-    total = len(chat_ids_to_delete)
+    total = queue.counts(batch).get("chat", {}).get("pending", 0)
     logger.warning(f"telethon: начинаю удаление {total} чатов...")
-    for i, chat_id in enumerate(chat_ids_to_delete):
-        title = f"ID {chat_id}"
+    _report(status_callback, total=total)
+    entity_cache = get_entity_cache()
+
+    async def flood_notice(seconds):
+        logger.error(f"telethon: floodwait при удалении чатов. жду {seconds}с.")
+        if status_callback: await status_callback(f"FloodWait! Жду {seconds} сек...")
+
+    passes = _QueuePasses(queue, "chat", batch, cancel_token)
+    while (item := await passes.next()) is not None:
+        chat_id = item.chat_id
+        # название и InputPeer из кэша сущностей - без get_entity на каждый чат
+        title = entity_cache.title(chat_id)
+        peer = entity_cache.input_peer(chat_id) or chat_id
         try:
-            try:
-                 entity = await client.get_entity(chat_id)
-                 title = await get_entity_title(entity)
-            except Exception as title_err: logger.debug(f"не удалось получить title для {chat_id}: {title_err}")
-            await client.delete_dialog(chat_id)
+            # темп и повторы после floodwait - в общем планировщике запросов
+            await rate_limiter.call("DeleteDialog", client.delete_dialog, peer, on_flood_wait=flood_notice)
+            queue.mark_done(item)
             logger.info(f"telethon: удален диалог: {title} (id: {chat_id})")
             deleted_count += 1; deleted_ids.add(chat_id)
-            if status_callback: await status_callback(f"Удален ({i+1}/{total}): {title}")
-            await asyncio.sleep(1.2)
+            _report(status_callback, done=1)
+            if status_callback: await status_callback(f"Удален ({deleted_count}/{total}): {title}")
         except errors.FloodWaitError as e:
-            logger.error(f"telethon: floodwait при удалении {title}. жду {e.seconds}с.")
-            if status_callback: await status_callback(f"FloodWait! Жду {e.seconds} сек...")
-            await asyncio.sleep(e.seconds + 1)
-            try: # Повтор
-                await client.delete_dialog(chat_id)
-                logger.info(f"telethon: удален (повторно): {title} (id: {chat_id})")
-                deleted_count += 1; deleted_ids.add(chat_id)
-                if status_callback: await status_callback(f"Удален ({i+1}/{total}) (повторно): {title}")
-                await asyncio.sleep(1.2)
-            except Exception as e_retry:
-                logger.error(f"telethon: ошибка повторного удаления {title}: {e_retry}")
-                failed_count += 1
-                if status_callback: await status_callback(f"Ошибка повторного удаления: {title}")
+            if queue.mark_failed(item, f"FloodWait {e.seconds}s") == "pending":
+                logger.warning(f"telethon: floodwait при удалении {title} ({e.seconds}с), повторю следующим проходом.")
+                continue
+            logger.error(f"telethon: floodwait при удалении {title} не прошел после повторов ({e.seconds}с).")
+            failed_count += 1
+            _report(status_callback, failed=1)
+            if status_callback: await status_callback(f"Ошибка повторного удаления: {title}")
         except Exception as e:
+            if queue.mark_failed(item, f"{type(e).__name__}: {e}") == "pending":
+                logger.warning(f"telethon: ошибка удаления {title}: {e}, повторю следующим проходом.")
+                continue
             logger.error(f"telethon: ошибка удаления {title}: {e}")
             failed_count += 1
+            _report(status_callback, failed=1)
             if status_callback: await status_callback(f"Ошибка удаления: {title} - {type(e).__name__}")
-            await asyncio.sleep(0.5)
-    logger.warning(f"telethon: удаление чатов завершено. удалено: {deleted_count}, ошибок: {failed_count}")
-    return {"deleted": deleted_count, "failed": failed_count, "deleted_ids": deleted_ids}
+    stopped = passes.finish()
+    logger.warning(f"telethon: удаление чатов {'остановлено' if stopped else 'завершено'}. удалено: {deleted_count}, ошибок: {failed_count}")
+    return {"deleted": deleted_count, "failed": failed_count, "deleted_ids": deleted_ids, "stopped": stopped}
 
 
 
-async def delete_messages_job(messages_to_delete: dict[int, list[int]], status_callback=None):
+async def delete_messages_job(messages_to_delete: dict, status_callback=None, history=None, cancel_token=None):
     """
     Удаляет указанные сообщения.
-    messages_to_delete: Словарь {chat_id: [msg_id1, msg_id2, ...]}
+    messages_to_delete: Словарь {chat_id: ids}, где ids - список, array('q') или memoryview на него
+    history: сведения анализа об истории чатов (AnalysisResults.history) - по ним планировщик
+    выбирает массовое удаление истории вместо пачек по 100 id, где это безопасно.
+    Операции плана ставятся в постоянную очередь и выполняются из нее.
     """
+    plans = plan_message_deletion(messages_to_delete, history)
+    rpc_estimate, chunk_rpc = plan_totals(plans)
+    logger.info(f"telethon: план удаления сообщений: ~{rpc_estimate} запросов (пачками по 100: {chunk_rpc}).")
+    batch = get_deletion_queue().enqueue_messages([op for plan in plans.values() for op in plan.ops])
+    _report(status_callback, total=sum(plan.message_count for plan in plans.values()))
+    return await run_message_items(batch, status_callback, cancel_token)
+
+
+async def _run_message_op(client, chat_id, op, on_flood_wait=None):
+    # выполняет одну операцию плана удаления, возвращает число удаленных сообщений
+    entity_cache = get_entity_cache()
+    peer = entity_cache.input_peer(chat_id) or chat_id
+    if op.get("op", "ids") == "ids":
+        # revoke=True удаляет для всех, если есть права (например, в своих сообщениях или как админ)
+        # Если прав нет, удалит только у себя.
+        await rate_limiter.call("DeleteMessages", client.delete_messages, peer, op["ids"], revoke=True, on_flood_wait=on_flood_wait)
+        return len(op["ids"])
+    if op["op"] != "history": raise ValueError(f"неизвестная операция удаления: {op['op']}") # например, из старой очереди
+    request = functions.messages.DeleteHistoryRequest(peer=peer, max_id=op["max_id"], revoke=True)
+    # сервер удаляет историю частями: повторяем, пока возвращается offset
+    while True:
+        affected = await rate_limiter.call("DeleteHistory", client, request, on_flood_wait=on_flood_wait)
+        if not affected.offset: return op["count"]
+
+
+async def run_message_items(batch=None, status_callback=None, cancel_token=None):
+    # выполняет pending-элементы "messages" (операции плана удаления) в порядке постановки
     client = get_telethon_client()
+    queue = get_deletion_queue()
     deleted_count = 0
     failed_count = 0
-    total_messages = sum(len(ids) for ids in messages_to_delete.values())
-    processed_messages = 0
-    logger.warning(f"telethon: начинаю удаление {total_messages} сообщений в {len(messages_to_delete)} чатах...")
-
-    for chat_id, message_ids in messages_to_delete.items():
-        if not message_ids: continue
-        chat_title = f"ID {chat_id}"
-        try: # Пытаемся получить название чата для лога
-            entity = await client.get_entity(chat_id)
-            chat_title = await get_entity_title(entity)
-        except Exception as title_err:
-            logger.debug(f"не удалось получить title для {chat_id} при удалении сообщений: {title_err}")
-
-        logger.info(f"telethon: удаляю {len(message_ids)} сообщений в чате '{chat_title}' (id: {chat_id})...")
-        # Удаляем сообщения пачками по 100 (лимит Telegram)
-        chunk_size = 100
-        chat_deleted_count = 0
-        chat_failed_count = 0
-        for i in range(0, len(message_ids), chunk_size):
-            chunk_ids = message_ids[i:i + chunk_size]
-            processed_messages += len(chunk_ids)
-            progress = f"({processed_messages}/{total_messages})"
-            try:
-                # revoke=True удаляет для всех, если есть права (например, в своих сообщениях или как админ)
-                # Если прав нет, удалит только у себя.
-                await client.delete_messages(chat_id, chunk_ids, revoke=True)
-                logger.debug(f"telethon: удалена пачка {len(chunk_ids)} сообщений в {chat_title} {progress}")
-                deleted_count += len(chunk_ids)
-                chat_deleted_count += len(chunk_ids)
-                if status_callback:
-                    # Не спамим на каждую пачку, сообщим итог по чату
-                    pass
-                await asyncio.sleep(0.8) # Небольшая пауза между пачками
+    chat_ids = set() # чаты, в которых что-то удаляли (для сброса инкрементального состояния)
+    deleted_by_chat = {} # {id чата: удалено сообщений} - для отчета
+    total_ops = queue.counts(batch).get("messages", {}).get("pending", 0)
+    processed_ops = 0
+    logger.warning(f"telethon: начинаю удаление сообщений: {total_ops} операций...")
 
-            except errors.FloodWaitError as e:
-                logger.error(f"telethon: floodwait при удалении сообщений в {chat_title}. жду {e.seconds}с.")
-                if status_callback: await status_callback(f"FloodWait в '{chat_title}'! Жду {e.seconds} сек...")
-                await asyncio.sleep(e.seconds + 1)
-                # Повтор пачки
-                try:
-                    await client.delete_messages(chat_id, chunk_ids, revoke=True)
-                    logger.debug(f"telethon: удалена пачка (повторно) {len(chunk_ids)} в {chat_title} {progress}")
-                    deleted_count += len(chunk_ids)
-                    chat_deleted_count += len(chunk_ids)
-                    await asyncio.sleep(0.8)
-                except Exception as e_retry:
-                    logger.error(f"telethon: ошибка повторного удаления сообщений в {chat_title}: {e_retry}")
-                    failed_count += len(chunk_ids) # Считаем всю пачку ошибкой
-                    chat_failed_count += len(chunk_ids)
-                    if status_callback: await status_callback(f"Ошибка повторного удаления в '{chat_title}'!")
-
-            except errors.MessageDeleteForbiddenError:
-                # Частая ошибка: нет прав удалять чужие сообщения или сообщение слишком старое
-                logger.warning(f"telethon: нет прав на удаление сообщений (или старые) в '{chat_title}'. Пропускаю пачку.")
-                failed_count += len(chunk_ids)
-                chat_failed_count += len(chunk_ids)
-                if status_callback:
-                    await status_callback(f"Нет прав/старые сообщения в '{chat_title}' ({len(chunk_ids)} шт).")
-                await asyncio.sleep(0.2) # Пауза после ошибки прав
-            except Exception as e:
-                logger.error(f"telethon: ошибка удаления сообщений в {chat_title}: {e}")
-                failed_count += len(chunk_ids)
-                chat_failed_count += len(chunk_ids)
-                if status_callback:
-                    await status_callback(f"Ошибка удаления в '{chat_title}': {type(e).__name__}")
-                await asyncio.sleep(0.5)
+    async def flood_notice(chat_title, seconds):
+        logger.error(f"telethon: floodwait при удалении сообщений в {chat_title}. жду {seconds}с.")
+        if status_callback: await status_callback(f"FloodWait в '{chat_title}'! Жду {seconds} сек...")
 
+    async def chat_summary(chat_title, chat_deleted_count, chat_failed_count):
         # Сообщаем итог по чату
         if status_callback:
             await status_callback(f"Чат '{chat_title}': удалено {chat_deleted_count}, ошибок {chat_failed_count}")
 
-    logger.warning(f"telethon: удаление сообщений завершено. удалено: {deleted_count}, ошибок: {failed_count}")
+    entity_cache = get_entity_cache()
+    current_chat = None
+    chat_title = None
+    chat_deleted_count = 0
+    chat_failed_count = 0
+    passes = _QueuePasses(queue, "messages", batch, cancel_token)
+    while (item := await passes.next()) is not None:
+        chat_id = item.chat_id
+        op = item.payload
+        op_count = len(op["ids"]) if op.get("op", "ids") == "ids" else op["count"]
+        if chat_id != current_chat:
+            if current_chat is not None: await chat_summary(chat_title, chat_deleted_count, chat_failed_count)
+            current_chat = chat_id
+            chat_ids.add(chat_id)
+            chat_title = entity_cache.title(chat_id) # название для лога из кэша сущностей
+            chat_deleted_count = 0
+            chat_failed_count = 0
+            logger.info(f"telethon: удаляю сообщения в чате '{chat_title}' (id: {chat_id})...")
+        processed_ops += 1
+        progress = f"(операция {processed_ops}/{total_ops})" if passes.number == 1 else f"(повтор, проход {passes.number})"
+        try:
+            # Темп и повторы после floodwait - в общем планировщике запросов
+            await _run_message_op(client, chat_id, op, on_flood_wait=lambda seconds: flood_notice(chat_title, seconds))
+            queue.mark_done(item)
+            logger.debug(f"telethon: удалено {op_count} сообщений в {chat_title} ({op.get('op', 'ids')}) {progress}")
+            deleted_count += op_count
+            chat_deleted_count += op_count
+            deleted_by_chat[chat_id] = deleted_by_chat.get(chat_id, 0) + op_count
+            _report(status_callback, done=op_count)
+
+        except errors.FloodWaitError as e:
+            if queue.mark_failed(item, f"FloodWait {e.seconds}s") == "pending":
+                logger.warning(f"telethon: floodwait при удалении сообщений в {chat_title} ({e.seconds}с), повторю следующим проходом {progress}.")
+                continue
+            logger.error(f"telethon: floodwait при удалении сообщений в {chat_title} не прошел после повторов ({e.seconds}с).")
+            failed_count += op_count # Считаем всю пачку ошибкой
+            chat_failed_count += op_count
+            _report(status_callback, failed=op_count)
+            if status_callback: await status_callback(f"Ошибка повторного удаления в '{chat_title}'!")
+
+        except (errors.MessageDeleteForbiddenError, errors.ChatAdminRequiredError) as e:
+            # Частая ошибка: нет прав удалять чужие сообщения или сообщение слишком старое - повтор не поможет
+            queue.mark_failed(item, f"{type(e).__name__}: {e}", permanent=True)
+            logger.warning(f"telethon: нет прав на удаление сообщений (или старые) в '{chat_title}'. Пропускаю пачку.")
+            failed_count += op_count
+            chat_failed_count += op_count
+            _report(status_callback, failed=op_count)
+            if status_callback:
+                await status_callback(f"Нет прав/старые сообщения в '{chat_title}' ({op_count} шт).")
+        except Exception as e:
+            if queue.mark_failed(item, f"{type(e).__name__}: {e}") == "pending":
+                logger.warning(f"telethon: ошибка удаления сообщений в {chat_title}: {e}, повторю следующим проходом {progress}.")
+                continue
+            logger.error(f"telethon: ошибка удаления сообщений в {chat_title}: {e}")
+            failed_count += op_count
+            chat_failed_count += op_count
+            _report(status_callback, failed=op_count)
+            if status_callback:
+                await status_callback(f"Ошибка удаления в '{chat_title}': {type(e).__name__}")
+
+    if current_chat is not None: await chat_summary(chat_title, chat_deleted_count, chat_failed_count)
+    stopped = passes.finish()
+    logger.warning(f"telethon: удаление сообщений {'остановлено' if stopped else 'завершено'}. удалено: {deleted_count}, ошибок: {failed_count}")
     # Возвращаем статистику, ID удаленных сообщений не храним детально
-    return {"deleted": deleted_count, "failed": failed_count}
+    return {"deleted": deleted_count, "failed": failed_count, "chat_ids": chat_ids, "deleted_by_chat": deleted_by_chat, "stopped": stopped}
+
+
+async def _resolve_input_user(client, user):
+    # запасной путь для контактов без access_hash: кэш сущностей или запрос к серверу
+    display_name = await get_user_display_name(user)
+    try:
+        input_entity = get_entity_cache().input_user(user.id) or await rate_limiter.call("ResolveEntity", client.get_input_entity, user.id)
+        if isinstance(input_entity, (InputUser, InputPeerUser)):
+            return (input_entity.user_id, input_entity.access_hash, display_name)
+        logger.warning(f"telethon: не получить InputUser/InputPeerUser для {display_name} ({user.id}). Тип: {type(input_entity)}")
+    except ValueError as e: logger.warning(f"telethon: ValueError get_input_entity {display_name} ({user.id}): {e}")
+    except Exception as e: logger.error(f"telethon: ошибка get_input_entity {display_name} ({user.id}): {type(e).__name__} - {e}")
+    return None
 
-# --- Функция delete_contacts_job БЕЗ ИЗМЕНЕНИЙ ---
-async def delete_contacts_job(contacts_to_delete: list[User], status_callback=None):
 
+async def delete_contacts_job(contacts_to_delete: list[User], status_callback=None, cancel_token=None):
+    # готовит InputUser для контактов, ставит пачки в постоянную очередь и выполняет их
     client = get_telethon_client()
-    deleted_count = 0
-    failed_count = 0
     total = len(contacts_to_delete)
     logger.warning(f"telethon: !!! Начинаю НЕОБРАТИМОЕ удаление {total} контактов !!!")
-    input_users_to_delete = []
-    skipped_input_users = 0
-    logger.info("telethon: преобразую User в InputUser/InputPeerUser...")
+    users_to_delete = [] # [(user_id, access_hash, display_name)] - в очереди хранится все нужное для запроса
+    to_resolve = []
+    # User из GetContacts уже содержит access_hash - InputUser собирается без запросов
     for user in contacts_to_delete:
-        display_name = await get_user_display_name(user)
-        try:
-            input_entity = await client.get_input_entity(user.id)
-            if isinstance(input_entity, (InputUser, InputPeerUser)):
-                 input_users_to_delete.append(input_entity)
-            else:
-                 logger.warning(f"telethon: не получить InputUser/InputPeerUser для {display_name} ({user.id}). Тип: {type(input_entity)}")
-                 skipped_input_users += 1
-        except ValueError as e: logger.warning(f"telethon: ValueError get_input_entity {display_name} ({user.id}): {e}"); skipped_input_users += 1
-        except Exception as e: logger.error(f"telethon: ошибка get_input_entity {display_name} ({user.id}): {type(e).__name__} - {e}"); skipped_input_users += 1
-    failed_count += skipped_input_users
-    total_to_request = len(input_users_to_delete)
-    logger.info(f"telethon: готово к удалению (запрос): {total_to_request} контактов.")
-    if status_callback: await status_callback(f"Подготовлено: {total_to_request} (пропущено: {skipped_input_users}). Начинаю...")
-    if not input_users_to_delete:
+        if getattr(user, "access_hash", None) is not None:
+            users_to_delete.append((user.id, user.access_hash, await get_user_display_name(user)))
+        else:
+            to_resolve.append(user)
+    if to_resolve:
+        logger.info(f"telethon: без access_hash: {len(to_resolve)} контактов, получаю через get_input_entity...")
+        resolved = await asyncio.gather(*(_resolve_input_user(client, user) for user in to_resolve))
+        users_to_delete.extend(entry for entry in resolved if entry)
+    skipped_input_users = total - len(users_to_delete)
+    logger.info(f"telethon: готово к удалению (запрос): {len(users_to_delete)} контактов.")
+    _report(status_callback, total=total, failed=skipped_input_users)
+    if status_callback: await status_callback(f"Подготовлено: {len(users_to_delete)} (пропущено: {skipped_input_users}). Начинаю...")
+    if not users_to_delete:
          logger.warning("telethon: нет контактов для запроса на удаление.")
-         return {"deleted": 0, "failed": failed_count}
-    chunk_size = 100
-    for i in range(0, total_to_request, chunk_size):
-        chunk = input_users_to_delete[i:i + chunk_size]; current_chunk_num = (i // chunk_size) + 1; total_chunks = (total_to_request + chunk_size - 1) // chunk_size
-        logger.info(f"telethon: удаляю пачку {current_chunk_num}/{total_chunks} ({len(chunk)} шт.)...")
-        if status_callback: await status_callback(f"Удаляю пачку {current_chunk_num}/{total_chunks} ({len(chunk)} шт)...")
-        try:
-            await client(functions.contacts.DeleteContactsRequest(id=chunk)); logger.info(f"telethon: пачка {current_chunk_num} удалена.")
-            deleted_count += len(chunk); await asyncio.sleep(1.5)
-        except errors.FloodWaitError as e:
-            logger.error(f"telethon: floodwait пачка {current_chunk_num}. жду {e.seconds}с."); await asyncio.sleep(e.seconds + 1)
-            if status_callback: await status_callback(f"FloodWait пачка {current_chunk_num}! Жду {e.seconds} сек...")
-            try: # Повтор
-                await client(functions.contacts.DeleteContactsRequest(id=chunk)); logger.info(f"telethon: пачка {current_chunk_num} удалена (повторно).")
-                deleted_count += len(chunk); await asyncio.sleep(1.5)
-            except Exception as e_retry: logger.error(f"telethon: ошибка повтора пачки {current_chunk_num}: {e_retry}"); failed_count += len(chunk); await status_callback(f"Ошибка повтора пачки {current_chunk_num}!")
-        except Exception as e: logger.error(f"telethon: ошибка пачки {current_chunk_num}: {e}"); failed_count += len(chunk); await status_callback(f"Ошибка пачки {current_chunk_num}: {type(e).__name__}"); await asyncio.sleep(0.5)
-    logger.warning(f"telethon: удаление контактов завершено. удалено: {deleted_count}, ошибок/пропущено: {failed_count}")
-    return {"deleted": deleted_count, "failed": failed_count}
-
-
-# --- Функция get_contacts_for_deletion БЕЗ ИЗМЕНЕНИЙ ---
-async def get_contacts_for_deletion(whitelist_ids: set):
+         return {"deleted": 0, "failed": skipped_input_users}
+    batch = get_deletion_queue().enqueue_contacts(users_to_delete)
+    results = await run_contact_items(batch, status_callback, cancel_token=cancel_token)
+    results["failed"] += skipped_input_users
+    return results
 
+
+async def run_contact_items(batch=None, status_callback=None, cancel_token=None, pipeline_depth=CONTACT_PIPELINE_DEPTH):
+    # выполняет pending-элементы "contacts" (пачки до 100 InputUser)
+    # pipeline_depth пачек отправляются одновременно: пока одна ждет ответа, следующая уже в работе
+    # (темп все равно задает общий планировщик запросов)
+    client = get_telethon_client()
+    queue = get_deletion_queue()
+    totals = {"deleted": 0, "failed": 0, "deleted_contacts": []} # deleted_contacts - имена удаленных (для отчета)
+    total_chunks = queue.counts(batch).get("contacts", {}).get("pending", 0)
+    passes = _QueuePasses(queue, "contacts", batch, cancel_token)
+    cursor = {"chunk_num": 0}
+    deleted_ids = []
+
+    async def flood_notice(seconds):
+        logger.error(f"telethon: floodwait при удалении контактов. жду {seconds}с.")
+        if status_callback: await status_callback(f"FloodWait! Жду {seconds} сек...")
+
+    async def worker():
+        # выборка под замком проходов, поэтому воркеры не берут одну пачку дважды
+        while (item := await passes.next()) is not None:
+            cursor["chunk_num"] += 1
+            current_chunk_num = cursor["chunk_num"] if passes.number == 1 else f"{cursor['chunk_num']} (повтор)"
+            chunk = [InputUser(user_id, access_hash) for user_id, access_hash, _ in item.payload["users"]]
+            logger.info(f"telethon: удаляю пачку {current_chunk_num}/{total_chunks} ({len(chunk)} шт.)...")
+            if status_callback: await status_callback(f"Удаляю пачку {current_chunk_num}/{total_chunks} ({len(chunk)} шт)...")
+            try:
+                # темп и повторы после floodwait - в общем планировщике запросов
+                await rate_limiter.call("DeleteContacts", client, functions.contacts.DeleteContactsRequest(id=chunk), on_flood_wait=flood_notice)
+                queue.mark_done(item)
+                logger.info(f"telethon: пачка {current_chunk_num} удалена.")
+                deleted_ids.extend(user.user_id for user in chunk)
+                totals["deleted_contacts"].extend(name for _, _, name in item.payload["users"])
+                totals["deleted"] += len(chunk)
+                _report(status_callback, done=len(chunk))
+            except errors.FloodWaitError as e:
+                if queue.mark_failed(item, f"FloodWait {e.seconds}s") == "pending":
+                    logger.warning(f"telethon: floodwait пачка {current_chunk_num} ({e.seconds}с), повторю следующим проходом.")
+                    continue
+                logger.error(f"telethon: floodwait пачка {current_chunk_num} не прошла после повторов ({e.seconds}с)."); totals["failed"] += len(chunk)
+                _report(status_callback, failed=len(chunk))
+                if status_callback: await status_callback(f"Ошибка повтора пачки {current_chunk_num}!")
+            except Exception as e:
+                if queue.mark_failed(item, f"{type(e).__name__}: {e}") == "pending":
+                    logger.warning(f"telethon: ошибка пачки {current_chunk_num}: {e}, повторю следующим проходом.")
+                    continue
+                logger.error(f"telethon: ошибка пачки {current_chunk_num}: {e}"); totals["failed"] += len(chunk)
+                _report(status_callback, failed=len(chunk))
+                if status_callback: await status_callback(f"Ошибка пачки {current_chunk_num}: {type(e).__name__}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(pipeline_depth, total_chunks)))))
+    get_contact_snapshot().forget(deleted_ids)
+    totals["stopped"] = passes.finish()
+    logger.warning(f"telethon: удаление контактов {'остановлено' if totals['stopped'] else 'завершено'}. удалено: {totals['deleted']}, ошибок/пропущено: {totals['failed']}")
+    return totals
+
+
+# выполнение элементов очереди по типу (для возобновления после перезапуска и /retryfailed)
+QUEUE_RUNNERS = {
+    "chat": run_chat_items,
+    "messages": run_message_items,
+    "contacts": run_contact_items,
+}
+
+
+async def get_contacts_for_deletion(whitelist_ids: set):
+    # контакты из общего снимка (см. contact_snapshot): без изменений на сервере - без загрузки списка
     client = get_telethon_client()
     contacts_to_delete = []
+    entity_cache = get_entity_cache()
     try:
-        contacts = await client(functions.contacts.GetContactsRequest(hash=0))
-        if hasattr(contacts, 'users'):
-            for user in contacts.users:
-                if isinstance(user, User) and not user.is_self and not user.bot and not user.deleted:
-                    if user.id not in whitelist_ids:
-                        contacts_to_delete.append(user)
+        for user in await get_contact_snapshot().get_users(client):
+            if isinstance(user, User): await entity_cache.remember(user)
+            if isinstance(user, User) and not user.is_self and not user.bot and not user.deleted:
+                if user.id not in whitelist_ids:
+                    contacts_to_delete.append(user)
+        entity_cache.save()
         logger.info(f"telethon: найдено контактов для возможного удаления: {len(contacts_to_delete)}")
         return contacts_to_delete
     except Exception as e:
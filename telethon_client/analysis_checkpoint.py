@@ -0,0 +1,155 @@
+# telethon_client/analysis_checkpoint.py
+# контрольная точка анализа: журнал итогов просканированных чатов и позиции внутри длинного чата
+import json
+import logging
+import os
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# при изменении формата записей увеличивать - старые контрольные точки не используются
+CHECKPOINT_VERSION = 1
+
+
+class ResumePoint:
+    # то, что удалось восстановить из журнала
+    __slots__ = ("chats", "positions")
+
+    def __init__(self):
+        self.chats = {} # {chat_id: итоги чата в формате записи scan_state}
+        self.positions = {} # {chat_id: позиция внутри недосканированного чата (ChatScan.snapshot)}
+
+    def __len__(self):
+        return len(self.chats)
+
+
+class AnalysisCheckpoint:
+    """
+    Журнал (jsonl) только дописывается: строка на просканированный чат, файл
+    целиком не перезаписывается, поэтому запись дешевая и не зависит от размера
+    анализа. Буфер сбрасывается на диск раз в flush_every записей, позиция внутри
+    длинного чата - сразу. Первая строка - отпечаток триггеров и лимита: при их
+    изменении контрольная точка недействительна. Для чата действует последняя запись.
+    """
+
+    def __init__(self, path, flush_every=5):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self._file = None
+        self._pending = 0
+
+    def load(self, fingerprint):
+        # ResumePoint или None (нет журнала, другие триггеры/лимит, битый заголовок)
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"не удалось прочитать контрольную точку анализа {self.path}: {e}")
+            return None
+        with f:
+            try:
+                header = json.loads(f.readline() or "null")
+            except ValueError:
+                header = None
+            if not header or header.get("version") != CHECKPOINT_VERSION or header.get("fingerprint") != fingerprint:
+                logger.info("контрольная точка анализа отсутствует или устарела (триггеры/лимит).")
+                return None
+            point = ResumePoint()
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # недописанная последняя строка (падение во время записи)
+                chat_id = record["chat_id"]
+                if record["type"] == "chat":
+                    point.chats[chat_id] = record["entry"]
+                    point.positions.pop(chat_id, None)
+                elif record["type"] == "position":
+                    point.positions[chat_id] = record["position"]
+                elif record["type"] == "forget":
+                    point.chats.pop(chat_id, None)
+                    point.positions.pop(chat_id, None)
+        logger.info(f"загружена контрольная точка анализа: {len(point.chats)} чатов, незавершенных: {len(point.positions)}.")
+        return point
+
+    def open(self, fingerprint, resume=False):
+        # новый журнал или (resume) продолжение существующего
+        self.close()
+        try:
+            if resume:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            else:
+                self._file = open(self.path, 'w', encoding='utf-8')
+                self._write({"type": "start", "version": CHECKPOINT_VERSION, "fingerprint": fingerprint, "started_at": time.time()})
+                self.flush()
+        except OSError as e:
+            logger.error(f"не удалось открыть контрольную точку анализа {self.path}: {e}")
+            self._file = None
+
+    def _write(self, record):
+        if self._file is None: return
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError as e:
+            # без контрольной точки анализ продолжается
+            logger.error(f"не удалось записать контрольную точку анализа: {e}")
+            self.close()
+            return
+        self._pending += 1
+        if self._pending >= self.flush_every: self.flush()
+
+    def record_chat(self, chat_id, entry):
+        self._write({"type": "chat", "chat_id": chat_id, "entry": entry})
+
+    def record_position(self, chat_id, position):
+        self._write({"type": "position", "chat_id": chat_id, "position": position})
+        self.flush()
+
+    def forget(self, chat_ids):
+        # чаты изменены удалением - при продолжении сканируются заново
+        chat_ids = list(chat_ids)
+        if not chat_ids: return
+        opened_here = self._file is None
+        if opened_here:
+            if not os.path.exists(self.path): return
+            self.open(None, resume=True)
+        for chat_id in chat_ids:
+            self._write({"type": "forget", "chat_id": chat_id})
+        if opened_here: self.close()
+        else: self.flush()
+
+    def flush(self):
+        if self._file is None: return
+        try:
+            self._file.flush()
+        except OSError as e:
+            logger.error(f"не удалось сохранить контрольную точку анализа: {e}")
+        self._pending = 0
+
+    def close(self):
+        if self._file is None: return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def discard(self):
+        # анализ завершен полностью - продолжать нечего
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"не удалось удалить контрольную точку анализа {self.path}: {e}")
+
+
+_checkpoint = None
+
+def get_analysis_checkpoint() -> AnalysisCheckpoint:
+    global _checkpoint
+    if _checkpoint is None:
+        _checkpoint = AnalysisCheckpoint(config.ANALYSIS_CHECKPOINT_FILE, config.CHECKPOINT_FLUSH_EVERY)
+    return _checkpoint
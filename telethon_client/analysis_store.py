@@ -0,0 +1,431 @@
+# telethon_client/analysis_store.py
+# итоги анализов на диске (sqlite, WAL): кандидаты на удаление выбираются по порогу, результаты переживают перезапуск
+import json
+import logging
+import sqlite3
+import time
+from array import array
+
+import config
+from .results import ChatResult, id_buffer
+from .thresholds import ChatColumns, ThresholdPolicy
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    chat_count INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS chats (
+    run_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    is_whitelisted INTEGER NOT NULL,
+    excluded INTEGER NOT NULL,
+    count_lower_bound INTEGER NOT NULL,
+    sampled INTEGER NOT NULL,
+    trigger_messages INTEGER NOT NULL,
+    trigger_ids BLOB,
+    history TEXT,
+    status TEXT NOT NULL DEFAULT 'found',
+    deleted_messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_chats_candidates ON chats (run_id, status, excluded, count);
+CREATE INDEX IF NOT EXISTS idx_chats_position ON chats (run_id, position);
+CREATE TABLE IF NOT EXISTS term_hits (
+    run_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (run_id, chat_id, term)
+);
+CREATE INDEX IF NOT EXISTS idx_term_hits_term ON term_hits (run_id, term);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    run_id INTEGER PRIMARY KEY,
+    virtual INTEGER NOT NULL,
+    policy TEXT NOT NULL,
+    statuses TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report_rows (
+    run_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    row_order INTEGER NOT NULL,
+    status TEXT,
+    html TEXT,
+    PRIMARY KEY (run_id, chat_id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_report_rows_order ON report_rows (run_id, row_order);
+"""
+
+_CHAT_COLUMNS = "chat_id, title, count, message_count, is_whitelisted, count_lower_bound, sampled"
+_IN_CHUNK = 500 # id в одном "IN (...)" (лимит параметров sqlite)
+_PAGE_ROWS = 1000 # строк в одном запросе при чтении страницами (отчет, выгрузка)
+# таблицы с данными запуска (run_id)
+_RUN_TABLES = ("term_hits", "chats", "report_rows", "reports")
+# поля AnalysisResults, которые хранятся в meta запуска
+_RESULT_META = ("stopped", "resumable", "resumed_chats", "sampled", "match_cache_stats", "duplicates")
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), _IN_CHUNK):
+        yield ids[i:i + _IN_CHUNK]
+
+
+def _exceeds_sql(policy):
+    # условие ThresholdPolicy.exceeds на колонки chats (c) и его параметры
+    if policy.mode == "density": return "c.count > ? * c.message_count", (policy.value,)
+    return "c.count > ?", (policy.value,)
+
+
+class AnalysisStore:
+    """
+    Запуски анализа (runs), итоги по чатам (chats) и найденные триггеры (term_hits).
+    У чата хранятся id сообщений с триггерами (array('q') в BLOB), сведения об
+    истории для планировщика удаления и статус: found - как найден анализом,
+    deleted - чат удален, cleaned - удалены сообщения с триггерами.
+    excluded - чат в белом списке (по флагу анализа или по id), кандидатом не бывает.
+    Держится ANALYSIS_STORE_KEEP_RUNS последних запусков.
+    Кандидаты выбираются по текущему порогу (policy, таблица settings) из колонок
+    запуска (ChatColumns): они читаются одним запросом и держатся в памяти до
+    следующего изменения, поэтому смена порога не требует ни сканирования, ни запросов.
+    Запуск пишется по мере анализа (begin_run -> RunWriter) и становится последним
+    только после finish(). Для HTML-отчета запуска (reports, report_rows) хранятся
+    порядок строк и уже отрисованные строки со статусом, с которым они отрисованы.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if "finished" not in {row[1] for row in self.conn.execute("PRAGMA table_info(runs)")}:
+            # хранилище прежней версии: все его запуски завершены
+            self.conn.execute("ALTER TABLE runs ADD COLUMN finished INTEGER NOT NULL DEFAULT 1")
+        self.conn.commit()
+        self._columns = None # ChatColumns последнего запрошенного запуска
+
+    def fork(self):
+        # свое соединение с той же базой - для работы из другого потока (запись отчета); в памяти - то же хранилище
+        return self if self.path == ":memory:" else AnalysisStore(self.path)
+
+    # --- запись ---
+
+    def begin_run(self, whitelist_ids=()):
+        # новый запуск, который заполняется по мере анализа; недописанные запуски (анализ упал) удаляются
+        self._delete_runs("finished = 0")
+        with self.conn:
+            run_id = self.conn.execute("INSERT INTO runs (created_at, chat_count, meta, finished) VALUES (?, 0, '{}', 0)", (time.time(),)).lastrowid
+        return RunWriter(self, run_id, whitelist_ids)
+
+    def save_run(self, results, whitelist_ids=(), meta=None):
+        # сохраняет готовые AnalysisResults одним запуском и возвращает его id; meta - доп. сведения для отчета (JSON)
+        writer = self.begin_run(whitelist_ids)
+        for position, chat in enumerate(results.chats):
+            writer.add(position, chat, results.messages_with_triggers.get(chat.id), results.history.get(chat.id))
+        return writer.finish(results, meta)
+
+    @staticmethod
+    def _ids_blob(ids):
+        return ids.tobytes() if ids is not None and len(ids) else None
+
+    @staticmethod
+    def _ids(blob):
+        ids = id_buffer()
+        ids.frombytes(blob)
+        return ids
+
+    def mark_chats_deleted(self, run_id, chat_ids):
+        self._columns = None
+        with self.conn:
+            self.conn.executemany("UPDATE chats SET status = 'deleted' WHERE run_id = ? AND chat_id = ?",
+                                  [(run_id, chat_id) for chat_id in chat_ids])
+
+    def mark_messages_deleted(self, run_id, deleted_by_chat):
+        # {chat_id: удалено сообщений}: чат больше не кандидат на удаление сообщений
+        self._columns = None
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE chats SET status = 'cleaned', deleted_messages = deleted_messages + ? WHERE run_id = ? AND chat_id = ? AND status != 'deleted'",
+                [(count, run_id, chat_id) for chat_id, count in deleted_by_chat.items() if count])
+
+    def _delete_runs(self, condition, params=()):
+        # удаляет запуски по условию на runs вместе с их чатами, триггерами и отчетом
+        with self.conn:
+            for table in _RUN_TABLES:
+                self.conn.execute(f"DELETE FROM {table} WHERE run_id IN (SELECT id FROM runs WHERE {condition})", params)
+            self.conn.execute(f"DELETE FROM runs WHERE {condition}", params)
+
+    def prune(self, keep=None):
+        keep = config.ANALYSIS_STORE_KEEP_RUNS if keep is None else keep
+        row = self.conn.execute("SELECT id FROM runs WHERE finished = 1 ORDER BY id DESC LIMIT 1 OFFSET ?", (max(keep, 1) - 1,)).fetchone()
+        if row is None: return
+        self._delete_runs("id < ?", (row[0],))
+
+    def clear(self):
+        self._columns = None
+        self._delete_runs("1")
+
+    # --- чтение ---
+
+    def latest_run(self):
+        # {"id", "created_at", "chat_count", ...meta} последнего завершенного запуска или None
+        row = self.conn.execute("SELECT id, created_at, chat_count, meta FROM runs WHERE finished = 1 ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None: return None
+        run = json.loads(row[3])
+        run.update(id=row[0], created_at=row[1], chat_count=row[2])
+        return run
+
+    def _chats(self, run_id, where="", params=()):
+        # ChatResult по условию на таблицу chats (в порядке анализа) вместе с найденными триггерами
+        rows = self.conn.execute(f"SELECT {_CHAT_COLUMNS} FROM chats WHERE run_id = ? {where} ORDER BY position", (run_id, *params)).fetchall()
+        triggers = {}
+        for chat_id, term in self.conn.execute(
+                f"SELECT chat_id, term FROM term_hits WHERE run_id = ? AND chat_id IN (SELECT chat_id FROM chats WHERE run_id = ? {where}) ORDER BY rowid",
+                (run_id, run_id, *params)):
+            triggers.setdefault(chat_id, []).append(term)
+        return [ChatResult(chat_id, title, count, message_count, triggers.get(chat_id, ()), bool(is_whitelisted), bool(count_lower_bound), bool(sampled))
+                for chat_id, title, count, message_count, is_whitelisted, count_lower_bound, sampled in rows]
+
+    def policy(self):
+        # текущий порог удаления (/threshold); не задан - из config
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'policy'").fetchone()
+        if row is not None:
+            try: return ThresholdPolicy.from_dict(json.loads(row[0]))
+            except (ValueError, TypeError) as e: logger.warning(f"сохраненный порог не подходит, используется config: {e}")
+        return ThresholdPolicy()
+
+    def set_policy(self, policy):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('policy', ?)", (json.dumps(policy.to_dict()),))
+
+    def columns(self, run_id):
+        # колонки чатов запуска, которые еще могут быть кандидатами (не белый список, не удалены, не очищены)
+        if self._columns is None or self._columns.run_id != run_id:
+            rows = self.conn.execute(
+                "SELECT chat_id, count, message_count, trigger_messages, count_lower_bound FROM chats "
+                "WHERE run_id = ? AND status = 'found' AND excluded = 0 ORDER BY position", (run_id,))
+            total = self.conn.execute("SELECT COUNT(*) FROM chats WHERE run_id = ?", (run_id,)).fetchone()[0]
+            self._columns = ChatColumns(run_id, rows, total)
+        return self._columns
+
+    def split(self, run_id, policy=None):
+        # ThresholdSplit запуска по порогу (по умолчанию - текущему)
+        return self.columns(run_id).classify(policy or self.policy())
+
+    def chat_candidates(self, run_id, policy=None):
+        # кандидаты на удаление чата (ChatResult в порядке анализа): выше порога, не белый список, еще не удалены
+        chat_ids = self.split(run_id, policy).full
+        by_id = {}
+        for chunk in _chunks(chat_ids):
+            for chat in self._chats(run_id, f"AND chat_id IN ({','.join('?' * len(chunk))})", chunk):
+                by_id[chat.id] = chat
+        return [by_id[chat_id] for chat_id in chat_ids if chat_id in by_id]
+
+    def message_candidates(self, run_id, policy=None):
+        # {chat_id: число сообщений с триггерами} для чатов с триггерами ниже порога, где сообщения еще не удалялись
+        return self.split(run_id, policy).messages
+
+    def _by_chat(self, run_id, column, chat_ids):
+        for chunk in _chunks(chat_ids):
+            placeholders = ",".join("?" * len(chunk))
+            yield from self.conn.execute(f"SELECT chat_id, {column} FROM chats WHERE run_id = ? AND chat_id IN ({placeholders})", (run_id, *chunk))
+
+    def trigger_ids(self, run_id, chat_ids):
+        # {chat_id: array('q')} id сообщений с триггерами (только для запрошенных чатов)
+        return {chat_id: self._ids(blob) for chat_id, blob in self._by_chat(run_id, "trigger_ids", chat_ids) if blob}
+
+    def history(self, run_id, chat_ids):
+        return {chat_id: json.loads(raw) for chat_id, raw in self._by_chat(run_id, "history", chat_ids) if raw}
+
+    def titles(self, run_id, chat_ids):
+        return dict(self._by_chat(run_id, "title", chat_ids))
+
+    def deleted_state(self, run_id):
+        # (id удаленных чатов, {chat_id: удалено сообщений}) - для восстановления отчета
+        deleted_ids, deleted_messages = set(), {}
+        for chat_id, status, count in self.conn.execute(
+                "SELECT chat_id, status, deleted_messages FROM chats WHERE run_id = ? AND status != 'found'", (run_id,)):
+            if status == "deleted": deleted_ids.add(chat_id)
+            if count: deleted_messages[chat_id] = count
+        return deleted_ids, deleted_messages
+
+    def summary(self, run_id):
+        # сводка запуска для итогового сообщения и отчета - одним запросом, без загрузки чатов
+        row = self.conn.execute(
+            "SELECT COUNT(*), SUM(count_lower_bound), SUM(sampled), SUM(status = 'deleted'), SUM(deleted_messages), SUM(deleted_messages > 0) "
+            "FROM chats WHERE run_id = ?", (run_id,)).fetchone()
+        total, lower_bound, sampled, deleted_chats, deleted_messages, cleaned_chats = (value or 0 for value in row)
+        return {"total": total, "lower_bound": lower_bound, "sampled": sampled, "deleted_chats": deleted_chats,
+                "deleted_messages": deleted_messages, "cleaned_chats": cleaned_chats}
+
+    def iter_chats(self, run_id):
+        """
+        Чаты запуска в порядке анализа: (ChatResult, id сообщений с триггерами или None).
+        Читаются страницами по _PAGE_ROWS, в памяти не больше одной страницы -
+        для выгрузок (из потока выгрузки, через fork()).
+        """
+        last = -1
+        while True:
+            rows = self.conn.execute(f"SELECT position, {_CHAT_COLUMNS}, trigger_ids FROM chats WHERE run_id = ? AND position > ? ORDER BY position LIMIT ?",
+                                     (run_id, last, _PAGE_ROWS)).fetchall()
+            if not rows: return
+            triggers = {}
+            for chat_id, term in self.conn.execute(
+                    "SELECT chat_id, term FROM term_hits WHERE run_id = ? AND chat_id IN "
+                    "(SELECT chat_id FROM chats WHERE run_id = ? AND position > ? AND position <= ?) ORDER BY rowid",
+                    (run_id, run_id, last, rows[-1][0])):
+                triggers.setdefault(chat_id, []).append(term)
+            for _, chat_id, title, count, message_count, is_whitelisted, count_lower_bound, sampled, blob in rows:
+                yield (ChatResult(chat_id, title, count, message_count, triggers.get(chat_id, ()), bool(is_whitelisted), bool(count_lower_bound), bool(sampled)),
+                       self._ids(blob) if blob else None)
+            if len(rows) < _PAGE_ROWS: return
+            last = rows[-1][0]
+
+    # --- HTML-отчет ---
+
+    def report_state(self, run_id):
+        # {"virtual", "policy", "statuses"} отчета запуска или None (отчет еще не создан)
+        row = self.conn.execute("SELECT virtual, policy, statuses FROM reports WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None: return None
+        return {"virtual": bool(row[0]), "policy": ThresholdPolicy.from_dict(json.loads(row[1])), "statuses": [tuple(status) for status in json.loads(row[2])]}
+
+    def create_report(self, run_id, virtual, policy):
+        # порядок строк отчета задается один раз: сначала кандидаты на удаление чата, затем по числу триггеров, при равенстве - порядок анализа
+        exceeds, params = _exceeds_sql(policy)
+        with self.conn:
+            self.conn.execute("DELETE FROM report_rows WHERE run_id = ?", (run_id,))
+            self.conn.execute("INSERT OR REPLACE INTO reports (run_id, virtual, policy, statuses) VALUES (?, ?, ?, '[]')",
+                              (run_id, virtual, json.dumps(policy.to_dict())))
+            self.conn.execute(
+                f"INSERT INTO report_rows (run_id, chat_id, row_order) SELECT c.run_id, c.chat_id, "
+                f"ROW_NUMBER() OVER (ORDER BY ({exceeds} AND c.is_whitelisted = 0) DESC, c.count DESC, c.position) - 1 "
+                f"FROM chats c WHERE c.run_id = ?", (*params, run_id))
+
+    def set_report_state(self, run_id, policy, statuses):
+        with self.conn:
+            self.conn.execute("UPDATE reports SET policy = ?, statuses = ? WHERE run_id = ?",
+                              (json.dumps(policy.to_dict()), json.dumps(statuses, ensure_ascii=False), run_id))
+
+    def _report_page(self, run_id, where, params):
+        rows = self.conn.execute(
+            "SELECT r.row_order, r.status, c.chat_id, c.title, c.count, c.message_count, c.is_whitelisted, c.count_lower_bound, c.sampled, "
+            "c.status, c.deleted_messages, (SELECT json_group_array(t.term) FROM term_hits t WHERE t.run_id = c.run_id AND t.chat_id = c.chat_id) "
+            f"FROM report_rows r JOIN chats c ON c.run_id = r.run_id AND c.chat_id = r.chat_id WHERE r.run_id = ? {where}", (run_id, *params)).fetchall()
+        return [(row_order, ChatResult(chat_id, title, count, message_count, json.loads(terms), bool(is_whitelisted), bool(count_lower_bound), bool(sampled)),
+                 status == "deleted", deleted_messages, tuple(json.loads(rendered)) if rendered else None)
+                for row_order, rendered, chat_id, title, count, message_count, is_whitelisted, count_lower_bound, sampled, status, deleted_messages, terms in rows]
+
+    def report_chats(self, run_id, chat_ids=None):
+        """
+        Строки отчета страницами по _PAGE_ROWS: (номер строки, ChatResult, удален ли
+        чат, удалено сообщений, статус, с которым строка отрисована, или None).
+        chat_ids=None - все строки в порядке отчета, иначе только эти чаты. Страница
+        читается целиком, поэтому между страницами можно писать update_report_rows.
+        """
+        if chat_ids is not None:
+            for chunk in _chunks(chat_ids):
+                yield from self._report_page(run_id, f"AND r.chat_id IN ({','.join('?' * len(chunk))})", chunk)
+            return
+        last = -1
+        while True:
+            page = self._report_page(run_id, "AND r.row_order > ? ORDER BY r.row_order LIMIT ?", (last, _PAGE_ROWS))
+            yield from page
+            if len(page) < _PAGE_ROWS: return
+            last = page[-1][0]
+
+    def update_report_rows(self, run_id, rows):
+        # rows: [(chat_id, статус, html строки)]
+        with self.conn:
+            self.conn.executemany("UPDATE report_rows SET status = ?, html = ? WHERE run_id = ? AND chat_id = ?",
+                                  ((json.dumps(status, ensure_ascii=False), html, run_id, chat_id) for chat_id, status, html in rows))
+
+    def report_html(self, run_id):
+        # отрисованные строки в порядке отчета - курсором, по одной
+        for (html,) in self.conn.execute("SELECT html FROM report_rows WHERE run_id = ? ORDER BY row_order", (run_id,)):
+            yield html
+
+    def term_summary(self, run_id, policy):
+        # [(триггер, чатов с ним, из них кандидатов на удаление)] по алфавиту
+        exceeds, params = _exceeds_sql(policy)
+        return self.conn.execute(
+            f"SELECT t.term, COUNT(*), SUM({exceeds} AND c.is_whitelisted = 0) FROM term_hits t "
+            f"JOIN chats c ON c.run_id = t.run_id AND c.chat_id = t.chat_id WHERE t.run_id = ? GROUP BY t.term ORDER BY t.term",
+            (*params, run_id)).fetchall()
+
+
+class RunWriter:
+    """
+    Запись запуска по мере анализа (AnalysisStore.begin_run): итоги чатов копятся
+    в буфере и пишутся пачками по ANALYSIS_STORE_BATCH одной транзакцией, так что
+    в памяти держится не больше пачки. Пока не вызван finish(), запуск не виден
+    latest_run - кандидаты и отчет берутся из прошлого завершенного запуска.
+    """
+
+    def __init__(self, store, run_id, whitelist_ids=()):
+        self.store = store
+        self.run_id = run_id
+        self.whitelist_ids = set(whitelist_ids)
+        self.chat_count = 0
+        self._chats, self._terms = [], []
+
+    def add(self, position, chat, trigger_ids=None, history=None):
+        # position - номер диалога (порядок анализа); при параллельном обходе чаты приходят не по порядку
+        if trigger_ids is not None and not isinstance(trigger_ids, array): trigger_ids = id_buffer(trigger_ids)
+        self._chats.append((self.run_id, chat.id, position, chat.title, chat.count, chat.message_count, chat.is_whitelisted,
+                            chat.is_whitelisted or chat.id in self.whitelist_ids, chat.count_lower_bound, chat.sampled,
+                            len(trigger_ids) if trigger_ids is not None else 0, AnalysisStore._ids_blob(trigger_ids),
+                            json.dumps(history) if history else None))
+        self._terms.extend((self.run_id, chat.id, term) for term in chat.found_triggers)
+        self.chat_count += 1
+        if len(self._chats) >= config.ANALYSIS_STORE_BATCH: self.flush()
+
+    def flush(self):
+        if not self._chats: return
+        conn = self.store.conn
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chats (run_id, chat_id, position, title, count, message_count, is_whitelisted, excluded, "
+                "count_lower_bound, sampled, trigger_messages, trigger_ids, history) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._chats)
+            conn.executemany("INSERT OR IGNORE INTO term_hits (run_id, chat_id, term) VALUES (?, ?, ?)", self._terms)
+        self._chats, self._terms = [], []
+
+    def finish(self, results=None, meta=None):
+        # дописывает буфер, сохраняет сводные поля AnalysisResults и meta и делает запуск последним; возвращает его id
+        self.flush()
+        run_meta = {key: getattr(results, key) for key in _RESULT_META} if results is not None else {}
+        run_meta.update(meta or {})
+        with self.store.conn:
+            self.store.conn.execute(
+                "UPDATE runs SET chat_count = (SELECT COUNT(*) FROM chats WHERE run_id = ?), meta = ?, finished = 1 WHERE id = ?",
+                (self.run_id, json.dumps(run_meta, ensure_ascii=False), self.run_id))
+        self.store._columns = None
+        self.store.prune()
+        logger.info(f"итоги анализа сохранены: запуск #{self.run_id}, {self.chat_count} чатов.")
+        return self.run_id
+
+    def discard(self):
+        # анализ не завершился: недописанный запуск удаляется
+        self._chats, self._terms = [], []
+        self.store._delete_runs("id = ?", (self.run_id,))
+
+
+_store = None
+
+def get_analysis_store() -> AnalysisStore:
+    global _store
+    if _store is None:
+        _store = AnalysisStore(config.ANALYSIS_STORE_DB)
+    return _store
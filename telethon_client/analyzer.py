@@ -1,129 +1,479 @@
 # telethon_client/analyzer.py
 import asyncio
 import logging
-from telethon import errors, functions
-from telethon.tl.types import User, Message as TelethonMessage
+from telethon import errors
+from telethon.tl.types import User
 
+import config
 from .client_instance import get_telethon_client
-from .utils import get_entity_title, clean_text_for_matching, get_user_display_name
+from .utils import get_entity_title, get_user_display_name
+from .matcher import TermMatcher
+from .term_index import ListIndex
+from .contact_snapshot import get_contact_snapshot
+from .scan_state import get_scan_state, terms_fingerprint, state_entry
+from .scan_strategies import ChatScan, choose_strategy, STRATEGIES
+from .analysis_checkpoint import get_analysis_checkpoint
+from .prescan import collect_samples
+from .match_pool import create_match_pool
+from .match_cache import MatchCache
+from .results import AnalysisResults, ChatResult, id_buffer
+from .thresholds import ThresholdPolicy
+from .entity_cache import get_entity_cache
+from .rate_limiter import rate_limiter
 
 
 logger = logging.getLogger(__name__)
 
+# сколько диалогов отдает один GetDialogs внутри iter_dialogs
+DIALOGS_PAGE_SIZE = 100
+
 async def find_whitelisted_ids(whitelist_names):
-    # ищет id пользователей из белого списка имен (без изменений)
+    # ищет id пользователей из белого списка имен (whitelist_names - ListIndex из get_whitelist_index() или список)
     client = get_telethon_client()
     whitelisted_user_ids = set()
     if not whitelist_names: return whitelisted_user_ids
+    if not isinstance(whitelist_names, (ListIndex, set, frozenset)): whitelist_names = frozenset(whitelist_names)
     try:
-        contacts = await client(functions.contacts.GetContactsRequest(hash=0))
-        if hasattr(contacts, 'users'):
-            for user in contacts.users:
-                if isinstance(user, User):
-                    display_name = await get_user_display_name(user)
-                    username = f"@{user.username.lower()}" if user.username else ""
-                    if display_name in whitelist_names or (username and username in whitelist_names):
-                        whitelisted_user_ids.add(user.id)
-                        name_found = display_name if display_name in whitelist_names else username
-                        logger.info(f"telethon: найден контакт в белом списке: {name_found} (id: {user.id})")
+        for user in await get_contact_snapshot().get_users(client):
+            if isinstance(user, User):
+                display_name = await get_user_display_name(user)
+                username = f"@{user.username.lower()}" if user.username else ""
+                if display_name in whitelist_names or (username and username in whitelist_names):
+                    whitelisted_user_ids.add(user.id)
+                    name_found = display_name if display_name in whitelist_names else username
+                    logger.info(f"telethon: найден контакт в белом списке: {name_found} (id: {user.id})")
         logger.info(f"telethon: найдено id в постоянном белом списке: {len(whitelisted_user_ids)}")
     except Exception as e:
         logger.error(f"telethon: ошибка при получении контактов: {e}")
     return whitelisted_user_ids
 
 
-async def analyze_chats_job(terms, whitelist_ids, fetch_limit):
-    # основная функция анализа чатов (возвращает упрощенный список + ID сообщений)
-    client = get_telethon_client()
-    chat_analysis = [] # список для результатов по чатам
-    messages_with_triggers = {} # Словарь {chat_id: [msg_id1, msg_id2, ...]}
-    dialog_count = 0
-    skipped_dialogs = 0
-    processed_chats = 0
-    logger.info("telethon: начинаю парсинг диалогов и сообщений (с поиском ID сообщений)...")
-    try:
-        async for dialog in client.iter_dialogs(limit=None):
-            dialog_count += 1
-            entity = dialog.entity
-            title = await get_entity_title(entity)
-            chat_id = dialog.id
-
-            is_self_chat = isinstance(entity, User) and entity.is_self
-            if is_self_chat:
-                skipped_dialogs += 1; continue
-
-            is_whitelisted_by_id = isinstance(entity, User) and entity.id in whitelist_ids
-            if is_whitelisted_by_id:
-                 logger.info(f"telethon: чат с '{title}' (id: {chat_id}) в белом списке.")
-                 chat_analysis.append({
-                     "id": chat_id, "title": title, "count": 0, "message_count": 0,
-                     "found_triggers": [], "is_whitelisted": True
-                 })
-                 skipped_dialogs += 1; continue
-
-            logger.info(f"telethon: анализирую чат ({dialog_count}): {title} (id: {chat_id})")
-            processed_chats += 1
-            term_count, message_count = 0, 0
-            found_triggers_in_chat = set()
-            trigger_message_ids_in_chat = []
+class AdaptiveConcurrency:
+    # ограничитель параллельности: сжимается при floodwait и растет обратно после серии успехов
+    def __init__(self, max_limit: int, grow_after: int = 10):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.grow_after = grow_after
+        self._active = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
 
-            try:
-                async for message in client.iter_messages(chat_id, limit=fetch_limit):
-                    message_count += 1
-                    message_found_trigger = False #
-                    text_to_check = ""
-                    if isinstance(message, TelethonMessage):
-                        if message.text: text_to_check += message.text + " "
-                        if message.media and hasattr(message, 'caption') and message.caption: text_to_check += message.caption
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def on_flood_wait(self):
+        # floodwait: уменьшаем число одновременных запросов вдвое
+        self._successes = 0
+        new_limit = max(1, self.limit // 2)
+        if new_limit != self.limit:
+            logger.warning(f"telethon: floodwait, параллельность сканирования снижена {self.limit} -> {new_limit}")
+            self.limit = new_limit
+
+    async def on_success(self):
+        # после grow_after успешных чатов подряд возвращаем по одному воркеру
+        if self.limit >= self.max_limit: return
+        self._successes += 1
+        if self._successes < self.grow_after: return
+        self._successes = 0
+        async with self._cond:
+            self.limit += 1
+            self._cond.notify_all()
+        logger.info(f"telethon: параллельность сканирования восстановлена до {self.limit}")
+
+
+class _FloodWaitRescan(Exception):
+    # floodwait посреди чата: ждать нужно вне слота параллельности, потом чат сканируется заново
+    def __init__(self, seconds, partial):
+        super().__init__(seconds)
+        self.seconds = seconds
+        self.partial = partial # итог уже просмотренного - если повторы кончатся
+
+
+class ScanContext:
+    # общие параметры одного запуска анализа (передаются во все воркеры)
+    def __init__(self, client, matcher, whitelist_ids, fetch_limit, scan_state=None, limiter=None, strategy_mode="full", match_pool=None, entity_cache=None, progress=None, cancel_token=None, is_excluded=None, checkpoint=None, resume=None, early_stop_at=None, match_cache=None):
+        self.client = client
+        self.matcher = matcher
+        self.match_cache = match_cache # MatchCache или None (каждый текст проверяется заново)
+        self.whitelist_ids = whitelist_ids
+        self.fetch_limit = fetch_limit
+        self.scan_state = scan_state # ScanStateStore или None (полный анализ)
+        self.limiter = limiter
+        self.strategy_mode = strategy_mode # "full", "search" или "auto"
+        self.match_pool = match_pool # MatchPool или None (поиск прямо в event loop)
+        self.entity_cache = entity_cache # EntityCache, заполняется по ходу обхода диалогов
+        self.unchanged_chats = 0 # чаты, пропущенные без запросов (top_message не изменился)
+        self.history = {} # {chat_id: сведения об истории чата для планировщика удаления}
+        self.progress = progress # ProgressReporter или None
+        self.cancel_token = cancel_token # asyncio.Event: остановка между чатами, уже собранное сохраняется
+        self.is_excluded = is_excluded # is_excluded(chat_id) -> True: чат занят другой задачей (удаляется), не сканируем
+        self.checkpoint = checkpoint # AnalysisCheckpoint или None
+        self.resume = resume # ResumePoint прерванного анализа или None
+        self.resumed_chats = 0 # чаты, итоги которых взяты из контрольной точки
+        self.position_every = config.CHECKPOINT_POSITION_MESSAGES if checkpoint else 0
+        self.windows = {} # {chat_id: (min_id, top_message)} сканируемых чатов - для позиции в контрольной точке
+        self.dialogs_failed = False # обход диалогов оборвался ошибкой (итоги неполные)
+        self.early_stop_at = early_stop_at # порог ранней остановки (число триггеров) или None
+        # двухфазный анализ (SAMPLE_PRESCAN)
+        self.samples = {} # {chat_id: ChatSample} первой фазы
+        self.known_chats = set() # чаты, которые уже сканировались раньше (есть в хранилище scan_state)
+        self.sample_suspicion = 0.0 # доля сообщений с триггерами, выше которой - полное сканирование
+        self.sampled_chats = 0
+
+    @property
+    def cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.is_set()
+
+    def chat_matcher(self, chat_id):
+        # объект с match(text) для сообщений чата: через кэш совпадений, если он включен
+        if self.match_cache and self.matcher: return self.match_cache.for_chat(chat_id)
+        return self.matcher
+
+    def save_position(self, chat_id, scan, offset_id, message_count):
+        # позиция внутри длинного чата: после падения он продолжается с середины
+        if not self.checkpoint: return
+        position = scan.snapshot(offset_id, message_count)
+        position["min_id"], position["top_message"] = self.windows[chat_id]
+        self.checkpoint.record_position(chat_id, position)
+
+
+def _dialog_top_message(dialog):
+    # id последнего сообщения диалога (из самого iter_dialogs, без запросов)
+    top_message = getattr(getattr(dialog, 'dialog', None), 'top_message', None)
+    if top_message is None and getattr(dialog, 'message', None) is not None:
+        top_message = dialog.message.id
+    return top_message or 0
+
+
+def _merge_prior(scan, prior):
+    # новые сообщения (id выше max_id) + сохраненные итоги прошлых анализов
+    scan.lower_bound = scan.lower_bound or prior.get("lower_bound", False)
+    scan.term_count += prior["count"]
+    scan.message_count += prior["message_count"]
+    scan.found_triggers.update(prior["found_triggers"])
+    scan.trigger_ids.extend(prior["trigger_ids"])
+
+
+def _prior_entry(ctx, chat_id):
+    # (сохраненные итоги чата или None, взяты ли они из контрольной точки)
+    checkpointed = ctx.resume.chats.get(chat_id) if ctx.resume else None
+    prior = checkpointed or (ctx.scan_state.get(chat_id) if ctx.scan_state else None)
+    if prior and prior.get("lower_bound") and (ctx.early_stop_at is None or prior["count"] <= ctx.early_stop_at):
+        # прошлый анализ остановился на пороге, а сейчас нужны точные итоги (или порог поднят /threshold) - сканируем заново
+        return None, False
+    return prior, checkpointed is not None
+
+
+def _sample_window(ctx, dialog):
+    # min_id для выборки первой фазы или None - чат загружать не нужно (свой, белый список, без изменений)
+    entity = dialog.entity
+    if isinstance(entity, User) and (entity.is_self or entity.id in ctx.whitelist_ids): return None
+    prior, _ = _prior_entry(ctx, dialog.id)
+    top_message = _dialog_top_message(dialog)
+    if prior and top_message and prior["top_message"] == top_message: return None
+    if prior and ctx.early_stop_at is not None and prior["count"] > ctx.early_stop_at: return None
+    if ctx.resume and dialog.id in ctx.resume.positions: return None
+    return prior["max_id"] if prior else 0
+
+
+async def _scan_dialog(ctx, dialog, dialog_number):
+    # сканирует один диалог, возвращает (статус, ChatResult, id сообщений с триггерами)
+    # статус: "self" - чат с собой, "whitelisted", "scanned", "sampled" - только выборка, "skipped" - нет доступа/ошибка
+    entity = dialog.entity
+    chat_id = dialog.id
+    if ctx.entity_cache:
+        title = (await ctx.entity_cache.remember(entity, chat_id))["title"]
+    else:
+        title = await get_entity_title(entity)
 
-                    if text_to_check and terms:
-                        cleaned_text = clean_text_for_matching(text_to_check)
-                        words_in_message = set(cleaned_text.split())
-                        for term in terms:
-                            if term in words_in_message:
-                                term_count += 1
-                                found_triggers_in_chat.add(term)
-                                message_found_trigger = True # Помечаем сообщение
+    is_self_chat = isinstance(entity, User) and entity.is_self
+    if is_self_chat:
+        return "self", None, None
 
+    is_whitelisted_by_id = isinstance(entity, User) and entity.id in ctx.whitelist_ids
+    if is_whitelisted_by_id:
+         logger.info(f"telethon: чат с '{title}' (id: {chat_id}) в белом списке.")
+         return "whitelisted", ChatResult(chat_id, title, is_whitelisted=True), None
 
-                    if message_found_trigger:
-                        trigger_message_ids_in_chat.append(message.id)
+    if ctx.is_excluded and ctx.is_excluded(chat_id):
+        logger.info(f"telethon: чат '{title}' (id: {chat_id}) сейчас удаляется другой задачей, пропускаю.")
+        return "skipped", ChatResult(chat_id, title), None
 
+    # инкрементальный режим и продолжение с контрольной точки: если top_message не сдвинулся, берем сохраненные итоги без запросов
+    top_message = _dialog_top_message(dialog)
+    prior, checkpointed = _prior_entry(ctx, chat_id)
+    if prior and ctx.early_stop_at is not None and prior["count"] > ctx.early_stop_at and prior["top_message"] != top_message:
+        # уже кандидат на полное удаление: новые сообщения только увеличат число триггеров
+        logger.debug(f"telethon: чат '{title}' уже выше порога удаления, новые сообщения не загружаю.")
+        ctx.history[chat_id] = prior.get("history")
+        return "unchanged", ChatResult(chat_id, title, prior["count"], prior["message_count"], prior["found_triggers"], count_lower_bound=True), id_buffer(prior["trigger_ids"])
+    if prior and top_message and prior["top_message"] == top_message:
+        ctx.history[chat_id] = prior.get("history")
+        if checkpointed:
+            ctx.resumed_chats += 1
+            if ctx.scan_state: ctx.scan_state.put(chat_id, prior)
+            logger.debug(f"telethon: чат '{title}' взят из контрольной точки анализа.")
+        else:
+            ctx.unchanged_chats += 1
+            logger.debug(f"telethon: чат '{title}' не изменился с прошлого анализа.")
+        return "unchanged", ChatResult(chat_id, title, prior["count"], prior["message_count"], prior["found_triggers"], count_lower_bound=prior.get("lower_bound", False)), id_buffer(prior["trigger_ids"])
 
-                    if message_count % 500 == 0: await asyncio.sleep(0.05)
+    min_id = prior["max_id"] if prior else 0
+    position = ctx.resume.positions.get(chat_id) if ctx.resume else None
+    sample = ctx.samples.pop(chat_id, None)
+    if sample is not None and sample.min_id == min_id:
+        scan = ChatScan()
+        scan.max_seen_id = min_id
+        sample.seed(scan)
+        if sample.complete or scan.over_threshold(ctx.early_stop_at):
+            # выборка уже содержит всю историю (или чат уже выше порога удаления)
+            strategy = None
+            scan.complete = sample.complete
+        elif sample.density <= ctx.sample_suspicion and chat_id in ctx.known_chats:
+            # чат проверялся раньше и в выборке чисто (ниже порога подозрительности): полностью не загружаем
+            if prior: _merge_prior(scan, prior)
+            ctx.sampled_chats += 1
+            logger.debug(f"telethon: чат '{title}': только выборка ({len(sample.messages)} сообщений, триггеров: {scan.term_count}).")
+            return "sampled", ChatResult(chat_id, title, scan.term_count, scan.message_count, scan.found_triggers, count_lower_bound=scan.lower_bound, sampled=True), scan.trigger_ids
+        else:
+            # подозрительный или новый чат: полная загрузка, начиная после выборки
+            strategy = STRATEGIES["full"]
+            logger.info(f"telethon: анализирую чат ({dialog_number}): {title} (id: {chat_id}, после выборки: доля триггеров {sample.density:.2f})" + (f", новые после id {min_id}" if min_id else ""))
+    elif position and position["min_id"] == min_id:
+        # чат не досканирован в прерванном анализе: продолжаем загрузку со старых сообщений
+        strategy = STRATEGIES["full"]
+        scan = ChatScan.from_snapshot(position)
+        top_message = position["top_message"] # более новые сообщения дочитает следующий анализ
+        logger.info(f"telethon: продолжаю чат ({dialog_number}): {title} (id: {chat_id}) с контрольной точки, просмотрено {scan.message_count}, дальше id < {scan.offset_id}")
+    else:
+        strategy = await choose_strategy(ctx, chat_id, entity, top_message, min_id)
+        logger.info(f"telethon: анализирую чат ({dialog_number}): {title} (id: {chat_id}, стратегия: {strategy.name})" + (f", новые после id {min_id}" if min_id else ""))
+        scan = ChatScan()
+        scan.max_seen_id = min_id
+    ctx.windows[chat_id] = (min_id, top_message)
 
-                chat_analysis.append({
-                    "id": chat_id, "title": title, "count": term_count,
-                    "message_count": message_count, "found_triggers": list(found_triggers_in_chat),
-                    "is_whitelisted": False
+    try:
+        if strategy: await strategy.scan(ctx, scan, chat_id, top_message, min_id, entity)
 
-                })
+        logger.info(f"telethon: чат '{title}': найдено {scan.term_count} триггеров в {len(scan.trigger_ids)} сообщениях (всего: {scan.message_count})" + (", остановлено на пороге." if scan.lower_bound else "."))
+        history = ctx.history[chat_id] = scan.history_facts(min_id, prior)
+        if prior: _merge_prior(scan, prior) # дописываем новые сообщения к сохраненным итогам
+        if ctx.scan_state or ctx.checkpoint:
+            entry = state_entry(top_message, scan.max_seen_id, scan.term_count, scan.message_count, scan.found_triggers, scan.trigger_ids, history, scan.lower_bound)
+            if ctx.scan_state: ctx.scan_state.put(chat_id, entry)
+            if ctx.checkpoint: ctx.checkpoint.record_chat(chat_id, entry)
+        if ctx.limiter: await ctx.limiter.on_success()
+        return "scanned", ChatResult(chat_id, title, scan.term_count, scan.message_count, scan.found_triggers, count_lower_bound=scan.lower_bound), scan.trigger_ids
 
-                if trigger_message_ids_in_chat:
-                    messages_with_triggers[chat_id] = trigger_message_ids_in_chat
+    except errors.FloodWaitError as e:
+         logger.warning(f"telethon: floodwait для '{title}'. ждем {e.seconds}с.")
+         if ctx.limiter: ctx.limiter.on_flood_wait()
+         # Сохраняем что успели (в инкрементальное состояние неполный скан не пишем): чат просмотрен не весь - число триггеров только нижняя оценка
+         if prior: _merge_prior(scan, prior)
+         raise _FloodWaitRescan(e.seconds, ("scanned", ChatResult(chat_id, title, scan.term_count, scan.message_count, scan.found_triggers, count_lower_bound=True), scan.trigger_ids))
+    except (errors.ChannelPrivateError, errors.ChatForbiddenError):
+         logger.warning(f"telethon: нет доступа к '{title}'.")
+         return "skipped", ChatResult(chat_id, title), None
+    except Exception as e:
+        logger.error(f"telethon: не удалось прочитать '{title}': {e}.")
+        return "skipped", ChatResult(chat_id, title), None
 
-                logger.info(f"telethon: чат '{title}': найдено {term_count} триггеров в {len(trigger_message_ids_in_chat)} сообщениях (всего: {message_count}).")
 
-            except errors.FloodWaitError as e:
-                 logger.warning(f"telethon: floodwait для '{title}'. ждем {e.seconds}с.")
-                 await asyncio.sleep(e.seconds + 1)
-                 chat_analysis.append({"id": chat_id, "title": title, "count": term_count, "message_count": message_count, "found_triggers": list(found_triggers_in_chat), "is_whitelisted": False})
-                 if trigger_message_ids_in_chat: messages_with_triggers[chat_id] = trigger_message_ids_in_chat # Сохраняем что успели
-            except (errors.ChannelPrivateError, errors.ChatForbiddenError):
-                 logger.warning(f"telethon: нет доступа к '{title}'.")
-                 skipped_dialogs += 1; chat_analysis.append({"id": chat_id, "title": title, "count": 0, "message_count": 0, "found_triggers": [], "is_whitelisted": False})
-            except Exception as e:
-                logger.error(f"telethon: не удалось прочитать '{title}': {e}.")
-                skipped_dialogs += 1; chat_analysis.append({"id": chat_id, "title": title, "count": 0, "message_count": 0, "found_triggers": [], "is_whitelisted": False})
+async def _scan_dialog_retrying(ctx, dialog, dialog_number, slot=None):
+    # _scan_dialog в слоте параллельности slot; при floodwait слот освобождается на время ожидания,
+    # и чат сканируется заново (до FLOOD_WAIT_RESCANS раз), потом берется уже просмотренное
+    for attempt in range(config.FLOOD_WAIT_RESCANS + 1):
+        try:
+            if slot is None: return await _scan_dialog(ctx, dialog, dialog_number)
+            async with slot: return await _scan_dialog(ctx, dialog, dialog_number)
+        except _FloodWaitRescan as flood:
+            partial = flood.partial
+            await asyncio.sleep(flood.seconds + 1)
+            if ctx.cancelled: break
+    logger.warning(f"telethon: чат '{partial[1].title}' не досканирован из-за floodwait, число триггеров - нижняя оценка.")
+    return partial
 
-            await asyncio.sleep(0.1)
 
+async def _iter_dialogs_safe(ctx):
+    # обходит диалоги, floodwait/ошибки при получении списка завершают обход (как и раньше),
+    # но анализ тогда считается неполным и контрольная точка сохраняется
+    progress = ctx.progress
+    try:
+        dialogs = ctx.client.iter_dialogs(limit=None)
+        async for dialog in rate_limiter.paced("GetDialogs", dialogs, DIALOGS_PAGE_SIZE):
+            # общее число диалогов известно после первой страницы (для прогресса и ETA)
+            if progress and getattr(dialogs, "total", None): progress.update(total=dialogs.total)
+            yield dialog
     except errors.FloodWaitError as e:
+        ctx.dialogs_failed = True
         logger.error(f"telethon: floodwait при получении диалогов. ждем {e.seconds}с...")
         await asyncio.sleep(e.seconds + 1)
     except Exception as e:
+        ctx.dialogs_failed = True
         logger.error(f"telethon: критическая ошибка парсинга диалогов: {e}", exc_info=True)
 
-    logger.info(f"telethon: анализ завершен. проанализировано: {processed_chats}. пропущено: {skipped_dialogs}.")
-    # Возвращаем ОБА результата
-    return chat_analysis, messages_with_triggers
\ No newline at end of file
+
+def _report_dialog(ctx, result):
+    status, chat_info, _ = result
+    if ctx.progress:
+        ctx.progress.update(done=1, note=f"{chat_info['title']}: триггеров {chat_info['count']}" if status == "scanned" else None)
+
+
+async def _iter_list(items):
+    for item in items:
+        yield item
+
+
+async def _scan_sequential(ctx, dialogs, on_result):
+    # последовательный обход: один чат за раз; итог каждого чата сразу уходит в on_result(номер диалога, результат)
+    index = 0
+    async for dialog in dialogs:
+        if ctx.cancelled: break
+        result = await _scan_dialog_retrying(ctx, dialog, index + 1)
+        await on_result(index, result)
+        index += 1
+        _report_dialog(ctx, result)
+        if result[0] in ("scanned", "skipped"): await asyncio.sleep(0.1)
+
+
+async def _scan_concurrent(ctx, concurrency, dialogs, on_result):
+    # пул воркеров, который получает диалоги из iter_dialogs через ограниченную очередь
+    # итоги уходят в on_result по мере готовности (не по порядку диалогов, номер диалога передается)
+    limiter = ctx.limiter = AdaptiveConcurrency(concurrency)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None: return
+                index, dialog = item
+                if ctx.cancelled: continue
+                result = await _scan_dialog_retrying(ctx, dialog, index + 1, limiter)
+                await on_result(index, result)
+                _report_dialog(ctx, result)
+                if result[0] in ("scanned", "skipped"): await asyncio.sleep(0.1)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        dialog_count = 0
+        async for dialog in dialogs:
+            if ctx.cancelled: break
+            await queue.put((dialog_count, dialog))
+            dialog_count += 1
+        for _ in workers: await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers: task.cancel()
+
+
+async def analyze_chats_job(terms, whitelist_ids, fetch_limit, concurrency=None, incremental=None, strategy=None, progress=None, cancel_token=None, is_excluded=None, resume=False, early_stop=None, sample_prescan=None, matcher=None, policy=None, sink=None):
+    # основная функция анализа чатов (возвращает AnalysisResults: чаты + ID сообщений с триггерами)
+    # sink: await sink(номер диалога, ChatResult, id сообщений с триггерами, сведения об истории) - итоги чатов по мере
+    #   сканирования (например, RunWriter хранилища); тогда в AnalysisResults только сводные поля, без чатов
+    # concurrency: сколько чатов сканировать одновременно (по умолчанию config.ANALYSIS_CONCURRENCY, 1 = последовательно)
+    # incremental: дочитывать только новые сообщения по сохраненным отметкам (по умолчанию config.INCREMENTAL_ANALYSIS)
+    # strategy: "full" - загрузка истории, "search" - серверный поиск по триггерам, "auto" - выбор по чату (config.SCAN_STRATEGY)
+    # progress: ProgressReporter - счетчик диалогов и последний просканированный чат
+    # cancel_token: asyncio.Event - остановка между чатами, возвращаются итоги уже просканированных
+    # is_excluded: is_excluded(chat_id) - чаты, которые сейчас удаляются другой задачей (пропускаются)
+    # resume: продолжить прерванный анализ с контрольной точки (иначе она начинается заново)
+    # early_stop: не загружать чат дальше, когда триггеров больше порога (по умолчанию config.EARLY_STOP_SCAN)
+    # policy: ThresholdPolicy - порог удаления для early_stop (по умолчанию из config); при пороге по доле (density) остановки нет
+    # sample_prescan: двухфазный анализ - выборка всех чатов, затем полная загрузка подозрительных и новых (config.SAMPLE_PRESCAN)
+    # matcher: готовый TermMatcher (например, из get_term_index()), тогда terms не используются
+    client = get_telethon_client()
+    if concurrency is None: concurrency = config.ANALYSIS_CONCURRENCY
+    if incremental is None: incremental = config.INCREMENTAL_ANALYSIS
+    if strategy is None: strategy = config.SCAN_STRATEGY
+    if early_stop is None: early_stop = config.EARLY_STOP_SCAN
+    if sample_prescan is None: sample_prescan = config.SAMPLE_PRESCAN
+    if policy is None: policy = ThresholdPolicy()
+    # доля триггеров известна только по всему чату - на пороге density загрузка не останавливается
+    if policy.mode != "count": early_stop = False
+    if matcher is None: matcher = TermMatcher(terms) # строится один раз на весь анализ
+    fingerprint = terms_fingerprint(matcher.terms, fetch_limit)
+    scan_state = None
+    if incremental:
+        scan_state = get_scan_state()
+        scan_state.ensure_fingerprint(fingerprint)
+    # контрольная точка: итоги каждого чата дописываются в журнал, после падения/остановки - /analyze resume
+    checkpoint = get_analysis_checkpoint()
+    resume_point = checkpoint.load(fingerprint) if resume else None
+    if resume and resume_point is None: logger.info("telethon: контрольной точки нет, анализ с начала.")
+    checkpoint.open(fingerprint, resume=resume_point is not None)
+    match_pool = create_match_pool(matcher, config.MATCH_WORKERS, config.MATCH_EXECUTOR, config.MATCH_BATCH_SIZE)
+    entity_cache = get_entity_cache()
+    match_cache = MatchCache(matcher, config.MATCH_CACHE_BYTES) if config.MATCH_CACHE_BYTES and matcher else None
+    ctx = ScanContext(client, matcher, whitelist_ids, fetch_limit, scan_state, strategy_mode=strategy, match_pool=match_pool, entity_cache=entity_cache, progress=progress, cancel_token=cancel_token, is_excluded=is_excluded, checkpoint=checkpoint, resume=resume_point,
+                      early_stop_at=policy.value if early_stop else None, match_cache=match_cache)
+    results = AnalysisResults() # чаты + {chat_id: array('q') id сообщений с триггерами}
+    collected = {} # без sink: {номер диалога: (ChatResult, id сообщений, история)}
+    skipped_dialogs = 0
+    processed_chats = 0
+
+    async def on_result(index, result):
+        nonlocal skipped_dialogs, processed_chats
+        status, chat_info, trigger_message_ids_in_chat = result
+        if status in ("self", "whitelisted", "skipped"): skipped_dialogs += 1
+        if status in ("scanned", "sampled", "skipped"): processed_chats += 1
+        if chat_info is None: return
+        # сведения о чате больше не нужны анализу - не копим их до конца обхода
+        history = ctx.history.pop(chat_info.id, None)
+        ctx.windows.pop(chat_info.id, None)
+        if sink: await sink(index, chat_info, trigger_message_ids_in_chat, history)
+        else: collected[index] = (chat_info, trigger_message_ids_in_chat, history)
+
+    logger.info(f"telethon: начинаю парсинг диалогов и сообщений (с поиском ID сообщений, параллельно: {concurrency}, инкрементально: {bool(incremental)}, стратегия: {strategy}, остановка на пороге: {bool(early_stop)})...")
+
+    try:
+        dialogs = _iter_dialogs_safe(ctx)
+        if sample_prescan:
+            # фаза 1: список диалогов и выборка последних сообщений; фаза 2 - обычный обход с учетом выборок
+            dialog_list = [dialog async for dialog in dialogs]
+            # "проверялся раньше" - только по итогам с теми же триггерами, лимитом и нормализацией
+            known_state = scan_state or get_scan_state()
+            ctx.known_chats = set(known_state.chats) if known_state.fingerprint == fingerprint else set()
+            ctx.sample_suspicion = config.SAMPLE_SUSPICION
+            targets = [(dialog, min_id) for dialog in dialog_list if (min_id := _sample_window(ctx, dialog)) is not None]
+            sample_size = min(config.SAMPLE_SIZE, fetch_limit) if fetch_limit else config.SAMPLE_SIZE
+            ctx.samples = await collect_samples(ctx, targets, sample_size, config.SAMPLE_BATCH)
+            dialogs = _iter_list(dialog_list)
+        if concurrency > 1:
+            await _scan_concurrent(ctx, concurrency, dialogs, on_result)
+        else:
+            await _scan_sequential(ctx, dialogs, on_result)
+    finally:
+        if match_pool: match_pool.shutdown()
+        if scan_state: scan_state.save()
+        entity_cache.save()
+        checkpoint.close() # при исключении журнал остается для /analyze resume
+
+    # собираем в порядке диалогов, чтобы результат совпадал с последовательным режимом
+    for index in sorted(collected):
+        chat_info, trigger_message_ids_in_chat, history = collected[index]
+        results.add_chat(chat_info, trigger_message_ids_in_chat)
+        if history: results.history[chat_info.id] = history
+
+    results.stopped = ctx.cancelled
+    results.resumed_chats = ctx.resumed_chats
+    results.sampled = sample_prescan
+    if match_cache:
+        results.match_cache_stats = match_cache.stats()
+        results.duplicates = match_cache.duplicates(config.DUPLICATE_MIN_CHATS)
+        logger.info(f"telethon: кэш совпадений: {results.match_cache_stats}. текстов с триггерами в {config.DUPLICATE_MIN_CHATS}+ чатах: {len(results.duplicates)}.")
+    results.resumable = ctx.cancelled or ctx.dialogs_failed
+    if not results.resumable: checkpoint.discard() # анализ полный - продолжать нечего
+    logger.info(f"telethon: анализ {'остановлен' if ctx.cancelled else 'завершен'}. проанализировано: {processed_chats}. без изменений: {ctx.unchanged_chats}. из контрольной точки: {ctx.resumed_chats}. только выборка: {ctx.sampled_chats}. пропущено: {skipped_dialogs}.")
+    if results.resumable: logger.info("telethon: анализ неполный, контрольная точка сохранена (/analyze resume).")
+    return results
@@ -16,7 +16,9 @@ async def init_telethon_client():
         return telethon_client
 
     logger.info("инициализация клиента telethon...")
-    telethon_client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH)
+    # flood_sleep_threshold=0: telethon не ждет floodwait сам (по умолчанию молча спит до 60с),
+    # ошибка доходит до общего планировщика запросов (rate_limiter), который снижает скорость и выжидает паузу
+    telethon_client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH, flood_sleep_threshold=0)
 
     try:
         logger.info("подключение клиента telethon...")
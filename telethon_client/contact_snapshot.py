@@ -0,0 +1,111 @@
+# telethon_client/contact_snapshot.py
+# последний полученный список контактов + его hash: повторный GetContacts возвращает contactsNotModified
+import asyncio
+import base64
+import json
+import logging
+import os
+
+from telethon import functions, types
+from telethon.extensions import BinaryReader
+from telethon.tl.alltlobjects import LAYER
+
+import config
+from .rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def contacts_hash(saved_count, user_ids):
+    # hash для GetContacts по алгоритму Telegram: saved_count, затем отсортированные id контактов (до 100000)
+    acc = 0
+    for value in [saved_count] + sorted(user_ids)[:100000]:
+        acc ^= acc >> 21
+        acc ^= (acc << 35) & _MASK
+        acc ^= acc >> 4
+        acc = (acc + value) & _MASK
+    return acc - (1 << 64) if acc >= 1 << 63 else acc
+
+
+class ContactSnapshot:
+    """
+    users - User из последнего ответа GetContacts (с access_hash), contact_ids -
+    id контактов из того же ответа, saved_count - contacts.saved_count.
+    Снимок хранится на диске (User сериализуются в TL-байты, при смене слоя
+    схемы снимок сбрасывается). Если посчитанный hash не совпадет с серверным,
+    сервер просто вернет полный список - как при hash=0.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.users = []
+        self.contact_ids = []
+        self.saved_count = 0
+        self.hash = 0
+        self._lock = asyncio.Lock()
+        self._dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("layer") != LAYER: return self
+            users = [BinaryReader(base64.b64decode(raw)).tgread_object() for raw in data["users"]]
+            self.users, self.contact_ids, self.saved_count, self.hash = users, data["contact_ids"], data["saved_count"], data["hash"]
+            logger.info(f"загружен снимок контактов: {len(self.users)}.")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"не удалось прочитать снимок контактов {self.path}: {e}")
+        return self
+
+    def save(self):
+        if not self._dirty: return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "layer": LAYER, "hash": self.hash, "saved_count": self.saved_count, "contact_ids": self.contact_ids,
+                    "users": [base64.b64encode(bytes(user)).decode('ascii') for user in self.users],
+                }, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"не удалось сохранить снимок контактов {self.path}: {e}")
+
+    async def get_users(self, client):
+        # актуальный список контактов (запрос с hash снимка; один запрос на все одновременные вызовы)
+        async with self._lock:
+            response = await rate_limiter.call("GetContacts", client, functions.contacts.GetContactsRequest(hash=self.hash if self.users else 0))
+            if isinstance(response, types.contacts.ContactsNotModified):
+                logger.info(f"telethon: контакты не изменились, беру из снимка ({len(self.users)}).")
+                return list(self.users)
+            self.users = list(response.users)
+            self.contact_ids = [contact.user_id for contact in response.contacts]
+            self.saved_count = response.saved_count
+            self.hash = contacts_hash(self.saved_count, self.contact_ids)
+            self._dirty = True
+            self.save()
+            logger.info(f"telethon: получен список контактов: {len(self.users)}.")
+            return list(self.users)
+
+    def forget(self, user_ids):
+        # контакты удалены нами: убираем их из снимка, чтобы следующий запрос снова совпал по hash
+        user_ids = set(user_ids)
+        if not user_ids: return
+        self.users = [user for user in self.users if user.id not in user_ids]
+        self.contact_ids = [user_id for user_id in self.contact_ids if user_id not in user_ids]
+        self.hash = contacts_hash(self.saved_count, self.contact_ids)
+        self._dirty = True
+        self.save()
+
+
+_snapshot = None
+
+def get_contact_snapshot() -> ContactSnapshot:
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = ContactSnapshot(config.CONTACTS_SNAPSHOT_FILE).load()
+    return _snapshot
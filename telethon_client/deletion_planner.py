@@ -0,0 +1,86 @@
+# telethon_client/deletion_planner.py
+# выбор самого дешевого способа удалить сообщения с триггерами в каждом чате
+import math
+
+from .entity_cache import get_entity_cache
+
+CHUNK_SIZE = 100 # лимит id в одном DeleteMessages
+# ориентировочно: столько сообщений сервер удаляет за один вызов DeleteHistory
+# (если удалено не все, сервер возвращает offset и вызов повторяется)
+BULK_DELETE_BATCH = 1000
+
+METHOD_TITLES = {
+    "ids": "пачки по 100 id",
+    "history": "история до id (DeleteHistory)",
+}
+
+
+def chunk_ops(chat_id, ids):
+    # обычное удаление: пачки по CHUNK_SIZE id (ids - список, array('q') или memoryview)
+    ops = []
+    for i in range(0, len(ids), CHUNK_SIZE):
+        chunk_ids = ids[i:i + CHUNK_SIZE]
+        if not isinstance(chunk_ids, list): chunk_ids = chunk_ids.tolist()
+        ops.append({"op": "ids", "chat_id": chat_id, "ids": chunk_ids})
+    return ops
+
+
+def op_rpc_estimate(op):
+    if op["op"] == "ids": return 1
+    return max(1, math.ceil(op["count"] / BULK_DELETE_BATCH))
+
+
+class ChatDeletionPlan:
+    # операции удаления одного чата + оценка числа запросов
+    __slots__ = ("chat_id", "method", "ops", "message_count")
+
+    def __init__(self, chat_id, method, ops, message_count):
+        self.chat_id = chat_id
+        self.method = method # "ids" или "history"
+        self.ops = ops
+        self.message_count = message_count
+
+    @property
+    def rpc_estimate(self):
+        return sum(op_rpc_estimate(op) for op in self.ops)
+
+    @property
+    def chunk_rpc(self):
+        # сколько запросов понадобилось бы при удалении пачками по 100
+        return math.ceil(self.message_count / CHUNK_SIZE)
+
+
+def plan_chat(chat_id, ids, history=None, entity_cache=None):
+    """
+    history - сведения анализа об истории чата (ChatScan.history_facts):
+    reached_start - просмотрена вся история, min_clean_id - наименьший id
+    сообщения без триггеров.
+    Массовое удаление выбирается только когда оно гарантированно не заденет
+    сообщения без триггеров, иначе - пачки id. DeleteHistory(max_id) ограничен
+    id и не заденет сообщения, пришедшие после анализа; DeleteParticipantHistory
+    не используется - он удаляет все наши сообщения на момент вызова, а не
+    только просмотренные анализом.
+    """
+    entity_cache = entity_cache or get_entity_cache()
+    peer_type = entity_cache.peer_type(chat_id)
+    if history and history.get("reached_start") and peer_type in ("user", "bot"):
+        # личный чат: все сообщения с id < min_clean_id содержат триггеры - их удаляет DeleteHistory(max_id)
+        min_clean_id = history["min_clean_id"]
+        prefix = [message_id for message_id in ids if not min_clean_id or message_id < min_clean_id]
+        history_op = {"op": "history", "chat_id": chat_id, "max_id": max(prefix, default=0), "count": len(prefix)}
+        if prefix and op_rpc_estimate(history_op) < math.ceil(len(prefix) / CHUNK_SIZE):
+            rest = [message_id for message_id in ids if min_clean_id and message_id >= min_clean_id]
+            return ChatDeletionPlan(chat_id, "history", [history_op] + chunk_ops(chat_id, rest), len(ids))
+    return ChatDeletionPlan(chat_id, "ids", chunk_ops(chat_id, ids), len(ids))
+
+
+def plan_message_deletion(messages_to_delete, history=None, entity_cache=None):
+    # {chat_id: ids} -> {chat_id: ChatDeletionPlan}
+    history = history or {}
+    return {chat_id: plan_chat(chat_id, ids, history.get(chat_id), entity_cache)
+            for chat_id, ids in messages_to_delete.items() if len(ids)}
+
+
+def plan_totals(plans):
+    # (оценка запросов по плану, запросов при удалении пачками по 100)
+    return sum(plan.rpc_estimate for plan in plans.values()), sum(plan.chunk_rpc for plan in plans.values())
@@ -0,0 +1,203 @@
+# telethon_client/deletion_queue.py
+# постоянная очередь удаления (sqlite): переживает падение/перезапуск процесса
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+import uuid
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3 # после стольких неудачных попыток элемент уходит в dead-letter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deletion_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    batch TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    chat_id INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deletion_items_status ON deletion_items (status, kind, batch);
+"""
+
+
+def _ids_key(ids):
+    return hashlib.sha1(",".join(map(str, ids)).encode()).hexdigest()[:16]
+
+
+class DeletionItem:
+    __slots__ = ("id", "key", "batch", "kind", "chat_id", "payload", "status", "attempts", "last_error")
+
+    def __init__(self, row):
+        (self.id, self.key, self.batch, self.kind, self.chat_id, payload,
+         self.status, self.attempts, self.last_error) = row
+        self.payload = json.loads(payload)
+
+
+class DeletionQueue:
+    """
+    Элементы удаления: "chat" (один диалог), "messages" (операция удаления сообщений
+    в чате из планировщика: пачка до 100 id или удаление истории до id),
+    "contacts" (пачка до 100 контактов с access_hash). У каждого элемента -
+    идемпотентный ключ, статус (pending/running/done/dead), число попыток и последняя ошибка.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    # --- постановка в очередь ---
+
+    def _enqueue(self, batch, rows):
+        # rows: [(key, kind, chat_id, payload)]; ожидающие (pending) и завершенные (done/dead) элементы с тем же
+        # ключом переходят в новое задание, выполняемый сейчас другой задачей (running) второй раз не ставится
+        now = time.time()
+        running = 0
+        for start in range(0, len(rows), 500):
+            keys = [row[0] for row in rows[start:start + 500]]
+            running += self.conn.execute(
+                f"SELECT COUNT(*) FROM deletion_items WHERE status = 'running' AND key IN ({','.join('?' * len(keys))})", keys).fetchone()[0]
+        if running: logger.warning(f"очередь удаления: {running} элементов уже выполняются другой задачей, в новое задание не вошли.")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO deletion_items (key, batch, kind, chat_id, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET batch = excluded.batch, payload = excluded.payload, status = 'pending', attempts = 0, last_error = NULL, updated_at = excluded.updated_at "
+                "WHERE deletion_items.status IN ('pending', 'done', 'dead')",
+                [(key, batch, kind, chat_id, json.dumps(payload), now, now) for key, kind, chat_id, payload in rows])
+        return batch
+
+    def enqueue_chats(self, chat_ids):
+        batch = uuid.uuid4().hex
+        return self._enqueue(batch, [(f"chat:{chat_id}", "chat", chat_id, {"chat_id": chat_id}) for chat_id in chat_ids])
+
+    def enqueue_messages(self, ops):
+        # операции из планировщика удаления (deletion_planner): пачки id, DeleteHistory
+        batch = uuid.uuid4().hex
+        rows = []
+        for op in ops:
+            chat_id = op["chat_id"]
+            if op["op"] == "ids": key = f"msgs:{chat_id}:{_ids_key(op['ids'])}"
+            elif op["op"] == "history": key = f"history:{chat_id}:{op['max_id']}"
+            else: key = f"{op['op']}:{chat_id}"
+            rows.append((key, "messages", chat_id, op))
+        return self._enqueue(batch, rows)
+
+    def enqueue_contacts(self, users, chunk_size=100):
+        # users: [(user_id, access_hash, display_name)]
+        batch = uuid.uuid4().hex
+        rows = []
+        for i in range(0, len(users), chunk_size):
+            chunk = users[i:i + chunk_size]
+            rows.append((f"contacts:{_ids_key(sorted(u[0] for u in chunk))}", "contacts", None, {"users": chunk}))
+        return self._enqueue(batch, rows)
+
+    # --- выборка и статусы ---
+
+    def claim_next(self, kind, batch=None, after_id=0):
+        # берет следующий pending-элемент (id > after_id, чтобы один проход не крутился на неудачном) и помечает его running
+        query = "SELECT id, key, batch, kind, chat_id, payload, status, attempts, last_error FROM deletion_items WHERE status = 'pending' AND kind = ? AND id > ?"
+        params = [kind, after_id]
+        if batch:
+            query += " AND batch = ?"; params.append(batch)
+        row = self.conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+        if row is None: return None
+        with self.conn:
+            self.conn.execute("UPDATE deletion_items SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?", (time.time(), row[0]))
+        item = DeletionItem(row)
+        item.attempts += 1
+        return item
+
+    def mark_done(self, item):
+        with self.conn:
+            self.conn.execute("UPDATE deletion_items SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?", (time.time(), item.id))
+
+    def mark_failed(self, item, error, permanent=False):
+        # временная ошибка - снова pending (пока есть попытки, повтор в следующем проходе задания), постоянная - сразу dead
+        status = "dead" if permanent or item.attempts >= MAX_ATTEMPTS else "pending"
+        with self.conn:
+            self.conn.execute("UPDATE deletion_items SET status = ?, last_error = ?, updated_at = ? WHERE id = ?", (status, str(error)[:500], time.time(), item.id))
+        return status
+
+    def requeue_interrupted(self):
+        # running после перезапуска = прерванные элементы
+        with self.conn:
+            cur = self.conn.execute("UPDATE deletion_items SET status = 'pending', updated_at = ? WHERE status = 'running'", (time.time(),))
+        return cur.rowcount
+
+    def cancel_pending(self, kind, batch=None, reason="остановлено"):
+        # задача остановлена пользователем или закончила проходы: невыполненное не продолжается само при перезапуске,
+        # а попадает в список неудавшихся (можно повторить через /retryfailed)
+        query = "UPDATE deletion_items SET status = 'dead', last_error = ?, updated_at = ? WHERE status = 'pending' AND kind = ?"
+        params = [reason, time.time(), kind]
+        if batch:
+            query += " AND batch = ?"; params.append(batch)
+        with self.conn:
+            cur = self.conn.execute(query, params)
+        return cur.rowcount
+
+    def retry_dead(self, kind=None):
+        query = "UPDATE deletion_items SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'dead'"
+        params = [time.time()]
+        if kind:
+            query += " AND kind = ?"; params.append(kind)
+        with self.conn:
+            cur = self.conn.execute(query, params)
+        return cur.rowcount
+
+    def counts(self, batch=None):
+        # {kind: {status: count}}
+        query = "SELECT kind, status, COUNT(*) FROM deletion_items"
+        params = []
+        if batch:
+            query += " WHERE batch = ?"; params.append(batch)
+        result = {}
+        for kind, status, count in self.conn.execute(query + " GROUP BY kind, status", params):
+            result.setdefault(kind, {})[status] = count
+        return result
+
+    def prune(self, max_age_days=7):
+        # выполненные элементы нужны только для отчета о задании, старые удаляем
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM deletion_items WHERE status = 'done' AND updated_at < ?", (time.time() - max_age_days * 86400,))
+        return cur.rowcount
+
+    def chat_outcomes(self):
+        # итоги удаления по чатам (для выгрузок): {chat_id: {"chat": статус, "messages": {статус: число операций}}}
+        result = {}
+        for chat_id, kind, status, count in self.conn.execute(
+                "SELECT chat_id, kind, status, COUNT(*) FROM deletion_items WHERE chat_id IS NOT NULL GROUP BY chat_id, kind, status"):
+            outcome = result.setdefault(chat_id, {})
+            if kind == "chat": outcome["chat"] = status
+            else: outcome.setdefault(kind, {})[status] = count
+        return result
+
+    def pending_kinds(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT kind FROM deletion_items WHERE status = 'pending'")]
+
+    def dead_items(self, limit=20):
+        rows = self.conn.execute(
+            "SELECT id, key, batch, kind, chat_id, payload, status, attempts, last_error FROM deletion_items WHERE status = 'dead' ORDER BY id LIMIT ?", (limit,))
+        return [DeletionItem(row) for row in rows]
+
+
+_queue = None
+
+def get_deletion_queue() -> DeletionQueue:
+    global _queue
+    if _queue is None:
+        _queue = DeletionQueue(config.DELETION_QUEUE_DB)
+    return _queue
@@ -0,0 +1,131 @@
+# telethon_client/entity_cache.py
+# постоянный кэш сущностей (название, тип, access_hash, input peer) по id диалога
+import json
+import logging
+import os
+
+from telethon import errors, utils as tl_utils
+from telethon.tl.types import (
+    User, Chat, ChatForbidden, Channel, ChannelForbidden,
+    InputPeerUser, InputPeerChat, InputPeerChannel, InputUser,
+)
+
+import config
+from .utils import get_entity_title
+from .rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def _entity_type(entity):
+    if isinstance(entity, User): return "bot" if entity.bot else "user"
+    if isinstance(entity, (Chat, ChatForbidden)): return "chat"
+    if isinstance(entity, (Channel, ChannelForbidden)): return "megagroup" if getattr(entity, "megagroup", False) else "channel"
+    return "unknown"
+
+
+class EntityCache:
+    """
+    Ключ - id диалога в формате telethon (как dialog.id: пользователи > 0,
+    группы < 0, каналы -100...). Хранит все, что нужно для запросов без
+    get_entity/get_input_entity: название, тип, исходный id и access_hash.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {} # {peer_id: {"title", "type", "id", "access_hash"}}
+        self._dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = {int(peer_id): entry for peer_id, entry in json.load(f).items()}
+            logger.info(f"загружен кэш сущностей: {len(self.entries)}.")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"не удалось прочитать кэш сущностей {self.path}: {e}")
+        return self
+
+    def save(self):
+        if not self._dirty: return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({str(peer_id): entry for peer_id, entry in self.entries.items()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"не удалось сохранить кэш сущностей {self.path}: {e}")
+
+    async def remember(self, entity, peer_id=None):
+        # запоминает сущность из dialog.entity / contacts.users
+        if peer_id is None: peer_id = tl_utils.get_peer_id(entity)
+        entry = {
+            "title": await get_entity_title(entity),
+            "type": _entity_type(entity),
+            "id": entity.id,
+            "access_hash": getattr(entity, "access_hash", None),
+        }
+        if self.entries.get(peer_id) != entry:
+            self.entries[peer_id] = entry
+            self._dirty = True
+        return entry
+
+    def get(self, peer_id):
+        return self.entries.get(peer_id)
+
+    def title(self, peer_id, default=None):
+        entry = self.entries.get(peer_id)
+        return entry["title"] if entry else (default if default is not None else f"ID {peer_id}")
+
+    def input_peer(self, peer_id):
+        # InputPeer* из кэша (None, если сущность неизвестна или без access_hash)
+        entry = self.entries.get(peer_id)
+        if not entry: return None
+        if entry["type"] == "chat":
+            return InputPeerChat(entry["id"])
+        if entry["access_hash"] is None:
+            return None
+        if entry["type"] in ("user", "bot"):
+            return InputPeerUser(entry["id"], entry["access_hash"])
+        if entry["type"] in ("megagroup", "channel"):
+            return InputPeerChannel(entry["id"], entry["access_hash"])
+        return None
+
+    def peer_type(self, peer_id):
+        entry = self.entries.get(peer_id)
+        return entry["type"] if entry else None
+
+    def input_user(self, user_id):
+        entry = self.entries.get(user_id)
+        if not entry or entry["type"] not in ("user", "bot") or entry["access_hash"] is None: return None
+        return InputUser(entry["id"], entry["access_hash"])
+
+
+_cache = None
+
+def get_entity_cache() -> EntityCache:
+    # общий экземпляр (загружается с диска при первом обращении)
+    global _cache
+    if _cache is None:
+        _cache = EntityCache(config.ENTITY_CACHE_FILE).load()
+    return _cache
+
+
+async def warm_up_entity_cache(client):
+    # один проход по диалогам при старте: после него удаление не делает запросов на получение сущностей
+    cache = get_entity_cache()
+    count = 0
+    try:
+        async for dialog in rate_limiter.paced("GetDialogs", client.iter_dialogs(limit=None)):
+            await cache.remember(dialog.entity, dialog.id)
+            count += 1
+        logger.info(f"кэш сущностей прогрет: {count} диалогов.")
+    except errors.FloodWaitError as e:
+        logger.warning(f"floodwait при прогреве кэша сущностей ({e.seconds}с), прогрето {count} диалогов.")
+    except Exception as e:
+        logger.error(f"ошибка прогрева кэша сущностей: {e}")
+    finally:
+        cache.save()
+    return count
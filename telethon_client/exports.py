@@ -0,0 +1,182 @@
+# telethon_client/exports.py
+# машиночитаемая выгрузка результатов анализа: JSON Lines, CSV и бинарный колоночный снимок
+import csv
+import datetime
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+
+import config
+from .results import AnalysisResults, ChatResult
+from .thresholds import ThresholdPolicy
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("jsonl", "csv", "snapshot")
+EXTENSIONS = {"jsonl": "jsonl", "csv": "csv", "snapshot": "svsnap"}
+
+SNAPSHOT_MAGIC = b"SVSNAP\x00\x01"
+# числовые колонки снимка в порядке записи: (имя, typecode array)
+SNAPSHOT_COLUMNS = (("id", "q"), ("count", "q"), ("message_count", "q"), ("flags", "B"), ("trigger_offsets", "q"), ("trigger_ids", "q"))
+# биты колонки flags
+FLAG_WHITELISTED, FLAG_LOWER_BOUND, FLAG_SAMPLED = 1, 2, 4
+
+CSV_FIELDS = ("id", "title", "count", "count_lower_bound", "message_count", "sampled", "is_whitelisted", "found_triggers",
+              "candidate", "chat_deletion", "message_ops_done", "message_ops_failed", "trigger_message_count", "trigger_ids")
+
+
+def _candidate(chat_id, candidates_for_chat_deletion, candidates_for_msg_deletion):
+    # "chat" - кандидат на удаление чата, "messages" - на удаление сообщений, None - нет
+    if chat_id in candidates_for_chat_deletion: return "chat"
+    if chat_id in candidates_for_msg_deletion: return "messages"
+    return None
+
+
+def _chat_rows(chats):
+    # (ChatResult, id сообщений с триггерами) из AnalysisResults или готового итератора (AnalysisStore.iter_chats)
+    if isinstance(chats, AnalysisResults):
+        return ((chat, chats.messages_with_triggers.get(chat.id)) for chat in chats.chats)
+    return chats
+
+
+def iter_records(chats, candidates_for_chat_deletion=(), candidates_for_msg_deletion=(), outcomes=None):
+    """
+    Одна запись (dict) на чат: поля ChatResult, кандидатство, итоги удаления из
+    очереди (outcomes - DeletionQueue.chat_outcomes()) и id сообщений с триггерами
+    (array('q') из результатов, без копирования). Генератор - выгрузки пишут по записи.
+    chats - AnalysisResults или итератор (ChatResult, id сообщений с триггерами или None).
+    """
+    chat_candidates = {chat["id"] if not isinstance(chat, int) else chat for chat in candidates_for_chat_deletion}
+    outcomes = outcomes or {}
+    for chat, trigger_ids in _chat_rows(chats):
+        outcome = outcomes.get(chat.id, {})
+        record = chat.to_dict()
+        record["candidate"] = _candidate(chat.id, chat_candidates, candidates_for_msg_deletion)
+        record["chat_deletion"] = outcome.get("chat")
+        record["message_ops_done"] = outcome.get("messages", {}).get("done", 0)
+        record["message_ops_failed"] = outcome.get("messages", {}).get("dead", 0)
+        record["trigger_ids"] = trigger_ids if trigger_ids is not None else ()
+        yield record
+
+
+def write_jsonl(path, records):
+    # одна строка JSON на чат; json.dump пишет в файл кусками, без строки на весь документ
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            record["found_triggers"] = list(record["found_triggers"])
+            record["trigger_ids"] = record["trigger_ids"].tolist() if isinstance(record["trigger_ids"], array) else list(record["trigger_ids"])
+            json.dump(record, f, ensure_ascii=False)
+            f.write("\n")
+            count += 1
+    return count
+
+
+def write_csv(path, records):
+    # списки (триггеры, id сообщений) - через пробел в одной ячейке
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for record in records:
+            record["trigger_message_count"] = len(record["trigger_ids"])
+            record["found_triggers"] = " ".join(record["found_triggers"])
+            record["trigger_ids"] = " ".join(map(str, record["trigger_ids"]))
+            writer.writerow([record[field] if record[field] is not None else "" for field in CSV_FIELDS])
+            count += 1
+    return count
+
+
+def write_snapshot(path, chats, candidates_for_chat_deletion=(), candidates_for_msg_deletion=(), outcomes=None, policy=None):
+    """
+    Бинарный колоночный снимок: заголовок (magic, длина метаданных), метаданные JSON
+    (строковые колонки: названия, триггеры, кандидатство, итоги удаления) и числовые
+    колонки SNAPSHOT_COLUMNS - каждая как длина в байтах + содержимое array.
+    id сообщений всех чатов лежат подряд в trigger_ids, границы чатов - trigger_offsets.
+    policy - порог, по которому выбраны кандидаты (в метаданных: threshold и policy - его режим).
+    Чаты (chats - как у iter_records) читаются по одному, в памяти копятся только колонки.
+    """
+    policy = policy or ThresholdPolicy()
+    columns = {name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS}
+    columns["trigger_offsets"].append(0)
+    meta = {"created_at": datetime.datetime.now().isoformat(timespec="seconds"), "byteorder": sys.byteorder,
+            "threshold": policy.value, "policy": policy.mode, "titles": [], "found_triggers": [], "candidate": [],
+            "chat_deletion": [], "message_ops": []}
+    records = iter_records(chats, candidates_for_chat_deletion, candidates_for_msg_deletion, outcomes)
+    for record in records:
+        columns["id"].append(record["id"]); columns["count"].append(record["count"]); columns["message_count"].append(record["message_count"])
+        columns["flags"].append((FLAG_WHITELISTED if record["is_whitelisted"] else 0) | (FLAG_LOWER_BOUND if record["count_lower_bound"] else 0)
+                                | (FLAG_SAMPLED if record["sampled"] else 0))
+        trigger_ids = record["trigger_ids"]
+        if isinstance(trigger_ids, array): columns["trigger_ids"].extend(trigger_ids)
+        else: columns["trigger_ids"].fromlist(list(trigger_ids))
+        columns["trigger_offsets"].append(len(columns["trigger_ids"]))
+        meta["titles"].append(record["title"]); meta["found_triggers"].append(list(record["found_triggers"]))
+        meta["candidate"].append(record["candidate"]); meta["chat_deletion"].append(record["chat_deletion"])
+        meta["message_ops"].append([record["message_ops_done"], record["message_ops_failed"]])
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<II", len(columns["id"]), len(meta_bytes)))
+        f.write(meta_bytes)
+        for name, _ in SNAPSHOT_COLUMNS:
+            f.write(struct.pack("<Q", len(columns[name]) * columns[name].itemsize))
+            columns[name].tofile(f)
+    return len(columns["id"])
+
+
+def load_snapshot(path):
+    """
+    Читает снимок write_snapshot: (AnalysisResults, meta). Числовые колонки
+    читаются целиком через array.frombytes, id сообщений каждого чата - срез
+    общего буфера.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC: raise ValueError(f"{path}: не снимок анализа")
+        chat_count, meta_length = struct.unpack("<II", f.read(8))
+        meta = json.loads(f.read(meta_length).decode('utf-8'))
+        columns = {}
+        for name, typecode in SNAPSHOT_COLUMNS:
+            (length,) = struct.unpack("<Q", f.read(8))
+            columns[name] = array(typecode)
+            columns[name].frombytes(f.read(length))
+            if meta["byteorder"] != sys.byteorder: columns[name].byteswap()
+    results = AnalysisResults()
+    offsets, trigger_ids = columns["trigger_offsets"], columns["trigger_ids"]
+    for i in range(chat_count):
+        flags = columns["flags"][i]
+        chat = ChatResult(columns["id"][i], meta["titles"][i], columns["count"][i], columns["message_count"][i], meta["found_triggers"][i],
+                          is_whitelisted=bool(flags & FLAG_WHITELISTED), count_lower_bound=bool(flags & FLAG_LOWER_BOUND), sampled=bool(flags & FLAG_SAMPLED))
+        results.add_chat(chat, trigger_ids[offsets[i]:offsets[i + 1]] if offsets[i + 1] > offsets[i] else None)
+    return results, meta
+
+
+def export_results(fmt, chats, candidates_for_chat_deletion=(), candidates_for_msg_deletion=(), outcomes=None, policy=None):
+    # пишет выгрузку в REPORTS_DIR и возвращает (путь к файлу, число чатов); синхронно - вызывать через asyncio.to_thread
+    # chats - AnalysisResults или итератор (ChatResult, id сообщений с триггерами), как у iter_records
+    if fmt not in EXPORT_FORMATS: raise ValueError(f"неизвестный формат выгрузки: {fmt}")
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = config.EXPORT_FILENAME_TEMPLATE.format(timestamp=timestamp, ext=EXTENSIONS[fmt])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if fmt == "snapshot":
+        count = write_snapshot(path, chats, candidates_for_chat_deletion, candidates_for_msg_deletion, outcomes, policy)
+    else:
+        records = iter_records(chats, candidates_for_chat_deletion, candidates_for_msg_deletion, outcomes)
+        count = (write_jsonl if fmt == "jsonl" else write_csv)(path, records)
+    logger.info(f"выгрузка {fmt} сохранена: {path} ({count} чатов).")
+    return path, count
+
+
+def export_run(fmt, store, run_id, outcomes=None):
+    # выгрузка запуска из AnalysisStore: кандидаты по текущему порогу, чаты - курсором страницами
+    # через свое соединение с базой (синхронно, из потока asyncio.to_thread); возвращает (путь, число чатов)
+    run_store = store.fork()
+    try:
+        policy = run_store.policy()
+        split = run_store.split(run_id, policy)
+        return export_results(fmt, run_store.iter_chats(run_id), split.full, split.messages, outcomes, policy)
+    finally:
+        if run_store is not store: run_store.conn.close()
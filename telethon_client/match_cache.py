@@ -0,0 +1,119 @@
+# telethon_client/match_cache.py
+# кэш результатов поиска триггеров по тексту: одинаковые (пересланные) сообщения проверяются один раз
+import collections
+import hashlib
+import sys
+
+# примерный размер записи без найденных триггеров: ключ (16 байт digest), узел OrderedDict, список-запись
+ENTRY_BYTES = 170
+CHAT_BYTES = 64 # еще один чат в множестве чатов записи
+PREVIEW_CHARS = 100 # сколько символов текста хранить для отчета о повторах
+
+
+def text_key(text):
+    # blake2b от UTF-8 байтов текста: совпадение ключей у разных текстов практически исключено (в отличие от hash())
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class MatchCache:
+    """
+    LRU: ключ - 128-битный digest сырого текста (text_key), значение - кортеж найденных триггеров.
+    Объем ограничен max_bytes (оценка), при превышении вытесняются давно
+    не использованные записи. Для текстов с триггерами запоминаются чаты,
+    где они встречались, и начало текста - по ним строится список
+    "один и тот же текст в N чатах" без отдельного прохода.
+    Кэш живет один анализ: его результаты верны только для текущего матчера.
+    """
+
+    def __init__(self, matcher, max_bytes):
+        self.matcher = matcher
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict() # {digest: [found, чаты или None, начало текста или None, размер]}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, chat_id):
+        entry = self.entries.get(key)
+        if entry is None: return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if entry[1] is not None and chat_id is not None and chat_id not in entry[1]:
+            entry[1].add(chat_id)
+            entry[3] += CHAT_BYTES; self.size += CHAT_BYTES
+        return entry[0]
+
+    def _store(self, key, text, found, chat_id):
+        found = tuple(found) if found else ()
+        if found:
+            chats = {chat_id} if chat_id is not None else set()
+            preview = text[:PREVIEW_CHARS]
+            size = ENTRY_BYTES + sys.getsizeof(found) + sys.getsizeof(preview) + CHAT_BYTES
+        else:
+            chats = preview = None
+            size = ENTRY_BYTES
+        self.entries[key] = [found, chats, preview, size]
+        self.size += size
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[3]
+            self.evictions += 1
+        return found
+
+    def match(self, text, chat_id=None):
+        # кортеж найденных триггеров (пустой - нет)
+        if not text: return ()
+        key = text_key(text)
+        found = self._lookup(key, chat_id)
+        if found is not None: return found
+        self.misses += 1
+        return self._store(key, text, self.matcher.match(text), chat_id)
+
+    def for_chat(self, chat_id):
+        return ChatMatcher(self, chat_id)
+
+    def split_batch(self, texts, chat_id=None):
+        # для пула поиска: (результаты с None на месте непроверенных, [(позиция, текст)] непроверенных)
+        results, misses = [], []
+        for i, text in enumerate(texts):
+            found = self._lookup(text_key(text), chat_id) if text else ()
+            if found is None:
+                self.misses += 1
+                misses.append((i, text))
+            results.append(found)
+        return results, misses
+
+    def fill_batch(self, results, misses, found_list, chat_id=None):
+        # результаты пула для непроверенных текстов -> в кэш и на свои места
+        for (i, text), found in zip(misses, found_list):
+            results[i] = self._store(text_key(text), text, found, chat_id)
+        return results
+
+    def duplicates(self, min_chats):
+        # тексты с триггерами, встреченные в min_chats чатах и больше (по убыванию числа чатов)
+        found = [
+            {"text": entry[2], "chats": len(entry[1]), "terms": sorted(entry[0])}
+            for entry in self.entries.values() if entry[1] and len(entry[1]) >= min_chats
+        ]
+        found.sort(key=lambda item: item["chats"], reverse=True)
+        return found
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries), "bytes": self.size, "evictions": self.evictions,
+        }
+
+
+class ChatMatcher:
+    # кэш с привязкой к чату - тот же интерфейс match(text), что у TermMatcher
+    __slots__ = ("cache", "chat_id")
+
+    def __init__(self, cache, chat_id):
+        self.cache = cache
+        self.chat_id = chat_id
+
+    def match(self, text):
+        return self.cache.match(text, self.chat_id)
@@ -0,0 +1,60 @@
+# telethon_client/match_pool.py
+# вынос очистки текста и поиска триггеров из event loop в пул процессов/потоков
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# матчер воркера (в пуле процессов строится один раз при старте процесса)
+_worker_matcher = None
+
+
+def _init_worker(matcher):
+    # готовый матчер передается целиком (в процесс - через pickle), автомат заново не строится
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _match_batch(texts):
+    # выполняется в воркере: для каждого текста - кортеж найденных триггеров (пустой, если нет)
+    return [tuple(found) for found in _worker_matcher.match_batch(texts)]
+
+
+class MatchPool:
+    """
+    Пул для поиска триггеров пачками. Сетевые корутины только собирают тексты,
+    а очистка и матчинг идут в отдельных процессах (или потоках), не блокируя
+    event loop, на котором работает и aiogram.
+    """
+
+    def __init__(self, matcher, workers, kind="process", batch_size=200):
+        self.matcher = matcher
+        self.batch_size = batch_size
+        self.max_pending = max(2, workers * 2) # сколько пачек может ждать обработки на один чат
+        self.kind = kind
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="svoboda-match",
+                                                initializer=_init_worker, initargs=(matcher,))
+        else:
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matcher,))
+        logger.info(f"пул поиска триггеров: {workers} ({kind}), пачка {batch_size} сообщений.")
+
+    def submit(self, texts):
+        # отправляет пачку текстов в пул, возвращает asyncio future
+        return asyncio.get_running_loop().run_in_executor(self._executor, _match_batch, texts)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_match_pool(matcher, workers, kind="process", batch_size=200):
+    # workers: 0 - искать прямо в event loop (как раньше), -1 - по числу ядер
+    if workers == 0 or not matcher: return None
+    if workers < 0: workers = os.cpu_count() or 1
+    try:
+        return MatchPool(matcher, workers, kind, batch_size)
+    except Exception as e:
+        logger.error(f"не удалось создать пул поиска триггеров ({kind}): {e}. ищу в event loop.")
+        return None
@@ -0,0 +1,89 @@
+# telethon_client/matcher.py
+# компилируемый матчер триггеров (ахо-корасик по словам)
+from .normalizer import normalize_text, normalize_batch
+
+
+class TermMatcher:
+    """
+    Ищет все триггеры (одиночные слова и фразы) за один проход по тексту.
+    Автомат Ахо-Корасик строится по словам, а не по символам, поэтому
+    сохраняется прежняя семантика "целое слово": триггер совпадает только
+    с целыми словами очищенного текста. Стоимость поиска не зависит от числа триггеров.
+    Триггеры нормализуются так же, как текст (normalize_text), а в результатах
+    остаются в исходном виде; триггеры с одинаковой нормальной формой считаются одним.
+    """
+
+    def __init__(self, terms):
+        # terms: список триггеров (уже в нижнем регистре, как из load_list_from_file)
+        normalized = {}
+        for term in terms:
+            key = normalize_text(term) if term else ""
+            if key.split() and key not in normalized: normalized[key] = term
+        self.terms = list(normalized.values())
+        self._goto = [{}]    # переходы: {слово: узел}
+        self._fail = [0]     # суффиксные ссылки
+        self._output = [()]  # триггеры, заканчивающиеся в узле (включая суффиксные)
+        single_words = set()
+        has_phrases = False
+
+        for key, term in normalized.items():
+            words = key.split()
+            if len(words) == 1: single_words.add(words[0])
+            else: has_phrases = True
+            node = 0
+            for word in words:
+                nxt = self._goto[node].get(word)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][word] = nxt
+                    self._goto.append({}); self._fail.append(0); self._output.append(())
+                node = nxt
+            self._output[node] = self._output[node] + (term,)
+
+        # суффиксные ссылки в порядке обхода в ширину
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for word, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+        # для списка без фраз, записанных уже в нормальной форме, хватает пересечения множеств (делается в C)
+        self._single_words = single_words if not has_phrases and all(key == term for key, term in normalized.items()) else None
+        self._vocabulary = frozenset(word for key in normalized for word in key.split())
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find_in_words(self, words):
+        # возвращает множество триггеров в последовательности слов
+        if self._single_words is not None:
+            return self._single_words.intersection(words)
+        found = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for word in words:
+            if word not in self._vocabulary:
+                node = 0; continue
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            if output[node]: found.update(output[node])
+        return found
+
+    def find(self, cleaned_text):
+        # поиск в уже очищенном тексте (результат normalize_text)
+        return self.find_in_words(cleaned_text.split())
+
+    def match(self, text):
+        # очистка + поиск в сыром тексте сообщения
+        if not text: return set()
+        return self.find(normalize_text(text))
+
+    def match_batch(self, texts):
+        # то же для пачки текстов: нормализация всей пачки за один проход (normalize_batch)
+        return [self.find(cleaned) if cleaned else set() for cleaned in normalize_batch(texts)]
@@ -0,0 +1,121 @@
+# telethon_client/normalizer.py
+# нормализация текста перед поиском триггеров: заранее собранная таблица str.translate
+# и замена двойников букв в словах со смешанными алфавитами
+import functools
+import re
+import string
+import unicodedata
+
+# при изменении таблицы или замены двойников увеличивать - сохраненные итоги анализа (scan_state,
+# контрольная точка) и индексы списков сбрасываются
+NORMALIZE_VERSION = 2
+
+# двойники букв (после lower()) заменяются только в словах, где смешаны алфавиты, - в сторону алфавита,
+# которым написано слово: "дpoп" с латинскими p/o -> "дроп", "pаypаl" с кириллическими а -> "paypal".
+# слова целиком на одном алфавите не меняются: триггер "bot" не совпадает с "вот"
+# латинские и греческие буквы, похожие на кириллические
+HOMOGLYPHS_TO_CYRILLIC = {
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м", "o": "о",
+    "p": "р", "t": "т", "x": "х", "y": "у",
+    "α": "а", "β": "в", "ε": "е", "η": "н", "κ": "к", "μ": "м", "ο": "о", "ρ": "р",
+    "τ": "т", "υ": "у", "χ": "х",
+}
+# кириллические и греческие буквы, похожие на латинские
+HOMOGLYPHS_TO_LATIN = {
+    "а": "a", "в": "b", "с": "c", "е": "e", "н": "h", "к": "k", "м": "m", "о": "o",
+    "р": "p", "т": "t", "х": "x", "у": "y",
+    "і": "i", "ј": "j", "ѕ": "s", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+    "α": "a", "β": "b", "ε": "e", "η": "h", "κ": "k", "μ": "m", "ο": "o", "ρ": "p",
+    "τ": "t", "υ": "y", "χ": "x",
+}
+_TO_CYRILLIC = str.maketrans(HOMOGLYPHS_TO_CYRILLIC)
+_TO_LATIN = str.maketrans(HOMOGLYPHS_TO_LATIN)
+
+_LATIN = re.compile("[a-z]")
+_CYRILLIC = re.compile("[\u0400-\u052f]")
+_GREEK = re.compile("[\u0370-\u03ff]")
+# буквы, у которых есть двойник в другом алфавите: по ним нельзя судить, каким алфавитом написано слово
+_LATIN_LOOKALIKES = frozenset(char for char in (*HOMOGLYPHS_TO_CYRILLIC, *HOMOGLYPHS_TO_LATIN.values()) if _LATIN.match(char))
+_CYRILLIC_LOOKALIKES = frozenset(char for char in (*HOMOGLYPHS_TO_LATIN, *HOMOGLYPHS_TO_CYRILLIC.values()) if _CYRILLIC.match(char))
+# слово, где есть и латинская (или греческая), и кириллическая (или греческая) буква - кандидат на замену двойников
+_MIXED_WORD = re.compile("(?<!\\S)(?=\\S*?[a-z\u0370-\u03ff])(?=\\S*?[\u0370-\u052f])\\S+")
+
+# дефисы-двойники считаются обычным дефисом (как и раньше, "-" внутри слов сохраняется)
+HYPHENS = "‐‑‒−﹣－"
+
+# таблица покрывает BMP и эмодзи; символы старше TABLE_SIZE translate оставляет как есть,
+# из них невидимые теги и селекторы вариантов удаляет _HIGH_INVISIBLE
+TABLE_SIZE = 0x1FB00
+_HIGH_INVISIBLE = re.compile("[\U000E0000-\U000E007F\U000E0100-\U000E01EF]")
+
+
+def _build_table():
+    """
+    Таблица для str.translate в виде списка по коду символа (без промахов словаря,
+    поэтому быстрее dict/str.maketrans). Удаляются: пунктуация (кроме "-"),
+    символы и эмодзи (S*), невидимые форматирующие (Cf: zero-width и т.п.),
+    селекторы вариантов и keycap-комбинации эмодзи. ё заменяется на е,
+    полноширинные латинские буквы - обычными. Двойники букв таблица не трогает
+    (см. _fold_homoglyphs).
+    """
+    table = list(range(TABLE_SIZE))
+    for code in range(TABLE_SIZE):
+        category = unicodedata.category(chr(code))
+        if category[0] in "PS" or category == "Cf":
+            table[code] = None
+    for code in (*range(0xFE00, 0xFE10), 0x20E3):
+        table[code] = None
+    for char in string.punctuation.replace('-', ''):
+        table[ord(char)] = None
+    table[ord('-')] = '-'
+    for char in HYPHENS:
+        table[ord(char)] = '-'
+    table[ord('ё')] = 'е'
+    for letter in string.ascii_lowercase:
+        table[ord(letter) - ord('a') + 0xFF41] = letter
+    return table
+
+
+TABLE = _build_table()
+_SEPARATOR = "\n" # разделитель для пачки: не меняется таблицей и не попадает внутрь слов
+
+
+@functools.lru_cache(maxsize=4096)
+def _fold(word):
+    # слово из нескольких алфавитов: двойники - к алфавиту, которым написано слово
+    # (кэш: одни и те же "замаскированные" слова повторяются в спаме)
+    latin, cyrillic, greek = _LATIN.findall(word), _CYRILLIC.findall(word), _GREEK.findall(word)
+    if bool(latin) + bool(cyrillic) + bool(greek) < 2: return word
+    # алфавит слова - по буквам без двойника, при равенстве - по числу букв, затем кириллица
+    latin_own = sum(1 for char in latin if char not in _LATIN_LOOKALIKES)
+    cyrillic_own = sum(1 for char in cyrillic if char not in _CYRILLIC_LOOKALIKES)
+    if (latin_own, len(latin)) > (cyrillic_own, len(cyrillic)): return word.translate(_TO_LATIN)
+    return word.translate(_TO_CYRILLIC)
+
+
+def _fold_word(match):
+    return _fold(match.group())
+
+
+def _fold_homoglyphs(text):
+    # текст без латиницы и греческих букв (обычное русское сообщение) смешанных слов не содержит
+    if _LATIN.search(text) is None and _GREEK.search(text) is None: return text
+    return _MIXED_WORD.sub(_fold_word, text)
+
+
+def normalize_text(text):
+    # нижний регистр + таблица (пунктуация, эмодзи, zero-width, ё -> е) + двойники букв в смешанных словах
+    if not text: return ""
+    return _fold_homoglyphs(_HIGH_INVISIBLE.sub("", text.lower().translate(TABLE)))
+
+
+def normalize_batch(texts):
+    """
+    Нормализует список текстов за два вызова на всю пачку (lower и translate
+    по склеенной строке) вместо двух вызовов на каждый текст. Результат
+    совпадает с [normalize_text(t) for t in texts] для поиска по словам:
+    переводы строк внутри текста заменяются пробелом.
+    """
+    if not texts: return []
+    joined = _SEPARATOR.join(text.replace(_SEPARATOR, " ") if text and _SEPARATOR in text else (text or "") for text in texts)
+    return _fold_homoglyphs(_HIGH_INVISIBLE.sub("", joined.lower().translate(TABLE))).split(_SEPARATOR)
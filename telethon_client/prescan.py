@@ -0,0 +1,111 @@
+# telethon_client/prescan.py
+# первая фаза двухфазного анализа: короткая выборка последних сообщений каждого чата
+import logging
+
+from telethon import errors, functions, types, utils
+
+from .rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSample:
+    """
+    Последние сообщения чата (не больше size, только новее min_id) и найденные в них
+    триггеры. messages - сырые сообщения ответа GetHistory, texts - их тексты для
+    проверки. complete - выборка содержит все сообщения окна (всю историю или все
+    новые после min_id), дозагружать нечего.
+    """
+    __slots__ = ("chat_id", "min_id", "messages", "found", "complete")
+
+    def __init__(self, chat_id, min_id, messages, texts, complete, matcher):
+        self.chat_id = chat_id
+        self.min_id = min_id
+        self.messages = messages
+        self.complete = complete
+        self.found = [matcher.match(text_to_check) if text_to_check and matcher else None for text_to_check in texts]
+
+    @property
+    def trigger_messages(self):
+        return sum(1 for found_terms in self.found if found_terms)
+
+    @property
+    def density(self):
+        # доля сообщений с триггерами в выборке
+        return self.trigger_messages / len(self.messages) if self.messages else 0.0
+
+    def seed(self, scan):
+        # переносит выборку в ChatScan; полная загрузка продолжится со следующего за ней сообщения
+        for message, found_terms in zip(self.messages, self.found):
+            scan.count_message(message)
+            scan.add_found(message.id, found_terms)
+        if self.messages: scan.offset_id = self.messages[-1].id
+
+
+def _history_request(entity, min_id, size):
+    return functions.messages.GetHistoryRequest(
+        peer=utils.get_input_peer(entity), offset_id=0, offset_date=None, add_offset=0,
+        limit=size, max_id=0, min_id=min_id, hash=0)
+
+
+def _message_text(parse_mode, message):
+    # тот же текст, что message_text() у сообщений из iter_messages (message.text = разметка parse_mode клиента),
+    # но через публичный client.parse_mode: сырые сообщения контейнера к клиенту не привязаны
+    raw = getattr(message, 'message', None)
+    if not raw: return ""
+    return (parse_mode.unparse(raw, message.entities or []) if parse_mode else raw) + " "
+
+
+def _sample_from_response(client, chat_id, min_id, size, response, matcher):
+    messages = [message for message in response.messages if not isinstance(message, types.MessageEmpty)]
+    texts = [_message_text(client.parse_mode, message) for message in messages]
+    # вся история пришла одним ответом (messages.Messages без среза или count не больше полученного);
+    # при min_id count - все сообщения чата, поэтому все новые получены, если ответ короче лимита
+    count = getattr(response, 'count', None)
+    if min_id:
+        complete = len(response.messages) < size
+    else:
+        complete = isinstance(response, types.messages.Messages) or (count is not None and count <= len(response.messages))
+    return ChatSample(chat_id, min_id, messages, texts, complete, matcher)
+
+
+async def collect_samples(ctx, targets, size, batch):
+    """
+    targets: [(dialog, min_id)]. GetHistory нескольких чатов отправляются одним
+    контейнером по batch запросов (каждый - в бюджете GetHistory). Чаты, для
+    которых выборка не получена (floodwait, нет доступа), в результат не попадают
+    и во второй фазе сканируются как обычно. Возвращает {chat_id: ChatSample}.
+    """
+    samples = {}
+    client = ctx.client
+    for start in range(0, len(targets), batch):
+        if ctx.cancelled: break
+        chunk, requests = [], []
+        for dialog, min_id in targets[start:start + batch]:
+            try:
+                requests.append(_history_request(dialog.entity, min_id, size))
+            except TypeError: # сущность без input peer (например, недоступный чат)
+                continue
+            chunk.append((dialog, min_id))
+            await rate_limiter.acquire("GetHistory")
+        if not requests: continue
+        try:
+            responses = await client(requests)
+        except errors.MultiError as e:
+            # часть запросов контейнера выполнена - их выборки используем
+            responses = e.results
+            flood_waits = [x.seconds for x in e.exceptions if isinstance(x, errors.FloodWaitError)]
+            if flood_waits: rate_limiter.on_flood_wait("GetHistory", max(flood_waits))
+        except errors.FloodWaitError as e:
+            rate_limiter.on_flood_wait("GetHistory", e.seconds)
+            continue
+        except Exception as e:
+            logger.warning(f"telethon: выборка для {len(requests)} чатов не получена: {e}")
+            continue
+        for (dialog, min_id), response in zip(chunk, responses):
+            if response is None: continue
+            rate_limiter.on_success("GetHistory")
+            samples[dialog.id] = _sample_from_response(client, dialog.id, min_id, size, response, ctx.chat_matcher(dialog.id))
+        if ctx.progress: ctx.progress.update(note=f"выборка: {min(start + batch, len(targets))}/{len(targets)} чатов")
+    logger.info(f"telethon: выборка получена для {len(samples)} из {len(targets)} чатов.")
+    return samples
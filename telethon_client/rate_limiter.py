@@ -0,0 +1,172 @@
+# telethon_client/rate_limiter.py
+# общий планировщик запросов telethon: token bucket на каждый метод + подстройка по floodwait
+import asyncio
+import logging
+import time
+
+from telethon import errors
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# начальная скорость (запросов/с) и размер пачки для известных методов
+DEFAULT_RATES = {
+    "GetHistory": (4.0, 4),
+    "Search": (2.0, 2),
+    "GetDialogs": (2.0, 2),
+    "DeleteDialog": (0.8, 1),
+    "DeleteMessages": (1.25, 2),
+    "DeleteHistory": (1.0, 1),
+    "DeleteContacts": (0.7, 1),
+    "ResolveEntity": (1.0, 2),
+}
+FALLBACK_RATE = (1.0, 1)
+
+
+class TokenBucket:
+    """
+    Бюджет запросов одного метода. Скорость подстраивается AIMD:
+    floodwait - резкое снижение и пауза на e.seconds, серия успешных
+    вызовов - постепенный рост, но не выше скорости, на которой был последний floodwait.
+    """
+
+    def __init__(self, method, rate, burst, max_rate=None, min_rate=0.02, grow_after=20):
+        self.method = method
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate or rate * 4
+        self.min_rate = min_rate
+        self.grow_after = grow_after
+        self.ceiling = None # скорость, на которой последний раз получили floodwait
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self.calls = 0
+        self.flood_waits = 0
+        self._successes = 0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # ждет токен; запросы одного метода из разных задач выстраиваются в очередь
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes < self.grow_after: return
+        self._successes = 0
+        limit = self.max_rate if self.ceiling is None else min(self.max_rate, self.ceiling * 0.9)
+        if self.rate < limit:
+            self.rate = min(limit, self.rate * 1.1)
+
+    def on_flood_wait(self, seconds):
+        # чем дольше сервер просит ждать, тем сильнее снижаем скорость
+        now = time.monotonic()
+        self.flood_waits += 1
+        self._successes = 0
+        self.ceiling = self.rate
+        self.rate = max(self.min_rate, self.rate * (0.5 if seconds <= 5 else 0.25))
+        self.blocked_until = max(self.blocked_until, now + seconds + 1)
+        self.tokens = 0.0
+        self._updated = self.blocked_until
+        logger.warning(f"rate limiter: floodwait {seconds}с для {self.method}, скорость снижена до {self.rate:.2f}/с")
+
+    def snapshot(self):
+        return {
+            "rate": round(self.rate, 3), "ceiling": round(self.ceiling, 3) if self.ceiling else None,
+            "tokens": round(self.tokens, 2), "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            "calls": self.calls, "flood_waits": self.flood_waits,
+        }
+
+
+class RateScheduler:
+    # единая точка для всех запросов telethon: бюджеты общие для всех одновременно работающих задач
+
+    def __init__(self, rates=None):
+        self.rates = dict(DEFAULT_RATES)
+        if rates: self.rates.update(rates)
+        self.buckets = {}
+
+    def bucket(self, method) -> TokenBucket:
+        bucket = self.buckets.get(method)
+        if bucket is None:
+            rate, burst = self.rates.get(method, FALLBACK_RATE)
+            bucket = self.buckets[method] = TokenBucket(method, rate, burst)
+        return bucket
+
+    async def acquire(self, method):
+        await self.bucket(method).acquire()
+
+    def on_flood_wait(self, method, seconds):
+        self.bucket(method).on_flood_wait(seconds)
+
+    def on_success(self, method):
+        self.bucket(method).on_success()
+
+    async def call(self, method, func, *args, retries=2, on_flood_wait=None, **kwargs):
+        """
+        Выполняет await func(*args, **kwargs) в рамках бюджета метода.
+        При FloodWaitError сообщает о нем бюджету и повторяет (до retries раз),
+        после исчерпания повторов пробрасывает ошибку.
+        on_flood_wait: необязательная корутина-колбек (секунды ожидания).
+        """
+        bucket = self.bucket(method)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                result = await func(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                bucket.on_flood_wait(e.seconds)
+                if on_flood_wait: await on_flood_wait(e.seconds)
+                attempt += 1
+                if attempt > retries: raise
+                continue
+            bucket.on_success()
+            return result
+
+    async def paced(self, method, iterator, page_size=100, retries=2):
+        # итерация iter_messages/iter_dialogs с токеном на каждую страницу (один запрос = page_size элементов);
+        # при floodwait страница запрашивается снова после паузы бюджета (итератор telethon повторяет ту же страницу),
+        # подряд не больше retries раз, потом ошибка пробрасывается
+        index = 0
+        attempt = 0
+        while True:
+            if index % page_size == 0: await self.acquire(method)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except errors.FloodWaitError as e:
+                self.on_flood_wait(method, e.seconds)
+                attempt += 1
+                if attempt > retries: raise
+                if index % page_size: await self.acquire(method) # ждет окончания паузы (на границе страницы - в начале цикла)
+                continue
+            attempt = 0
+            index += 1
+            if index % page_size == 0: self.on_success(method)
+            yield item
+
+    def snapshot(self):
+        # текущие скорости по методам (для /rates)
+        return {method: bucket.snapshot() for method, bucket in sorted(self.buckets.items())}
+
+
+# общий экземпляр для всех задач
+rate_limiter = RateScheduler(config.RATE_LIMITS)
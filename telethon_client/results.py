@@ -0,0 +1,100 @@
+# telethon_client/results.py
+# компактное хранилище результатов анализа
+from array import array
+
+
+class ChatResult:
+    """
+    Итог анализа одного чата. Поля в __slots__ (без __dict__ на каждый чат),
+    при этом поддерживается доступ как к словарю (chat_info['count'], chat_info.get(...)),
+    которым пользуются отчет и роутеры.
+    """
+    __slots__ = ("id", "title", "count", "message_count", "found_triggers", "is_whitelisted", "count_lower_bound", "sampled")
+
+    def __init__(self, id, title, count=0, message_count=0, found_triggers=(), is_whitelisted=False, count_lower_bound=False, sampled=False):
+        self.id = id
+        self.title = title
+        self.count = count
+        self.message_count = message_count
+        self.found_triggers = tuple(found_triggers)
+        self.is_whitelisted = is_whitelisted
+        self.count_lower_bound = count_lower_bound # загрузка остановлена на пороге: триггеров не меньше count
+        self.sampled = sampled # проверена только выборка последних сообщений (SAMPLE_PRESCAN)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__: raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__: raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, ChatResult): other = other.to_dict()
+        if not isinstance(other, dict): return NotImplemented
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return f"ChatResult({self.to_dict()!r})"
+
+
+def id_buffer(ids=()):
+    # буфер id сообщений: int64 без отдельного python-объекта на каждый id
+    return array('q', ids)
+
+
+class AnalysisResults:
+    """
+    Результаты одного анализа: список ChatResult и id сообщений с триггерами
+    в виде {chat_id: array('q')}. Удаление сообщений получает memoryview
+    на эти буферы без копирования.
+    """
+
+    def __init__(self):
+        self.chats = [] # [ChatResult, ...] в порядке диалогов
+        self.messages_with_triggers = {} # {chat_id: array('q')}
+        self.history = {} # {chat_id: сведения об истории для планировщика удаления}
+        self.stopped = False # анализ остановлен до конца (итоги частичные)
+        self.resumable = False # анализ неполный, его можно продолжить с контрольной точки
+        self.resumed_chats = 0 # итоги скольких чатов взяты из контрольной точки
+        self.sampled = False # двухфазный анализ: часть чатов проверена только выборкой (ChatResult.sampled)
+        self.match_cache_stats = None # счетчики кэша совпадений (MatchCache.stats) или None
+        self.duplicates = [] # [{"text", "chats", "terms"}] - тексты с триггерами, повторяющиеся в разных чатах
+
+    def add_chat(self, chat_result, trigger_ids=None):
+        self.chats.append(chat_result)
+        if trigger_ids:
+            self.messages_with_triggers[chat_result.id] = trigger_ids if isinstance(trigger_ids, array) else id_buffer(trigger_ids)
+
+    def trigger_count(self, chat_id):
+        return len(self.messages_with_triggers.get(chat_id, ()))
+
+    def trigger_ids_view(self, chat_id):
+        # только для чтения, без копирования
+        ids = self.messages_with_triggers.get(chat_id)
+        return memoryview(ids).toreadonly() if ids is not None else memoryview(id_buffer()).toreadonly()
+
+    def views_for(self, chat_ids):
+        # {chat_id: memoryview} для передачи в delete_messages_job
+        return {chat_id: self.trigger_ids_view(chat_id) for chat_id in chat_ids if chat_id in self.messages_with_triggers}
+
+    def lower_bound_chats(self):
+        return sum(1 for chat in self.chats if chat.count_lower_bound)
+
+    def sampled_chats(self):
+        return sum(1 for chat in self.chats if chat.sampled)
+
+    def total_trigger_messages(self):
+        return sum(len(ids) for ids in self.messages_with_triggers.values())
@@ -0,0 +1,109 @@
+# telethon_client/scan_state.py
+# хранилище отметок сканирования по чатам (для инкрементального анализа)
+import hashlib
+import json
+import logging
+import os
+
+import config
+from .normalizer import NORMALIZE_VERSION
+
+logger = logging.getLogger(__name__)
+
+# при изменении формата или логики поиска увеличивать - старое состояние будет сброшено
+STATE_VERSION = 1
+
+
+def state_entry(top_message, max_id, count, message_count, found_triggers, trigger_ids, history=None, lower_bound=False):
+    # итоги одного чата (тот же формат пишет контрольная точка анализа)
+    # lower_bound: загрузка остановлена на пороге удаления (EARLY_STOP_SCAN), count - нижняя оценка
+    return {
+        "top_message": top_message, "max_id": max_id, "count": count,
+        "message_count": message_count, "found_triggers": sorted(found_triggers),
+        "trigger_ids": list(trigger_ids), "history": history, "lower_bound": lower_bound,
+    }
+
+
+def terms_fingerprint(terms, fetch_limit):
+    # отпечаток списка триггеров, лимита и версии нормализации текста: при изменении старые итоги недействительны
+    payload = "\n".join(sorted(set(terms))) + f"\n#limit={fetch_limit}\n#normalize={NORMALIZE_VERSION}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ScanStateStore:
+    """
+    Для каждого чата хранит максимальный просканированный id сообщения,
+    top_message диалога на момент сканирования и накопленные итоги
+    (кол-во триггеров, сообщений, найденные триггеры и id сообщений с триггерами).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprint = None
+        self.chats = {} # {chat_id: {...}}
+        self._dirty = False
+
+    def load(self):
+        # читает состояние с диска (отсутствующий/битый файл = пустое состояние)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != STATE_VERSION:
+                logger.info("состояние сканирования устарело (версия), начинаю заново.")
+                return self
+            self.fingerprint = data.get("fingerprint")
+            self.chats = {int(chat_id): entry for chat_id, entry in data.get("chats", {}).items()}
+            logger.info(f"загружено состояние сканирования: {len(self.chats)} чатов.")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"не удалось прочитать состояние сканирования {self.path}: {e}")
+        return self
+
+    def save(self):
+        # атомарная запись (через временный файл), только если были изменения
+        if not self._dirty: return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": STATE_VERSION, "fingerprint": self.fingerprint,
+                           "chats": {str(chat_id): entry for chat_id, entry in self.chats.items()}}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"не удалось сохранить состояние сканирования {self.path}: {e}")
+
+    def ensure_fingerprint(self, fingerprint):
+        # сбрасывает все итоги, если изменились триггеры или лимит загрузки
+        if self.fingerprint != fingerprint:
+            if self.chats: logger.info("список триггеров/лимит изменились, инкрементальное состояние сброшено.")
+            self.chats = {}
+            self.fingerprint = fingerprint
+            self._dirty = True
+
+    def get(self, chat_id):
+        return self.chats.get(chat_id)
+
+    def update(self, chat_id, top_message, max_id, count, message_count, found_triggers, trigger_ids, history=None):
+        # history: сведения для планировщика удаления (см. ChatScan.history_facts), None - неизвестны
+        self.put(chat_id, state_entry(top_message, max_id, count, message_count, found_triggers, trigger_ids, history))
+
+    def put(self, chat_id, entry):
+        self.chats[chat_id] = entry
+        self._dirty = True
+
+    def forget(self, chat_ids):
+        # чат удален/изменен нами - при следующем анализе сканируется заново
+        for chat_id in chat_ids:
+            if self.chats.pop(chat_id, None) is not None: self._dirty = True
+        self.save()
+
+
+_store = None
+
+def get_scan_state() -> ScanStateStore:
+    # общий экземпляр хранилища (загружается при первом обращении)
+    global _store
+    if _store is None:
+        _store = ScanStateStore(config.SCAN_STATE_FILE).load()
+    return _store
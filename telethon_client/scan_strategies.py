@@ -0,0 +1,295 @@
+# telethon_client/scan_strategies.py
+# стратегии сканирования одного чата: полная загрузка истории или серверный поиск
+import asyncio
+import collections
+import logging
+import math
+
+from telethon.tl.types import Channel, Message as TelethonMessage
+
+from .results import id_buffer
+from .rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# сколько сообщений возвращает один GetHistory/Search
+HISTORY_PAGE_SIZE = 100
+# в режиме "auto" поиск выбирается, только если он дешевле полной загрузки хотя бы во столько раз
+SEARCH_COST_MARGIN = 2
+
+
+def message_text(message):
+    # текст сообщения для проверки (текст + подпись медиа, как раньше)
+    text_to_check = ""
+    if isinstance(message, TelethonMessage):
+        if message.text: text_to_check += message.text + " "
+        if message.media and hasattr(message, 'caption') and message.caption: text_to_check += message.caption
+    return text_to_check
+
+
+class ChatScan:
+    # накопитель результатов по одному чату (переживает floodwait - частичные итоги сохраняются)
+    def __init__(self):
+        self.term_count = 0
+        self.message_count = 0
+        self.found_triggers = set()
+        self.trigger_ids = id_buffer() # array('q')
+        self.max_seen_id = 0
+        self.offset_id = 0 # продолжение с контрольной точки: загружать сообщения старше этого id
+        self.lower_bound = False # загрузка остановлена на пороге удаления, остальные сообщения не просмотрены
+        # сведения об истории для планировщика удаления
+        self.complete = False # просмотрены все сообщения после min_id (окно не обрезано fetch_limit)
+        self.min_clean_id = 0 # наименьший id сообщения без триггеров (0 - таких не было)
+
+    def count_message(self, message):
+        self.message_count += 1
+        if message.id > self.max_seen_id: self.max_seen_id = message.id
+
+    def add_found(self, message_id, found_terms):
+        if found_terms:
+            self.term_count += len(found_terms)
+            self.found_triggers.update(found_terms)
+            self.trigger_ids.append(message_id) # Помечаем сообщение
+        else:
+            if not self.min_clean_id or message_id < self.min_clean_id: self.min_clean_id = message_id
+
+    def add_message(self, message, matcher):
+        self.count_message(message)
+        text_to_check = message_text(message)
+        self.add_found(message.id, matcher.match(text_to_check) if text_to_check and matcher else None)
+
+    def apply_batch(self, message_ids, results):
+        # результаты пачки из пула поиска (в том же порядке, что и сообщения)
+        for message_id, found_terms in zip(message_ids, results):
+            self.add_found(message_id, found_terms)
+
+    def over_threshold(self, early_stop_at):
+        # чат уже точно кандидат на полное удаление - дальше можно не загружать
+        if early_stop_at is None or self.term_count <= early_stop_at: return False
+        self.lower_bound = True
+        return True
+
+    def snapshot(self, offset_id, message_count):
+        # позиция для контрольной точки: учтены все сообщения новее offset_id (их message_count)
+        return {
+            "offset_id": offset_id, "message_count": message_count, "term_count": self.term_count,
+            "found_triggers": sorted(self.found_triggers), "trigger_ids": list(self.trigger_ids),
+            "max_seen_id": self.max_seen_id, "min_clean_id": self.min_clean_id,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        scan = cls()
+        scan.offset_id = snapshot["offset_id"]
+        scan.message_count = snapshot["message_count"]
+        scan.term_count = snapshot["term_count"]
+        scan.found_triggers = set(snapshot["found_triggers"])
+        scan.trigger_ids = id_buffer(snapshot["trigger_ids"])
+        scan.max_seen_id = snapshot["max_seen_id"]
+        scan.min_clean_id = snapshot["min_clean_id"]
+        return scan
+
+    def history_facts(self, min_id, prior=None):
+        # итог для планировщика удаления; None - история не просмотрена целиком (например, серверный поиск)
+        prior_facts = prior.get("history") if prior else None
+        if min_id and not prior_facts: return None
+        facts = {
+            "reached_start": self.complete and (not min_id or prior_facts["reached_start"]),
+            "min_clean_id": self.min_clean_id,
+        }
+        if min_id:
+            if prior_facts["min_clean_id"] and (not facts["min_clean_id"] or prior_facts["min_clean_id"] < facts["min_clean_id"]):
+                facts["min_clean_id"] = prior_facts["min_clean_id"]
+        return facts
+
+
+def _submit_batch(ctx, chat_id, texts):
+    # пачка в пул поиска -> future со списком результатов; тексты, уже проверенные в этом анализе
+    # (кэш совпадений), в пул не отправляются
+    cache = ctx.match_cache
+    if cache is None: return ctx.match_pool.submit(texts)
+    results, misses = cache.split_batch(texts, chat_id)
+    batch_future = asyncio.get_running_loop().create_future()
+    if not misses:
+        batch_future.set_result(results)
+        return batch_future
+
+    def on_done(pool_future):
+        if batch_future.done(): return
+        if pool_future.cancelled(): batch_future.cancel()
+        elif pool_future.exception() is not None: batch_future.set_exception(pool_future.exception())
+        else: batch_future.set_result(cache.fill_batch(results, misses, pool_future.result(), chat_id))
+
+    ctx.match_pool.submit([text for _, text in misses]).add_done_callback(on_done)
+    return batch_future
+
+
+class FullDownloadStrategy:
+    # загружает историю (до fetch_limit сообщений) и ищет триггеры локально
+    name = "full"
+
+    def estimate_requests(self, ctx, messages_estimate):
+        return max(1, math.ceil(messages_estimate / HISTORY_PAGE_SIZE))
+
+    def _iter_history(self, ctx, scan, chat_id, min_id):
+        # при продолжении с контрольной точки - с offset_id и остатком лимита
+        limit = ctx.fetch_limit - scan.message_count if ctx.fetch_limit else None
+        return ctx.client.iter_messages(chat_id, limit=limit, min_id=min_id, offset_id=scan.offset_id, wait_time=0)
+
+    async def scan(self, ctx, scan, chat_id, top_message, min_id, entity=None):
+        if ctx.match_pool:
+            await self._scan_pipelined(ctx, scan, chat_id, min_id)
+            return
+        position_every = ctx.position_every
+        matcher = ctx.chat_matcher(chat_id)
+        messages = self._iter_history(ctx, scan, chat_id, min_id)
+        async for message in rate_limiter.paced("GetHistory", messages, HISTORY_PAGE_SIZE):
+            scan.add_message(message, matcher)
+            if scan.over_threshold(ctx.early_stop_at): break
+            if scan.message_count % 500 == 0: await asyncio.sleep(0.05)
+            if position_every and scan.message_count % position_every == 0:
+                ctx.save_position(chat_id, scan, message.id, scan.message_count)
+        scan.complete = not scan.lower_bound and (not ctx.fetch_limit or scan.message_count < ctx.fetch_limit)
+
+    async def _scan_pipelined(self, ctx, scan, chat_id, min_id):
+        # загрузка -> пачки текстов -> пул поиска -> итоги чата (в порядке пачек)
+        # одновременно в пуле не больше max_pending пачек чата, дальше загрузка ждет
+        pool = ctx.match_pool
+        pending = collections.deque() # (id сообщений, future с результатами пачки)
+        message_ids, texts = [], []
+        # позиция для контрольной точки - по уже примененным пачкам (message_count включает и ждущие в пуле)
+        applied_count = scan.message_count
+        position_every = ctx.position_every
+        try:
+            messages = self._iter_history(ctx, scan, chat_id, min_id)
+            async for message in rate_limiter.paced("GetHistory", messages, HISTORY_PAGE_SIZE):
+                scan.count_message(message)
+                message_ids.append(message.id); texts.append(message_text(message))
+                if len(texts) >= pool.batch_size:
+                    pending.append((message_ids, _submit_batch(ctx, chat_id, texts)))
+                    message_ids, texts = [], []
+                    # готовые пачки применяем сразу (без ожидания) - порог ранней остановки виден раньше
+                    while pending and (len(pending) >= pool.max_pending or pending[0][1].done()):
+                        batch_ids, future = pending.popleft()
+                        scan.apply_batch(batch_ids, await future)
+                        if position_every and (applied_count + len(batch_ids)) // position_every > applied_count // position_every:
+                            ctx.save_position(chat_id, scan, batch_ids[-1], applied_count + len(batch_ids))
+                        applied_count += len(batch_ids)
+                    if scan.over_threshold(ctx.early_stop_at): break
+            scan.complete = not scan.lower_bound and (not ctx.fetch_limit or scan.message_count < ctx.fetch_limit)
+        finally:
+            # и при floodwait досчитываем уже загруженное
+            if texts: pending.append((message_ids, _submit_batch(ctx, chat_id, texts)))
+            while pending:
+                batch_ids, future = pending.popleft()
+                scan.apply_batch(batch_ids, await future)
+
+
+class ServerSearchStrategy:
+    """
+    Просит Telegram найти сообщения по каждому триггеру (iter_messages(search=...))
+    в том же окне, что и полная загрузка (последние fetch_limit сообщений после min_id).
+    Каждое найденное сервером сообщение перепроверяется тем же матчером,
+    поэтому неточные совпадения серверного поиска в итоги не попадают.
+    """
+    name = "search"
+
+    def estimate_requests(self, ctx, messages_estimate):
+        return 1 + len(ctx.matcher) # граница окна + по запросу на триггер
+
+    async def scan(self, ctx, scan, chat_id, top_message, min_id, entity=None):
+        client = ctx.client
+        window_min_id = min_id
+        window_full = False
+        # один запрос: общее число сообщений и граница окна fetch_limit
+        if ctx.fetch_limit:
+            boundary = await rate_limiter.call("GetHistory", client.get_messages, chat_id, limit=1, min_id=min_id, add_offset=ctx.fetch_limit - 1)
+            total = boundary.total
+            if boundary:
+                window_min_id = max(min_id, boundary[0].id - 1)
+                window_full = True
+        else:
+            total = (await rate_limiter.call("GetHistory", client.get_messages, chat_id, limit=0)).total
+
+        matcher = ctx.chat_matcher(chat_id)
+        found_messages = {}
+        checked = {} # {id: найденные триггеры} - проверенные локально
+        checked_count = 0
+        for term in ctx.matcher.terms if ctx.matcher else ():
+            messages = client.iter_messages(chat_id, search=term, min_id=window_min_id, wait_time=0)
+            async for message in rate_limiter.paced("Search", messages, HISTORY_PAGE_SIZE):
+                found_messages.setdefault(message.id, message)
+            if ctx.early_stop_at is not None:
+                # ранняя остановка: после каждого триггера проверяем новое найденное
+                for message_id, message in found_messages.items():
+                    if message_id in checked: continue
+                    text_to_check = message_text(message)
+                    checked[message_id] = matcher.match(text_to_check) if text_to_check else None
+                    checked_count += len(checked[message_id] or ())
+                if checked_count > ctx.early_stop_at:
+                    scan.lower_bound = True
+                    break
+
+        # итоги как у полной загрузки: проверяем найденное локально, id по убыванию
+        for message_id in sorted(found_messages, reverse=True):
+            message = found_messages[message_id]
+            if message_id in checked:
+                found_terms = checked[message_id]
+            else:
+                text_to_check = message_text(message)
+                found_terms = matcher.match(text_to_check) if text_to_check else None
+            if found_terms:
+                scan.term_count += len(found_terms)
+                scan.found_triggers.update(found_terms)
+                scan.trigger_ids.append(message_id)
+        if window_full:
+            scan.message_count = ctx.fetch_limit
+        elif not min_id:
+            scan.message_count = total
+        else:
+            # сервер отдает только общее число сообщений чата, число новых после min_id оцениваем
+            estimate = estimate_message_count(entity, top_message, min_id, ctx.fetch_limit)
+            scan.message_count = max(len(scan.trigger_ids), estimate if estimate is not None else 0)
+        scan.max_seen_id = max(min_id, top_message or 0, max(found_messages, default=0))
+
+
+STRATEGIES = {
+    FullDownloadStrategy.name: FullDownloadStrategy(),
+    ServerSearchStrategy.name: ServerSearchStrategy(),
+}
+
+
+def estimate_message_count(entity, top_message, min_id, fetch_limit):
+    # грубая оценка числа сообщений в окне без запросов:
+    # в каналах/супергруппах id сообщений идут подряд, в остальных чатах id общие для аккаунта
+    if isinstance(entity, Channel) and top_message:
+        estimate = max(0, top_message - min_id)
+        return min(estimate, fetch_limit) if fetch_limit else estimate
+    if min_id: # дочитываем новые сообщения - обычно это не больше одной страницы
+        return min(HISTORY_PAGE_SIZE, fetch_limit) if fetch_limit else HISTORY_PAGE_SIZE
+    return fetch_limit # None = неизвестно (вся история)
+
+
+async def _history_count(ctx, chat_id):
+    # число сообщений чата одним запросом (GetHistory с limit=1 возвращает count); None - узнать не удалось
+    try:
+        return (await rate_limiter.call("GetHistory", ctx.client.get_messages, chat_id, limit=1)).total
+    except Exception as e:
+        logger.debug(f"telethon: не удалось узнать число сообщений чата {chat_id}: {e}")
+        return None
+
+
+async def choose_strategy(ctx, chat_id, entity, top_message, min_id, mode=None):
+    # выбирает стратегию для чата: "full", "search" или "auto" (по оценке числа запросов)
+    mode = mode or ctx.strategy_mode
+    if mode != "auto":
+        return STRATEGIES.get(mode, STRATEGIES["full"])
+    if not ctx.matcher:
+        return STRATEGIES["full"]
+    messages_estimate = estimate_message_count(entity, top_message, min_id, ctx.fetch_limit)
+    if messages_estimate is None: # вся история неизвестного размера (не канал, без fetch_limit) - спрашиваем у сервера
+        messages_estimate = await _history_count(ctx, chat_id)
+        if messages_estimate is None: return STRATEGIES["full"]
+    full_cost = STRATEGIES["full"].estimate_requests(ctx, messages_estimate)
+    search_cost = STRATEGIES["search"].estimate_requests(ctx, messages_estimate)
+    return STRATEGIES["search"] if search_cost * SEARCH_COST_MARGIN < full_cost else STRATEGIES["full"]
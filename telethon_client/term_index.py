@@ -0,0 +1,149 @@
+# telethon_client/term_index.py
+# скомпилированные списки триггеров и белого списка: кэш на диске рядом с файлом и перезагрузка при изменении
+import hashlib
+import logging
+import os
+import pickle
+
+import config
+from .matcher import TermMatcher
+from .normalizer import NORMALIZE_VERSION
+
+logger = logging.getLogger(__name__)
+
+# при изменении формата индекса или TermMatcher увеличивать - старые файлы индекса будут пересобраны
+# (при смене NORMALIZE_VERSION они пересобираются и так)
+INDEX_VERSION = 2
+
+
+class ListIndex:
+    """
+    Неизменяемый список строк из файла (в нижнем регистре, как load_list_from_file):
+    items - в порядке файла (для отчета), lookup - frozenset для проверки "in" за O(1).
+    mtime_ns/size/digest - по ним определяется, что исходный файл изменился.
+    """
+
+    def __init__(self, source, items, mtime_ns, size, digest):
+        self.source = source
+        self.items = tuple(items)
+        self.lookup = frozenset(self.items)
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+
+    def __contains__(self, item):
+        return item in self.lookup
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def compile(self):
+        # дополнительная подготовка (TermIndex строит матчер)
+        return self
+
+
+class TermIndex(ListIndex):
+    # список триггеров + готовый матчер (строится один раз и хранится в файле индекса)
+    matcher = None
+
+    def compile(self):
+        self.matcher = TermMatcher(self.items)
+        return self
+
+
+def _read_source(path):
+    # (строки файла в нижнем регистре, sha256 содержимого); нет файла - пустой список
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        logger.warning(f"файл {path} не найден.")
+        return [], None
+    items = [line.strip().lower() for line in data.decode('utf-8').splitlines() if line.strip()]
+    return items, hashlib.sha256(data).hexdigest()
+
+
+class CompiledList:
+    """
+    Источник индекса: текстовый файл path и файл индекса path + LIST_INDEX_SUFFIX (pickle).
+    get() при каждом вызове сверяет mtime и размер исходного файла (один stat):
+    - не изменились - отдает индекс из памяти;
+    - изменились, но sha256 содержимого тот же - индекс не пересобирается (только отметки);
+    - содержимое другое - индекс пересобирается и сохраняется на диск.
+    Поэтому правка terms.txt/white_list.txt подхватывается работающим ботом без перезапуска.
+    """
+
+    def __init__(self, path, index_class=ListIndex):
+        self.path = path
+        self.index_path = path + config.LIST_INDEX_SUFFIX
+        self.index_class = index_class
+        self.index = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None, None
+
+    def _load_cached(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                version, index = pickle.load(f)
+            if version == (INDEX_VERSION, NORMALIZE_VERSION) and isinstance(index, self.index_class) and index.source == self.path:
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"не удалось прочитать индекс {self.index_path}: {e}")
+        return None
+
+    def _save(self, index):
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(((INDEX_VERSION, NORMALIZE_VERSION), index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.error(f"не удалось сохранить индекс {self.index_path}: {e}")
+
+    def get(self):
+        mtime_ns, size = self._stat()
+        index = self.index
+        if index is not None and (index.mtime_ns, index.size) == (mtime_ns, size):
+            return index
+        if index is None:
+            index = self._load_cached()
+            if index is not None and (index.mtime_ns, index.size) == (mtime_ns, size):
+                self.index = index
+                return index
+        items, digest = _read_source(self.path)
+        if index is not None and index.digest == digest:
+            # файл "тронут" без изменения содержимого: переиспользуем скомпилированный индекс
+            index.mtime_ns, index.size = mtime_ns, size
+        else:
+            index = self.index_class(self.path, items, mtime_ns, size, digest).compile()
+            if self.index is not None: logger.info(f"список {self.path} изменился, индекс пересобран: {len(index)} записей.")
+        if digest is not None: self._save(index)
+        self.index = index
+        return index
+
+
+_terms = None
+_whitelist = None
+
+def get_term_index() -> TermIndex:
+    # актуальный индекс terms.txt (перечитывается только при изменении файла)
+    global _terms
+    if _terms is None:
+        _terms = CompiledList(config.TERMS_FILE, TermIndex)
+    return _terms.get()
+
+def get_whitelist_index() -> ListIndex:
+    global _whitelist
+    if _whitelist is None:
+        _whitelist = CompiledList(config.WHITELIST_FILE)
+    return _whitelist.get()
@@ -0,0 +1,147 @@
+# telethon_client/thresholds.py
+# порог удаления и классификация чатов по колонкам итогов анализа (повторное разбиение без сканирования)
+import time
+from array import array
+
+import config
+
+try:
+    import numpy as np # необязателен: без него классификация идет одним циклом по array
+except ImportError:
+    np = None
+
+POLICY_MODES = ("count", "density")
+
+
+class ThresholdPolicy:
+    """
+    Правило выбора кандидатов на полное удаление чата:
+    count - триггеров больше value (DELETION_THRESHOLD);
+    density - триггеров больше value на одно просмотренное сообщение
+    (доля, DENSITY_THRESHOLD) - длинные чаты с редкими триггерами не удаляются целиком.
+    Остальные чаты с триггерами - кандидаты на удаление отдельных сообщений.
+    """
+    __slots__ = ("mode", "value")
+
+    def __init__(self, mode=None, value=None):
+        mode = mode or config.DELETION_POLICY
+        if mode not in POLICY_MODES: raise ValueError(f"неизвестный порог: {mode}")
+        if value is None: value = config.DELETION_THRESHOLD if mode == "count" else config.DENSITY_THRESHOLD
+        if value < 0 or (mode == "density" and value > 1): raise ValueError(f"недопустимое значение порога: {value}")
+        self.mode = mode
+        self.value = int(value) if mode == "count" else float(value)
+
+    @classmethod
+    def parse(cls, args):
+        # из аргументов /threshold: "5" или "count 5" - по числу, "density 0.02" или "density 2%" - по доле
+        if len(args) == 1: args = ["count", args[0]]
+        if len(args) != 2: raise ValueError("ожидается режим и значение")
+        mode, raw = args[0].lower(), args[1]
+        if mode == "count": return cls(mode, int(raw))
+        value = float(raw.rstrip("%")) / 100 if raw.endswith("%") else float(raw)
+        return cls(mode, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("mode"), data.get("value"))
+
+    def to_dict(self):
+        return {"mode": self.mode, "value": self.value}
+
+    def __eq__(self, other):
+        return isinstance(other, ThresholdPolicy) and (self.mode, self.value) == (other.mode, other.value)
+
+    def exceeds(self, count, message_count):
+        # кандидат на полное удаление; одинаково работает для чисел и поэлементно для массивов numpy
+        if self.mode == "density": return count > self.value * message_count
+        return count > self.value
+
+    def _percent(self):
+        return f"{self.value * 100:g}%"
+
+    def describe(self):
+        if self.mode == "density": return f"> {self._percent()} просмотренных сообщений с триггерами"
+        return f"> {self.value} триггеров"
+
+    def above_label(self):
+        return f"плотность >{self._percent()}" if self.mode == "density" else f">{self.value}"
+
+    def below_label(self):
+        return f"плотность <= {self._percent()}" if self.mode == "density" else f"<= {self.value}"
+
+    def describe_below(self):
+        # чаты на удаление отдельных сообщений
+        if self.mode == "density": return f"<= {self._percent()} просмотренных сообщений с триггерами"
+        return f"1-{self.value} триггеров"
+
+
+class ThresholdSplit:
+    """
+    Разбиение чатов запуска по порогу: full - id чатов на полное удаление (в порядке
+    анализа), messages - {id чата: сообщений с триггерами} на удаление сообщений,
+    uncertain - чаты ниже порога, где загрузка была остановлена на старом пороге
+    (EARLY_STOP_SCAN): число триггеров и id сообщений неполные, нужен новый /analyze,
+    clean - чатов без действий (включая белый список и уже обработанные).
+    """
+    __slots__ = ("policy", "full", "messages", "uncertain", "clean", "elapsed")
+
+    def __init__(self, policy, full, messages, uncertain, clean, elapsed):
+        self.policy = policy
+        self.full = full
+        self.messages = messages
+        self.uncertain = uncertain
+        self.clean = clean
+        self.elapsed = elapsed # секунд на классификацию
+
+
+class ChatColumns:
+    """
+    Итоги запуска анализа колонками (array('q') / numpy без копирования) - только
+    чаты, которые еще могут быть кандидатами: не белый список, не удалены и не очищены.
+    classify() разбивает их по любому порогу за один векторный проход, без запросов к
+    хранилищу; total - всего чатов в запуске (для числа чатов без действий).
+    """
+
+    def __init__(self, run_id, rows, total):
+        # rows: (chat_id, count, message_count, trigger_messages, count_lower_bound) в порядке анализа
+        self.run_id = run_id
+        self.total = total
+        self.ids, self.counts, self.message_counts, self.trigger_messages = array('q'), array('q'), array('q'), array('q')
+        self.lower_bound = array('B')
+        for chat_id, count, message_count, trigger_messages, lower_bound in rows:
+            self.ids.append(chat_id); self.counts.append(count); self.message_counts.append(message_count)
+            self.trigger_messages.append(trigger_messages); self.lower_bound.append(1 if lower_bound else 0)
+        self._np = None
+        if np is not None and len(self.ids):
+            self._np = (np.frombuffer(self.ids, dtype=np.int64), np.frombuffer(self.counts, dtype=np.int64),
+                        np.frombuffer(self.message_counts, dtype=np.int64), np.frombuffer(self.trigger_messages, dtype=np.int64),
+                        np.frombuffer(self.lower_bound, dtype=np.uint8).astype(bool))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _classify_numpy(self, policy):
+        ids, counts, message_counts, trigger_messages, lower_bound = self._np
+        full = policy.exceeds(counts, message_counts)
+        below = ~full & (counts > 0)
+        uncertain = below & lower_bound
+        messages = below & ~lower_bound & (trigger_messages > 0)
+        return (ids[full].tolist(), dict(zip(ids[messages].tolist(), trigger_messages[messages].tolist())),
+                ids[uncertain].tolist())
+
+    def _classify_loop(self, policy):
+        full, messages, uncertain = [], {}, []
+        exceeds = policy.exceeds
+        for chat_id, count, message_count, trigger_messages, lower_bound in zip(
+                self.ids, self.counts, self.message_counts, self.trigger_messages, self.lower_bound):
+            if exceeds(count, message_count): full.append(chat_id)
+            elif count <= 0: continue
+            elif lower_bound: uncertain.append(chat_id)
+            elif trigger_messages > 0: messages[chat_id] = trigger_messages
+        return full, messages, uncertain
+
+    def classify(self, policy):
+        start = time.perf_counter()
+        full, messages, uncertain = (self._classify_numpy if self._np is not None else self._classify_loop)(policy)
+        return ThresholdSplit(policy, full, messages, uncertain, self.total - len(full) - len(messages) - len(uncertain),
+                              time.perf_counter() - start)
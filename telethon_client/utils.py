@@ -1,10 +1,19 @@
 # telethon_client/utils.py
+import asyncio
 import logging
-import string
 import os
 import datetime
+import gzip
+import io
+import json
+import threading
+from html import escape
 from telethon.tl.types import User
 import config # Импорт config для доступа к константам
+from .normalizer import normalize_text
+from .thresholds import ThresholdPolicy
+from .results import AnalysisResults, ChatResult
+from .analysis_store import AnalysisStore
 
 logger = logging.getLogger(__name__)
 
@@ -41,64 +50,490 @@ async def get_user_display_name(user: User):
     return name.lower().strip()
 
 def clean_text_for_matching(text):
-    # приводит текст к нижнему регистру и удаляет пунктуацию
-    if not text: return ""
-    text_lower = text.lower()
-    translator = str.maketrans('', '', string.punctuation.replace('-', ''))
-    return text_lower.translate(translator)
+    # приводит текст к нижнему регистру, удаляет пунктуацию, эмодзи и невидимые символы, заменяет двойники букв
+    return normalize_text(text)
 
 # --- Генерация HTML отчета ---
 
-def generate_html_report(analysis_results, permanent_whitelist_ids, permanent_whitelist_names, candidates_for_deletion, final_deleted_ids, terms_list):
-    # генерирует html-отчет и возвращает путь к файлу
-    # (стили и структура HTML остаются прежними, они уже используют HTML)
-    html = f"""
+DUPLICATES_IN_REPORT = 50 # строк в таблице повторяющихся текстов
+REPORT_ROW_HEIGHT = 30 # px, высота строки виртуальной таблицы (по ней считается видимый диапазон)
+REPORT_ROWS_BATCH = 1000 # перерисованных строк отчета в одной записи в хранилище
+CHAT_TYPES = ("Личный", "Группа", "Канал/супергруппа")
+# флаги строки в данных виртуального отчета
+ROW_LOWER_BOUND, ROW_SAMPLED, ROW_WHITELISTED = 1, 2, 4
+
+def _chat_status(chat_info, final_deleted_ids, deleted_messages=None, policy=None):
+    # (статус, css-класс строки, css-класс числа триггеров) - общая классификация для обоих видов отчета
+    # deleted_messages: {id чата: удалено сообщений} - итоги удаления отдельных сообщений
+    # policy: ThresholdPolicy (по умолчанию из config)
+    if policy is None: policy = ThresholdPolicy()
+    count = chat_info['count']
+    above = policy.exceeds(count, chat_info.get('message_count', 0))
+    if chat_info['id'] in final_deleted_ids: status_text, status_class = "УДАЛЕН", "deleted danger-high"
+    elif chat_info.get('is_whitelisted', False): status_text, status_class = "Белый список", "whitelist"
+    elif deleted_messages and chat_info['id'] in deleted_messages: status_text, status_class = f"Удалено сообщений: {deleted_messages[chat_info['id']]}", "kept danger-low"
+    elif above: status_text, status_class = f"Кандидат {policy.above_label()}", "kept danger-high"
+    elif count > 0: status_text, status_class = f"Триггеры {policy.below_label()}", "kept danger-medium"
+    else: status_text, status_class = "Нет триггеров", "kept neutral"
+    danger_class = "neutral"
+    if above: danger_class = "danger-high"
+    elif count > 0: danger_class = "danger-medium"
+    return status_text, status_class, danger_class
+
+def _chat_type(chat_id):
+    # тип по "помеченному" id Telethon: > 0 - пользователь, -100... - канал/супергруппа, иначе - обычная группа
+    if chat_id > 0: return 0
+    return 2 if chat_id <= -1000000000000 else 1
+
+_VIRTUAL_REPORT_CSS = """
+.vt-filters{display:flex;flex-wrap:wrap;gap:10px;margin-bottom:10px}.vt-filters select,.vt-filters input{background:#282c34;color:#abb2bf;border:1px solid #4b5263;padding:4px}
+#vt-viewport{height:70vh;overflow-y:auto;border:1px solid #4b5263}#vt{table-layout:fixed;margin:0;overflow:visible;border-radius:0}
+#vt th{position:sticky;top:0;cursor:pointer;user-select:none;padding:6px 10px}#vt td{padding:0 10px;height:""" + str(REPORT_ROW_HEIGHT) + """px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis}
+#vt td.vt-pad{padding:0;border:0}#vt-terms tr{cursor:pointer}
+"""
+
+_VIRTUAL_REPORT_JS = """
+(function(){
+var D=JSON.parse(document.getElementById('vt-data').textContent), rows=D.rows;
+var vp=document.getElementById('vt-viewport'), body=document.getElementById('vt-body'), info=document.getElementById('vt-info');
+var fStatus=document.getElementById('vt-status'), fType=document.getElementById('vt-type'), fMin=document.getElementById('vt-min'), fText=document.getElementById('vt-text'), fTerm=document.getElementById('vt-term');
+var ROW=D.row_height, view=[], sortCol=0, sortDir=1, first=-1, pending=false;
+// ключи сортировки по колонкам заголовка (0 - исходный порядок отчета)
+var KEYS=[null, function(r){return String(r[1]).toLowerCase();}, function(r){return r[0];}, function(r){return r[2];},
+  function(r){return r[7].length;}, function(r){return r[3];}, function(r){return r[5]&2?r[6]:-1;}];
+function options(select, labels){labels.forEach(function(label, i){var o=document.createElement('option'); o.value=i; o.textContent=label; select.appendChild(o);});}
+function cell(tr, text){var td=document.createElement('td'); td.textContent=text; tr.appendChild(td); return td;}
+function pad(height){var tr=document.createElement('tr'), td=document.createElement('td'); td.colSpan=7; td.className='vt-pad'; td.style.height=height+'px'; tr.appendChild(td); return tr;}
+function render(force){
+  var start=Math.max(0, Math.floor(vp.scrollTop/ROW)-10);
+  if(!force && start===first) return;
+  first=start;
+  var end=Math.min(view.length, start+Math.ceil(vp.clientHeight/ROW)+20), frag=document.createDocumentFragment();
+  frag.appendChild(pad(start*ROW));
+  for(var p=start; p<end; p++){
+    var r=rows[view[p]], st=D.statuses[r[3]], tr=document.createElement('tr');
+    tr.className=st[1];
+    cell(tr, view[p]+1); cell(tr, r[1]); cell(tr, r[0]);
+    cell(tr, (r[5]&1?'≥':'')+r[2]).className=st[2];
+    cell(tr, r[7].length).title=r[7].map(function(t){return D.terms[t];}).join(', ');
+    cell(tr, st[0]);
+    cell(tr, r[5]&2?'выборка ('+r[6]+')':(r[5]&4?'':'полная'));
+    frag.appendChild(tr);
+  }
+  frag.appendChild(pad((view.length-end)*ROW));
+  body.replaceChildren(frag);
+  // высота строки задана в CSS, но браузер может округлить - берем фактическую
+  var row=body.children[1];
+  if(row && end>start){var h=row.getBoundingClientRect().height; if(h && Math.abs(h-ROW)>0.5){ROW=h; render(true);}}
+}
+function sortView(){
+  var key=KEYS[sortCol];
+  if(key) view.sort(function(a, b){var x=key(rows[a]), y=key(rows[b]); return (x<y?-1:x>y?1:a-b)*sortDir;});
+  else if(sortDir<0) view.reverse();
+  info.textContent='Показано чатов: '+view.length+' из '+rows.length;
+  vp.scrollTop=0; render(true);
+}
+function applyFilter(){
+  var st=fStatus.value===''?-1:+fStatus.value, ty=fType.value===''?-1:+fType.value, tm=fTerm.value===''?-1:+fTerm.value;
+  var mn=+fMin.value||0, tx=fText.value.trim().toLowerCase();
+  view=[];
+  for(var i=0; i<rows.length; i++){
+    var r=rows[i];
+    if(st>=0 && r[3]!==st || ty>=0 && r[4]!==ty || r[2]<mn || tm>=0 && r[7].indexOf(tm)<0) continue;
+    if(tx && String(r[1]).toLowerCase().indexOf(tx)<0 && String(r[0]).indexOf(tx)<0) continue;
+    view.push(i);
+  }
+  sortView();
+}
+options(fStatus, D.statuses.map(function(s){return s[0];})); options(fType, D.types); options(fTerm, D.terms);
+[fStatus, fType, fTerm].forEach(function(el){el.addEventListener('change', applyFilter);});
+[fMin, fText].forEach(function(el){el.addEventListener('input', applyFilter);});
+document.querySelectorAll('#vt th').forEach(function(th, col){th.addEventListener('click', function(){
+  sortDir=sortCol===col?-sortDir:(col>=3?-1:1); sortCol=col; sortView();
+});});
+vp.addEventListener('scroll', function(){if(pending) return; pending=true; requestAnimationFrame(function(){pending=false; render(false);});});
+// сводка по триггерам: клик по строке - фильтр таблицы чатов по этому триггеру
+var order=D.terms.map(function(t, i){return i;}).sort(function(a, b){return D.term_chats[b]-D.term_chats[a];}), terms=document.getElementById('vt-terms');
+order.forEach(function(t){
+  var tr=document.createElement('tr'); cell(tr, D.terms[t]); cell(tr, D.term_chats[t]); cell(tr, D.term_candidates[t]);
+  tr.addEventListener('click', function(){fTerm.value=t; applyFilter(); vp.scrollIntoView();});
+  terms.appendChild(tr);
+});
+applyFilter();
+})();
+"""
+
+def _separated(items, separator):
+    # items с разделителем между ними (для записи списка по одному элементу)
+    first = True
+    for item in items:
+        if not first: yield separator
+        first = False
+        yield item
+
+def _json(value):
+    # компактный JSON для встраивания в <script> ("</" внутри закрыл бы тег)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+_REPORT_HEAD = """
 <!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8"><title>Отчет SVOBODA Bot</title><style>
-body{{font-family:'Segoe UI',Tahoma,Geneva,Verdana,sans-serif;line-height:1.6;padding:25px;background-color:#282c34;color:#abb2bf;margin:0}}
-h1,h2,h3{{color:#61afef;border-bottom:1px solid #4b5263;padding-bottom:8px;margin-top:30px;margin-bottom:15px}}h1{{text-align:center;border-bottom:2px solid #61afef;margin-bottom:30px}}
-table{{width:100%;border-collapse:collapse;margin-bottom:25px;background-color:#3b4048;box-shadow:0 2px 5px rgba(0,0,0,0.2);border-radius:5px;overflow:hidden}}
-th,td{{border:1px solid #4b5263;padding:12px 15px;text-align:left;vertical-align:top}}th{{background-color:#4f5660;color:#fff;font-weight:600}}
-.whitelist{{background-color:rgba(97,175,239,.2)}}.deleted{{background-color:rgba(224,108,117,.2);text-decoration:line-through}}.kept{{background-color:rgba(152,195,121,.15)}}
-.danger-high{{color:#e06c75;font-weight:700}}.danger-medium{{color:#d19a66}}.danger-low{{color:#98c379}}.neutral{{color:#abb2bf}}
-.trigger-list{{font-size:.85em;color:#e5c07b;max-width:350px;word-wrap:break-word;line-height:1.4}}
-.summary p,.section ul{{margin:8px 0}}.section{{margin-bottom:30px;padding:20px;border:1px solid #4b5263;border-radius:8px;background-color:#323842}}
-.section ul{{padding-left:20px}}.section li{{margin-bottom:5px}}
-td:nth-child(3){{font-family:'Courier New',Courier,monospace;font-size:.9em;color:#56b6c2}}td:last-child{{font-weight:500}}
-</style></head><body><h1>Отчет анализатора чатов SVOBODA</h1><div class="section summary"><h2>Сводка</h2>
-<p>Всего проанализировано чатов: {len(analysis_results)}</p><p>Загружено триггер-слов: {len(terms_list)}</p><p>Порог для удаления: > {config.DELETION_THRESHOLD} триггеров</p>
-<p>Имен в постоянном белом списке: {len(permanent_whitelist_names)}</p><p>ID в постоянном белом списке: {len(permanent_whitelist_ids)}</p><p>Чатов удалено: {len(final_deleted_ids)}</p></div>
-<div class="section"><h2>Постоянный белый список (Не удаляются)</h2><p>Имена/Названия из {config.WHITELIST_FILE}:</p><ul>{''.join(f'<li>{name}</li>' for name in permanent_whitelist_names) if permanent_whitelist_names else '<li>Список пуст</li>'}</ul>
-<p>Разрешенные ID пользователей: {permanent_whitelist_ids if permanent_whitelist_ids else 'Нет'}</p></div><div class="section"><h2>Анализ чатов</h2><table>
-<thead><tr><th>#</th><th>Название чата</th><th>ID чата</th><th>Кол-во триггеров</th><th>Найденные триггеры</th><th>Статус</th></tr></thead><tbody>
+body{font-family:'Segoe UI',Tahoma,Geneva,Verdana,sans-serif;line-height:1.6;padding:25px;background-color:#282c34;color:#abb2bf;margin:0}
+h1,h2,h3{color:#61afef;border-bottom:1px solid #4b5263;padding-bottom:8px;margin-top:30px;margin-bottom:15px}h1{text-align:center;border-bottom:2px solid #61afef;margin-bottom:30px}
+table{width:100%;border-collapse:collapse;margin-bottom:25px;background-color:#3b4048;box-shadow:0 2px 5px rgba(0,0,0,0.2);border-radius:5px;overflow:hidden}
+th,td{border:1px solid #4b5263;padding:12px 15px;text-align:left;vertical-align:top}th{background-color:#4f5660;color:#fff;font-weight:600}
+.whitelist{background-color:rgba(97,175,239,.2)}.deleted{background-color:rgba(224,108,117,.2);text-decoration:line-through}.kept{background-color:rgba(152,195,121,.15)}
+.danger-high{color:#e06c75;font-weight:700}.danger-medium{color:#d19a66}.danger-low{color:#98c379}.neutral{color:#abb2bf}
+.trigger-list{font-size:.85em;color:#e5c07b;max-width:350px;word-wrap:break-word;line-height:1.4}
+.summary p,.section ul{margin:8px 0}.section{margin-bottom:30px;padding:20px;border:1px solid #4b5263;border-radius:8px;background-color:#323842}
+.section ul{padding-left:20px}.section li{margin-bottom:5px}
+td:nth-child(3){font-family:'Courier New',Courier,monospace;font-size:.9em;color:#56b6c2}td:nth-child(6){font-weight:500}td:last-child{font-size:.85em}
+"""
+
+_TABLE_START = """<div class="section"><h2>Анализ чатов</h2><table>
+<thead><tr><th>#</th><th>Название чата</th><th>ID чата</th><th>Кол-во триггеров</th><th>Найденные триггеры</th><th>Статус</th><th>Проверка</th></tr></thead><tbody>"""
+
+_VIRTUAL_TABLE_START = """<div class="section"><h2>Анализ чатов</h2><div class="vt-filters">
+<select id="vt-status"><option value="">Все статусы</option></select><select id="vt-type"><option value="">Все типы</option></select>
+<select id="vt-term"><option value="">Все триггеры</option></select><input id="vt-min" type="number" min="0" placeholder="Триггеров от">
+<input id="vt-text" type="search" placeholder="Название или ID"><span id="vt-info"></span></div>
+<div id="vt-viewport"><table id="vt"><colgroup><col style="width:6%"><col style="width:34%"><col style="width:16%"><col style="width:10%"><col style="width:9%"><col style="width:15%"><col style="width:10%"></colgroup>
+<thead><tr><th>#</th><th>Название чата</th><th>ID чата</th><th>Кол-во триггеров</th><th>Триггеров</th><th>Статус</th><th>Проверка</th></tr></thead><tbody id="vt-body"></tbody></table></div>
+<p>Список найденных триггеров чата - во всплывающей подсказке колонки «Триггеров»; клик по заголовку - сортировка.</p></div>
+<div class="section"><h2>Сводка по триггерам</h2><table><thead><tr><th>Триггер</th><th>Чатов</th><th>Из них кандидатов на удаление</th></tr></thead><tbody id="vt-terms"></tbody></table></div>
+<script type="application/json" id="vt-data">"""
+
+
+def _render_table_row(position, chat_info, status):
+    # строка html-таблицы чатов (обычный отчет и частичный отчет во время анализа)
+    status_text, status_class, danger_class = status
+    chat_id, title, count = chat_info['id'], chat_info['title'], chat_info['count']
+    found_triggers = chat_info.get('found_triggers', set()) # Это уже list в analysis_cache
+    triggers_str = ', '.join(sorted(list(found_triggers))) if found_triggers else 'Нет' # На случай если пришел set
+    # загрузка остановлена на пороге (EARLY_STOP_SCAN): триггеров не меньше count
+    scan_str = f"выборка ({chat_info.get('message_count', 0)})" if chat_info.get('sampled') else ("" if chat_info.get('is_whitelisted', False) else "полная")
+    count_str = f'<span title="загрузка чата остановлена на пороге удаления">≥{count}</span>' if chat_info.get('count_lower_bound') else count
+    return f'<tr class="{status_class}"><td>{position+1}</td><td>{title}</td><td>{chat_id}</td><td class="{danger_class}">{count_str}</td><td class="trigger-list">{triggers_str}</td><td>{status_text}</td><td>{scan_str}</td></tr>'
+
+
+class ReportWriter:
+    """
+    Запись отчета на диск кусками через буфер REPORT_WRITE_BUFFER: документ
+    целиком в памяти не собирается. compress - сжатый файл (path + ".gz") для
+    отправки. Методы синхронные - из бота вызываются в рабочем потоке.
+    """
+
+    def __init__(self, path, compress=False):
+        self.path = path + ".gz" if compress else path
+        if compress:
+            raw = io.BufferedWriter(gzip.GzipFile(self.path, 'wb'), config.REPORT_WRITE_BUFFER)
+            self._file = io.TextIOWrapper(raw, encoding='utf-8')
+        else:
+            self._file = open(self.path, 'w', encoding='utf-8', buffering=config.REPORT_WRITE_BUFFER)
+
+    def write(self, text):
+        self._file.write(text)
+
+    def write_all(self, parts):
+        for part in parts:
+            self._file.write(part)
+
+    def flush(self):
+        # дописанное становится видно в файле (для сжатого - до конца текущего блока)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReportDocument:
+    """
+    HTML-отчет по запуску анализа из хранилища (AnalysisStore): чаты в память не
+    загружаются. Строки таблицы чатов отрисовываются один раз и лежат в хранилище
+    (report_rows) вместе со статусом, с которым отрисованы; порядок строк задается
+    при создании отчета. Статусы берутся из хранилища, поэтому удаления сначала
+    отмечаются там, затем mark_* - в отчете: пересчитываются только затронутые
+    чаты, перерисовываются строки со сменившимся статусом, документ склеивается
+    из строк хранилища в порядке отчета. Смена порога (set_policy) проходит все
+    строки страницами; порядок строк остается тем, что был при создании. Объект
+    живет в кэше анализа, после перезапуска отчет продолжает те же строки.
+    save() пишет документ через ReportWriter по одной строке из хранилища и
+    рассчитан на рабочий поток (asyncio.to_thread): там у него свое соединение
+    с хранилищем (AnalysisStore.fork), а сохранения идут по одному. Конструктор
+    в хранилище не обращается: число чатов, режим таблицы и порядок строк
+    определяются при первой отрисовке, уже в рабочем потоке.
+    """
+
+    def __init__(self, store, run_id, permanent_whitelist_ids, permanent_whitelist_names, terms_list, duplicates=None, virtual=None, policy=None):
+        # virtual: таблица чатов рисуется в браузере из JSON (None - если чатов больше REPORT_VIRTUAL_MIN_CHATS)
+        # policy: ThresholdPolicy - порог удаления (по умолчанию из config)
+        self.store = store
+        self.run_id = run_id
+        self.policy = policy or ThresholdPolicy()
+        self.permanent_whitelist_ids = permanent_whitelist_ids
+        self.permanent_whitelist_names = permanent_whitelist_names
+        self.terms_count = len(terms_list)
+        self.duplicates = duplicates
+        self.deleted_contacts = [] # имена удаленных контактов
+        self.virtual = virtual # None - решается в _prepare по числу чатов
+        self.chat_count = None # известно после _prepare
+        self._prepared = False
+        self._dirty = None # None - проверить все строки
+        self._statuses = {}
+        self._terms = {} # {триггер: номер} виртуальной таблицы (по алфавиту - не меняется)
+        self._term_summary = []
+        self._static = None # (белый список, повторяющиеся тексты) - после удалений не меняются
+        self.rendered_rows = 0 # сколько строк перерисовал последний render()
+        self._lock = threading.Lock() # одно сохранение за раз
+
+    def set_policy(self, policy):
+        # новый порог: статусы пересчитываются у всех строк, перерисуются те, где статус сменился; False - порог тот же
+        if policy == self.policy: return False
+        self.policy = policy
+        self._dirty = None
+        return True
+
+    def _mark_dirty(self, chat_ids):
+        if self._dirty is not None: self._dirty.update(chat_ids)
+
+    def mark_chats_deleted(self, chat_ids):
+        self._mark_dirty(chat_ids)
+
+    def mark_messages_deleted(self, deleted_by_chat):
+        # deleted_by_chat: {id чата: удалено сообщений} (итог delete_messages_job)
+        self._mark_dirty(chat_id for chat_id, count in deleted_by_chat.items() if count)
+
+    def mark_contacts_deleted(self, names):
+        # строки чатов не меняются - только сводка и список удаленных контактов
+        self.deleted_contacts.extend(names)
+
+    def _render_row(self, position, chat_info, status):
+        if not self.virtual: return _render_table_row(position, chat_info, status)
+        chat_id = chat_info['id']
+        status_index = self._statuses.setdefault(status, len(self._statuses))
+        flags = ((ROW_LOWER_BOUND if chat_info.get('count_lower_bound') else 0) | (ROW_SAMPLED if chat_info.get('sampled') else 0)
+                 | (ROW_WHITELISTED if chat_info.get('is_whitelisted') else 0))
+        trigger_indexes = [self._terms[term] for term in sorted(chat_info.get('found_triggers') or ())]
+        return _json([chat_id, chat_info['title'], chat_info['count'], status_index, _chat_type(chat_id), flags, chat_info.get('message_count', 0), trigger_indexes])
+
+    def _render_static(self):
+        # (белый список - перед таблицей чатов, повторяющиеся тексты - после нее)
+        names = self.permanent_whitelist_names
+        whitelist_html = f"""<div class="section"><h2>Постоянный белый список (Не удаляются)</h2><p>Имена/Названия из {config.WHITELIST_FILE}:</p><ul>{''.join(f'<li>{name}</li>' for name in names) if names else '<li>Список пуст</li>'}</ul>
+<p>Разрешенные ID пользователей: {self.permanent_whitelist_ids if self.permanent_whitelist_ids else 'Нет'}</p></div>
+"""
+        html = ""
+        duplicates = self.duplicates
+        if duplicates:
+            html += f"""<div class="section"><h2>Повторяющиеся тексты</h2><p>Тексты с триггерами, встреченные в {config.DUPLICATE_MIN_CHATS} и более чатах (показано до {DUPLICATES_IN_REPORT}):</p><table>
+<thead><tr><th>#</th><th>Начало текста</th><th>Чатов</th><th>Найденные триггеры</th></tr></thead><tbody>"""
+            html += "".join(f'<tr><td>{i+1}</td><td>{escape(duplicate["text"])}</td><td>{duplicate["chats"]}</td><td class="trigger-list">{", ".join(duplicate["terms"])}</td></tr>'
+                            for i, duplicate in enumerate(duplicates[:DUPLICATES_IN_REPORT]))
+            html += """</tbody></table></div>"""
+        return whitelist_html, html
+
+    def _render_summary(self, summary):
+        return f"""<div class="section summary"><h2>Сводка</h2>
+<p>Всего проанализировано чатов: {summary['total']}</p><p>Загружено триггер-слов: {self.terms_count}</p><p>Порог для удаления: {self.policy.describe()}</p>
+{f'<p>Чатов, проверенных только выборкой последних сообщений (двухфазный анализ): {summary["sampled"]}, остальные просканированы полностью</p>' if summary['sampled'] else ''}
+{f'<p>Чатов, где загрузка остановлена на пороге (число триггеров - нижняя оценка, отмечено ≥): {summary["lower_bound"]}</p>' if summary['lower_bound'] else ''}
+<p>Имен в постоянном белом списке: {len(self.permanent_whitelist_names)}</p><p>ID в постоянном белом списке: {len(self.permanent_whitelist_ids)}</p><p>Чатов удалено: {summary['deleted_chats']}</p>
+{f'<p>Сообщений удалено: {summary["deleted_messages"]} (в {summary["cleaned_chats"]} чатах)</p>' if summary['deleted_messages'] else ''}
+{f'<p>Контактов удалено: {len(self.deleted_contacts)}</p>' if self.deleted_contacts else ''}</div>
+"""
+
+    def _render_contacts(self):
+        if not self.deleted_contacts: return ""
+        return ("""<div class="section"><h2>Удаленные контакты</h2><ul>"""
+                + "".join(f"<li>{escape(name)}</li>" for name in self.deleted_contacts) + "</ul></div>")
+
+    def _prepare(self, store):
+        # первая отрисовка: число чатов, режим таблицы и отчет в хранилище (новый или оставшийся с прошлого запуска бота)
+        self.chat_count = store.summary(self.run_id)["total"]
+        if self.virtual is None: self.virtual = self.chat_count > config.REPORT_VIRTUAL_MIN_CHATS
+        state = store.report_state(self.run_id)
+        if state is None or state["virtual"] != self.virtual:
+            store.create_report(self.run_id, self.virtual, self.policy)
+            self._dirty = None
+        else:
+            # строки уже отрисованы (отчет после перезапуска): проверяются чаты с удалениями, при другом пороге - все
+            # (удаления до первой отрисовки уже отмечены в хранилище, mark_* их не копили)
+            deleted_ids, deleted_messages = store.deleted_state(self.run_id)
+            self._dirty = None if state["policy"] != self.policy else deleted_ids | set(deleted_messages)
+            self._statuses = {status: i for i, status in enumerate(state["statuses"])}
+        self._prepared = True
+
+    def refresh(self, store=None):
+        # перерисовывает строки чатов из _dirty (None - все), у которых изменился статус, и пишет их в хранилище
+        store = store or self.store
+        if not self._prepared: self._prepare(store)
+        policy = self.policy # set_policy во время отрисовки сбросит _dirty - строки перепроверит следующий вызов
+        dirty, self._dirty = self._dirty, set()
+        if self.virtual:
+            self._term_summary = store.term_summary(self.run_id, policy)
+            self._terms = {term: i for i, (term, _, _) in enumerate(self._term_summary)}
+        rendered, changed = 0, []
+        for position, chat_info, deleted, deleted_messages, rendered_status in store.report_chats(self.run_id, dirty):
+            chat_id = chat_info.id
+            status = _chat_status(chat_info, (chat_id,) if deleted else (), {chat_id: deleted_messages} if deleted_messages else None, policy)
+            if status == rendered_status: continue
+            changed.append((chat_id, status, self._render_row(position, chat_info, status)))
+            if len(changed) >= REPORT_ROWS_BATCH:
+                store.update_report_rows(self.run_id, changed)
+                rendered += len(changed)
+                changed = []
+        store.update_report_rows(self.run_id, changed)
+        store.set_report_state(self.run_id, policy, list(self._statuses))
+        self.rendered_rows = rendered + len(changed)
+
+    def _parts(self, store):
+        # куски документа по порядку; строки таблицы читаются из хранилища по одной
+        if self._static is None: self._static = self._render_static()
+        yield from (_REPORT_HEAD, _VIRTUAL_REPORT_CSS if self.virtual else "", "</style></head><body><h1>Отчет анализатора чатов SVOBODA</h1>",
+                    self._render_summary(store.summary(self.run_id)), self._static[0])
+        if self.virtual:
+            # справочник статусов дополняется по мере отрисовки строк, поэтому пишется после них
+            yield _VIRTUAL_TABLE_START
+            yield '{"rows":['
+            yield from _separated(store.report_html(self.run_id), ",")
+            yield "],"
+            yield _json({
+                "row_height": REPORT_ROW_HEIGHT, "statuses": list(self._statuses), "types": CHAT_TYPES, "terms": list(self._terms),
+                "term_chats": [chats for _, chats, _ in self._term_summary],
+                "term_candidates": [candidates for _, _, candidates in self._term_summary]})[1:]
+            yield from ("</script><script>", _VIRTUAL_REPORT_JS, "</script>")
+        else:
+            yield _TABLE_START
+            yield from store.report_html(self.run_id)
+            yield "</tbody></table></div>"
+        yield from (self._static[1], self._render_contacts(), "</body></html>")
+
+    def render(self):
+        # документ одной строкой (для проверок; в файл отчет пишется save() по частям)
+        with self._lock:
+            self.refresh()
+            return "".join(self._parts(self.store))
+
+    def save(self, compress=None):
+        # пишет отчет в новый файл и возвращает путь (None - не удалось); compress - .html.gz (по умолчанию REPORT_GZIP)
+        # синхронно: из бота вызывается через asyncio.to_thread, чтобы запись не останавливала event loop
+        if compress is None: compress = config.REPORT_GZIP
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_filepath = config.REPORT_FILENAME_TEMPLATE.format(timestamp=timestamp)
+        os.makedirs(config.REPORTS_DIR, exist_ok=True)
+        with self._lock:
+            store = self.store.fork()
+            try:
+                self.refresh(store)
+                with ReportWriter(report_filepath, compress) as writer:
+                    writer.write_all(self._parts(store))
+                logger.info(f"html-отчет сохранен: {writer.path} (перерисовано строк: {self.rendered_rows} из {self.chat_count})")
+                return writer.path
+            except Exception as e:
+                logger.error(f"не удалось сохранить html-отчет: {e}")
+                return None
+            finally:
+                if store is not self.store: store.conn.close()
+
+
+class PartialReport:
     """
-    analysis_results.sort(key=lambda x: (-(x['count'] > config.DELETION_THRESHOLD and not x.get('is_whitelisted', False)), -x['count']))
-    for i, chat_info in enumerate(analysis_results):
-        chat_id, title, count = chat_info['id'], chat_info['title'], chat_info['count']
-        found_triggers = chat_info.get('found_triggers', set()) # Это уже list в analysis_cache
-        is_permanent_whitelist = chat_info.get('is_whitelisted', False)
-        is_deleted = chat_id in final_deleted_ids
-        status_text, status_class = "", ""
-        if is_deleted: status_text, status_class = "УДАЛЕН", "deleted danger-high"
-        elif is_permanent_whitelist: status_text, status_class = "Белый список", "whitelist"
-        elif count > config.DELETION_THRESHOLD: status_text, status_class = f"Кандидат >{config.DELETION_THRESHOLD}", "kept danger-high"
-        elif count > 0: status_text, status_class = f"Триггеры <= {config.DELETION_THRESHOLD}", "kept danger-medium"
-        else: status_text, status_class = "Нет триггеров", "kept neutral"
-        danger_class = "neutral"
-        if count > config.DELETION_THRESHOLD: danger_class = "danger-high"
-        elif count > 0: danger_class = "danger-medium"
-        triggers_str = ', '.join(sorted(list(found_triggers))) if found_triggers else 'Нет' # На случай если пришел set
-        html += f'<tr class="{status_class}"><td>{i+1}</td><td>{title}</td><td>{chat_id}</td><td class="{danger_class}">{count}</td><td class="trigger-list">{triggers_str}</td><td>{status_text}</td></tr>'
-    html += """</tbody></table></div></body></html>"""
-
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_filepath = config.REPORT_FILENAME_TEMPLATE.format(timestamp=timestamp)
-    os.makedirs(config.REPORTS_DIR, exist_ok=True)
+    Отчет, который дописывается во время анализа: шапка пишется при открытии,
+    строки чатов - в порядке сканирования, пачками по REPORT_PARTIAL_ROWS в
+    рабочем потоке. На диске в любой момент лежит частичный отчет по уже
+    просмотренным чатам (браузер показывает таблицу и без закрывающих тегов);
+    finish() дописывает подвал, discard() удаляет файл, когда готов полный отчет.
+    """
+
+    def __init__(self, terms_count, policy=None):
+        self.policy = policy or ThresholdPolicy()
+        self.terms_count = terms_count
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = config.REPORT_FILENAME_TEMPLATE.format(timestamp=f"{timestamp}_partial")
+        self.rows = 0
+        self._pending = []
+        self._writer = None
+        self._lock = asyncio.Lock() # пачки пишутся по одной и по порядку
+
+    def _open(self):
+        os.makedirs(config.REPORTS_DIR, exist_ok=True)
+        writer = ReportWriter(self.path)
+        writer.write_all((_REPORT_HEAD, "</style></head><body><h1>Отчет анализатора чатов SVOBODA</h1>",
+                          f"""<div class="section summary"><h2>Частичный отчет</h2><p>Анализ еще идет: чаты ниже - в порядке просмотра, без сортировки.</p>
+<p>Загружено триггер-слов: {self.terms_count}</p><p>Порог для удаления: {self.policy.describe()}</p></div>""", _TABLE_START))
+        writer.flush()
+        self._writer = writer
+
+    def _write_rows(self, rows):
+        self._writer.write_all(rows)
+        self._writer.flush()
+
+    def _close(self):
+        if self._writer is None: return
+        self._writer.write("</tbody></table></div></body></html>")
+        self._writer.close()
+        self._writer = None
+
+    async def open(self):
+        # частичный отчет - вспомогательный: ошибка записи не останавливает анализ
+        try:
+            await asyncio.to_thread(self._open)
+        except OSError as e:
+            logger.warning(f"частичный html-отчет не создан: {e}")
+
+    async def add(self, chat_info):
+        if self._writer is None: return
+        self._pending.append(_render_table_row(self.rows, chat_info, _chat_status(chat_info, (), None, self.policy)))
+        self.rows += 1
+        if len(self._pending) >= config.REPORT_PARTIAL_ROWS: await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows or self._writer is None: return
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except OSError as e:
+                logger.warning(f"частичный html-отчет больше не дописывается: {e}")
+                self._writer = None
+
+    async def finish(self):
+        # дописывает оставшиеся строки и подвал; путь к файлу или None, если он не открывался
+        await self.flush()
+        async with self._lock:
+            if self._writer is None: return None
+            try:
+                await asyncio.to_thread(self._close)
+            except OSError as e:
+                logger.warning(f"частичный html-отчет не дописан: {e}")
+                self._writer = None
+                return None
+        return self.path
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
 
+def generate_html_report(analysis_results, permanent_whitelist_ids, permanent_whitelist_names, final_deleted_ids, terms_list, duplicates=None, virtual=None):
+    # генерирует html-отчет и возвращает путь к файлу (разовый; отчет, обновляемый после удалений, - ReportDocument)
+    # analysis_results: ChatResult или словари с теми же ключами; отчет строится через временное хранилище в памяти,
+    # кандидаты на удаление выделяются по порогу из config
+    # duplicates: AnalysisResults.duplicates - тексты с триггерами, повторяющиеся в разных чатах
+    store = AnalysisStore(":memory:")
     try:
-        with open(report_filepath, 'w', encoding='utf-8') as f:
-            f.write(html)
-        logger.info(f"html-отчет сохранен: {report_filepath}")
-        return report_filepath
-    except Exception as e:
-        logger.error(f"не удалось сохранить html-отчет: {e}")
-        return None
\ No newline at end of file
+        results = AnalysisResults()
+        for chat_info in analysis_results:
+            results.add_chat(chat_info if isinstance(chat_info, ChatResult) else ChatResult(**{key: chat_info[key] for key in ChatResult.__slots__ if key in chat_info}))
+        run_id = store.save_run(results, permanent_whitelist_ids)
+        store.mark_chats_deleted(run_id, final_deleted_ids)
+        return ReportDocument(store, run_id, permanent_whitelist_ids, permanent_whitelist_names, terms_list, duplicates, virtual).save(compress=False)
+    finally:
+        store.conn.close()
@@ -0,0 +1,28 @@
+# tests/conftest.py
+# запуск из корня проекта: python -m pytest
+import os
+import re
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _load_config():
+    # config.py - шаблон: пока ADMIN_ID/API_ID не заполнены, он не импортируется; для тестов пустые значения - 0
+    try:
+        import config
+        return config
+    except SyntaxError:
+        pass
+    with open(os.path.join(ROOT, "config.py"), encoding="utf-8") as f:
+        source = re.sub(r"^(\w+\s*=)\s*(?=#|$)", r"\1 0 ", f.read(), flags=re.M)
+    config = types.ModuleType("config")
+    config.__file__ = os.path.join(ROOT, "config.py")
+    exec(compile(source, config.__file__, "exec"), config.__dict__)
+    sys.modules["config"] = config
+    return config
+
+
+_load_config()
@@ -0,0 +1,98 @@
+# tests/test_analysis_store.py
+import pytest
+
+import config
+from telethon_client.analysis_store import AnalysisStore
+from telethon_client.results import AnalysisResults, ChatResult
+from telethon_client.thresholds import ThresholdPolicy
+from telethon_client.utils import ReportDocument
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AnalysisStore(str(tmp_path / "store.sqlite3"))
+    yield store
+    store.conn.close()
+
+
+def chat(chat_id, count=0, **kwargs):
+    return ChatResult(chat_id, f"чат {chat_id}", count, 100, ("дроп",) if count else (), **kwargs)
+
+
+def test_run_is_hidden_until_finished(store, monkeypatch):
+    monkeypatch.setattr(config, "ANALYSIS_STORE_BATCH", 2)
+    writer = store.begin_run()
+    for position, chat_id in enumerate([3, 1, 2]):
+        writer.add(position, chat(chat_id, chat_id), [chat_id * 10])
+    # две пачки уже в хранилище, последняя - в буфере
+    assert store.conn.execute("SELECT COUNT(*) FROM chats WHERE run_id = ?", (writer.run_id,)).fetchone()[0] == 2
+    assert store.latest_run() is None
+    run_id = writer.finish(AnalysisResults(), {"terms": ["дроп"]})
+    run = store.latest_run()
+    assert (run["id"], run["chat_count"], run["terms"]) == (run_id, 3, ["дроп"])
+    assert [(c.id, list(ids)) for c, ids in store.iter_chats(run_id)] == [(3, [30]), (1, [10]), (2, [20])]
+
+
+def test_concurrent_chats_keep_dialog_order(store):
+    writer = store.begin_run()
+    writer.add(2, chat(30))
+    writer.add(0, chat(10))
+    writer.add(1, chat(20))
+    assert [(c.id, ids) for c, ids in store.iter_chats(writer.finish())] == [(10, None), (20, None), (30, None)]
+
+
+def test_discarded_and_stale_runs_are_dropped(store):
+    previous = store.save_run(AnalysisResults())
+    writer = store.begin_run()
+    writer.add(0, chat(1))
+    writer.discard()
+    assert store.latest_run()["id"] == previous
+    store.begin_run().add(0, chat(1)) # анализ упал, не дописав запуск
+    store.begin_run()
+    assert store.conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0] == 0
+
+
+def test_summary(store):
+    results = AnalysisResults()
+    for item in (chat(1, 5, count_lower_bound=True), chat(2, 1, sampled=True), chat(3)):
+        results.add_chat(item)
+    run_id = store.save_run(results)
+    store.mark_chats_deleted(run_id, [1])
+    store.mark_messages_deleted(run_id, {2: 3})
+    assert store.summary(run_id) == {"total": 3, "lower_bound": 1, "sampled": 1, "deleted_chats": 1, "deleted_messages": 3, "cleaned_chats": 1}
+
+
+def make_report(store, virtual=False):
+    results = AnalysisResults()
+    for item in (chat(1, 1), chat(2, 9), chat(3, 4), chat(4, 9, is_whitelisted=True), chat(5)):
+        results.add_chat(item)
+    run_id = store.save_run(results)
+    return run_id, ReportDocument(store, run_id, set(), [], ["дроп"], virtual=virtual, policy=ThresholdPolicy("count", 3))
+
+
+def test_report_rows_order_and_incremental_render(store):
+    run_id, report = make_report(store)
+    html = report.render()
+    assert report.rendered_rows == 5
+    # сначала кандидаты на удаление чата, затем по числу триггеров, при равенстве - порядок анализа
+    assert [chat_id for chat_id, in store.conn.execute("SELECT chat_id FROM report_rows WHERE run_id = ? ORDER BY row_order", (run_id,))] == [2, 3, 4, 1, 5]
+    assert html.index("чат 2") < html.index("чат 3") < html.index("чат 4")
+    store.mark_chats_deleted(run_id, [3])
+    report.mark_chats_deleted([3])
+    assert "УДАЛЕН" in report.render()
+    assert report.rendered_rows == 1
+    assert report.set_policy(ThresholdPolicy("count", 0))
+    report.render()
+    assert report.rendered_rows == 2 # чат 1 стал кандидатом, у чата 2 сменилась подпись порога; удаленный и пустой чаты - те же
+
+
+def test_report_after_restart_reuses_rows(store, tmp_path):
+    run_id, report = make_report(store, virtual=True)
+    report.render()
+    store.mark_chats_deleted(run_id, [2])
+    reopened = AnalysisStore(store.path)
+    report = ReportDocument(reopened, run_id, set(), [], ["дроп"], policy=ThresholdPolicy("count", 3), virtual=True)
+    html = report.render()
+    assert report.rendered_rows == 1
+    assert "УДАЛЕН" in html
+    reopened.conn.close()
@@ -0,0 +1,45 @@
+# tests/test_contact_snapshot.py
+from ctypes import c_int64, c_uint64
+
+from telethon_client.contact_snapshot import ContactSnapshot, contacts_hash
+
+
+def reference_hash(values):
+    # алгоритм из документации Telegram (Offsets/Hash generation) в арифметике uint64, как в C
+    acc = c_uint64(0)
+    for value in values:
+        acc.value ^= acc.value >> 21
+        acc.value ^= c_uint64(acc.value << 35).value
+        acc.value ^= acc.value >> 4
+        acc.value = acc.value + value
+    return c_int64(acc.value).value
+
+
+def test_hash_empty():
+    assert contacts_hash(0, []) == 0
+
+
+def test_hash_matches_reference_and_sorts_ids():
+    ids = [7000000001, 12, 5555555555, 300]
+    assert contacts_hash(4, ids) == reference_hash([4] + sorted(ids))
+    assert contacts_hash(4, ids) == contacts_hash(4, sorted(ids, reverse=True))
+
+
+def test_hash_is_signed_64_bit():
+    values = [contacts_hash(saved, range(1, 200, saved + 1)) for saved in range(50)]
+    assert all(-(1 << 63) <= value < 1 << 63 for value in values)
+    assert any(value < 0 for value in values)
+
+
+def test_hash_uses_first_100000_ids():
+    ids = list(range(100001))
+    assert contacts_hash(0, ids) == contacts_hash(0, ids[:100000])
+
+
+def test_forget_updates_hash(tmp_path):
+    snapshot = ContactSnapshot(str(tmp_path / "contacts.json"))
+    snapshot.contact_ids, snapshot.saved_count = [1, 2, 3], 2
+    snapshot.forget([2])
+    assert snapshot.contact_ids == [1, 3]
+    assert snapshot.hash == contacts_hash(2, [1, 3])
+    assert (tmp_path / "contacts.json").exists()
@@ -0,0 +1,64 @@
+# tests/test_deletion_planner.py
+from array import array
+
+from telethon_client.deletion_planner import plan_chat, plan_message_deletion, plan_totals, CHUNK_SIZE
+from telethon_client.entity_cache import EntityCache
+
+PRIVATE, GROUP = 1, -1001
+
+
+def make_cache(tmp_path):
+    cache = EntityCache(str(tmp_path / "entities.json"))
+    cache.entries[PRIVATE] = {"type": "user", "id": PRIVATE, "access_hash": 1}
+    cache.entries[GROUP] = {"type": "megagroup", "id": 1001, "access_hash": 2}
+    return cache
+
+
+def facts(reached_start=True, min_clean_id=0):
+    return {"reached_start": reached_start, "min_clean_id": min_clean_id}
+
+
+def test_chunks_without_history(tmp_path):
+    plan = plan_chat(PRIVATE, list(range(1, 251)), None, make_cache(tmp_path))
+    assert plan.method == "ids"
+    assert [len(op["ids"]) for op in plan.ops] == [100, 100, 50]
+    assert plan.rpc_estimate == plan.chunk_rpc == 3
+
+
+def test_memoryview_ids(tmp_path):
+    plan = plan_chat(PRIVATE, memoryview(array('q', range(1, 151))), None, make_cache(tmp_path))
+    assert plan.ops[1]["ids"] == list(range(101, 151))
+
+
+def test_private_chat_prefix_uses_delete_history(tmp_path):
+    ids = list(range(1, 2001)) + [2500]
+    plan = plan_chat(PRIVATE, ids, facts(min_clean_id=2001), make_cache(tmp_path))
+    assert plan.method == "history"
+    assert plan.ops[0] == {"op": "history", "chat_id": PRIVATE, "max_id": 2000, "count": 2000}
+    assert plan.ops[1] == {"op": "ids", "chat_id": PRIVATE, "ids": [2500]}
+    assert plan.rpc_estimate < plan.chunk_rpc
+
+
+def test_incomplete_history_falls_back_to_chunks(tmp_path):
+    plan = plan_chat(PRIVATE, list(range(1, 2001)), facts(reached_start=False), make_cache(tmp_path))
+    assert plan.method == "ids"
+
+
+def test_small_prefix_is_not_worth_delete_history(tmp_path):
+    plan = plan_chat(PRIVATE, list(range(1, CHUNK_SIZE + 1)), facts(min_clean_id=500), make_cache(tmp_path))
+    assert plan.method == "ids"
+
+
+def test_megagroup_deletes_by_ids(tmp_path):
+    # в группе история общая - даже при просмотренной целиком истории только пачки id
+    ids = list(range(1, 5001))
+    plan = plan_chat(GROUP, ids, facts(), make_cache(tmp_path))
+    assert plan.method == "ids"
+    assert {op["op"] for op in plan.ops} == {"ids"}
+
+
+def test_plan_message_deletion_totals(tmp_path):
+    plans = plan_message_deletion({PRIVATE: list(range(1, 2001)), GROUP: [5, 6], 7: []},
+                                  {PRIVATE: facts()}, make_cache(tmp_path))
+    assert set(plans) == {PRIVATE, GROUP}
+    assert plan_totals(plans) == (2 + 1, 20 + 1)
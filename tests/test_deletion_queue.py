@@ -0,0 +1,143 @@
+# tests/test_deletion_queue.py
+import asyncio
+
+import pytest
+
+import config
+from telethon_client.deletion_queue import DeletionQueue, MAX_ATTEMPTS
+from telethon_client.actions import _QueuePasses
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DeletionQueue(str(tmp_path / "queue.sqlite3"))
+    yield queue
+    queue.conn.close()
+
+
+def statuses(queue, batch=None):
+    return queue.counts(batch).get("chat", {})
+
+
+def test_claim_done(queue):
+    batch = queue.enqueue_chats([1, 2])
+    item = queue.claim_next("chat", batch)
+    assert (item.chat_id, item.status, item.attempts) == (1, "pending", 1)
+    assert statuses(queue, batch) == {"running": 1, "pending": 1}
+    queue.mark_done(item)
+    assert statuses(queue, batch) == {"done": 1, "pending": 1}
+
+
+def test_claim_after_id_skips_earlier_items(queue):
+    batch = queue.enqueue_chats([1, 2])
+    first = queue.claim_next("chat", batch)
+    assert queue.mark_failed(first, "ошибка") == "pending"
+    assert queue.claim_next("chat", batch, first.id).chat_id == 2
+    assert queue.claim_next("chat", batch).chat_id == 1
+
+
+def test_transient_failure_goes_dead_after_max_attempts(queue):
+    batch = queue.enqueue_chats([1])
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        item = queue.claim_next("chat", batch)
+        assert item.attempts == attempt
+        expected = "dead" if attempt == MAX_ATTEMPTS else "pending"
+        assert queue.mark_failed(item, "ошибка") == expected
+    assert queue.claim_next("chat", batch) is None
+    assert [item.last_error for item in queue.dead_items()] == ["ошибка"]
+
+
+def test_permanent_failure_goes_dead_at_once(queue):
+    batch = queue.enqueue_chats([1])
+    assert queue.mark_failed(queue.claim_next("chat", batch), "нет прав", permanent=True) == "dead"
+
+
+def test_cancel_pending_and_retry_dead(queue):
+    batch = queue.enqueue_chats([1, 2])
+    other = queue.enqueue_chats([3])
+    assert queue.cancel_pending("chat", batch) == 2
+    assert statuses(queue, batch) == {"dead": 2}
+    assert statuses(queue, other) == {"pending": 1}
+    assert {item.last_error for item in queue.dead_items()} == {"остановлено"}
+    assert queue.retry_dead("chat") == 2
+    assert queue.claim_next("chat", batch).attempts == 1
+
+
+def test_requeue_interrupted(queue):
+    batch = queue.enqueue_chats([1])
+    queue.claim_next("chat", batch)
+    assert queue.requeue_interrupted() == 1
+    assert statuses(queue, batch) == {"pending": 1}
+
+
+def test_enqueue_moves_pending_key_to_new_batch(queue):
+    old = queue.enqueue_chats([1, 2])
+    new = queue.enqueue_chats([2, 3])
+    assert statuses(queue, old) == {"pending": 1}
+    assert statuses(queue, new) == {"pending": 2}
+
+
+def test_enqueue_keeps_running_item_in_its_job(queue):
+    old = queue.enqueue_chats([1])
+    queue.claim_next("chat", old)
+    new = queue.enqueue_chats([1])
+    assert statuses(queue, old) == {"running": 1}
+    assert statuses(queue, new) == {}
+
+
+def test_enqueue_revives_finished_key(queue):
+    old = queue.enqueue_chats([1])
+    queue.mark_done(queue.claim_next("chat", old))
+    new = queue.enqueue_chats([1])
+    assert queue.claim_next("chat", new).attempts == 1
+
+
+def test_passes_retry_transient_failure_within_job(queue, monkeypatch):
+    monkeypatch.setattr(config, "DELETION_RETRY_BACKOFF", 0)
+    batch = queue.enqueue_chats([1, 2])
+
+    async def run():
+        passes = _QueuePasses(queue, "chat", batch, asyncio.Event())
+        seen = []
+        while (item := await passes.next()) is not None:
+            seen.append((passes.number, item.chat_id))
+            if item.chat_id == 1 and passes.number == 1: queue.mark_failed(item, "ошибка")
+            else: queue.mark_done(item)
+        return seen, passes.finish()
+
+    seen, stopped = asyncio.run(run())
+    assert seen == [(1, 1), (1, 2), (2, 1)]
+    assert not stopped
+    assert statuses(queue, batch) == {"done": 2}
+
+
+def test_passes_leave_nothing_pending_for_restart(queue, monkeypatch):
+    monkeypatch.setattr(config, "DELETION_RETRY_BACKOFF", 0)
+    batch = queue.enqueue_chats([1])
+
+    async def run():
+        passes = _QueuePasses(queue, "chat", batch, None)
+        while (item := await passes.next()) is not None:
+            queue.mark_failed(item, "ошибка")
+        return passes.number, passes.finish()
+
+    number, stopped = asyncio.run(run())
+    assert number == MAX_ATTEMPTS
+    assert not stopped
+    assert statuses(queue, batch) == {"dead": 1}
+    assert queue.pending_kinds() == []
+
+
+def test_stopped_job_moves_pending_to_dead(queue):
+    batch = queue.enqueue_chats([1, 2])
+    cancel = asyncio.Event()
+
+    async def run():
+        passes = _QueuePasses(queue, "chat", batch, cancel)
+        queue.mark_done(await passes.next())
+        cancel.set()
+        assert await passes.next() is None
+        return passes.finish()
+
+    assert asyncio.run(run())
+    assert statuses(queue, batch) == {"done": 1, "dead": 1}
@@ -0,0 +1,75 @@
+# tests/test_exports.py
+import csv
+import json
+
+import config
+from telethon_client import exports
+from telethon_client.analysis_store import AnalysisStore
+from telethon_client.results import AnalysisResults, ChatResult
+from telethon_client.thresholds import ThresholdPolicy
+
+
+def make_results():
+    results = AnalysisResults()
+    results.add_chat(ChatResult(-1001, "канал \"один\"", 5, 100, ("дроп", "мамонт")), [10, 11, 12])
+    results.add_chat(ChatResult(2, "личный", 0, 30, is_whitelisted=True))
+    results.add_chat(ChatResult(3, "группа", 2, 40, ("дроп",), count_lower_bound=True, sampled=True), [7])
+    return results
+
+
+OUTCOMES = {-1001: {"chat": "done"}, 3: {"messages": {"done": 1, "dead": 2}}}
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "run.svsnap")
+    results = make_results()
+    assert exports.write_snapshot(path, results, [-1001], {3: 1}, OUTCOMES, ThresholdPolicy("density", 0.02)) == 3
+    loaded, meta = exports.load_snapshot(path)
+    assert loaded.chats == results.chats
+    assert {chat_id: list(ids) for chat_id, ids in loaded.messages_with_triggers.items()} == {-1001: [10, 11, 12], 3: [7]}
+    assert (meta["policy"], meta["threshold"]) == ("density", 0.02)
+    assert meta["candidate"] == ["chat", None, "messages"]
+    assert meta["chat_deletion"] == ["done", None, None]
+    assert meta["message_ops"] == [[0, 0], [0, 0], [1, 2]]
+
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "other.svsnap"
+    path.write_bytes(b"not a snapshot")
+    try:
+        exports.load_snapshot(str(path))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ожидалась ошибка")
+
+
+def test_jsonl_and_csv(tmp_path):
+    results = make_results()
+    jsonl = str(tmp_path / "run.jsonl")
+    assert exports.write_jsonl(jsonl, exports.iter_records(results, [-1001], {3: 1}, OUTCOMES)) == 3
+    with open(jsonl, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["trigger_ids"] == [10, 11, 12] and records[0]["candidate"] == "chat"
+    assert records[1]["trigger_ids"] == [] and records[1]["candidate"] is None
+    path = str(tmp_path / "run.csv")
+    assert exports.write_csv(path, exports.iter_records(results, [-1001], {3: 1}, OUTCOMES)) == 3
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["title"] == "канал \"один\"" and rows[0]["found_triggers"] == "дроп мамонт"
+    assert rows[2]["trigger_message_count"] == "1" and rows[2]["message_ops_failed"] == "2"
+
+
+def test_export_run_streams_from_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "EXPORT_FILENAME_TEMPLATE", str(tmp_path / "export_{timestamp}.{ext}"))
+    store = AnalysisStore(str(tmp_path / "store.sqlite3"))
+    results = make_results()
+    run_id = store.save_run(results)
+    store.set_policy(ThresholdPolicy("count", 3))
+    path, count = exports.export_run("snapshot", store, run_id, OUTCOMES)
+    store.conn.close()
+    loaded, meta = exports.load_snapshot(path)
+    assert count == 3 and loaded.chats == results.chats
+    assert {chat_id: list(ids) for chat_id, ids in loaded.messages_with_triggers.items()} == {-1001: [10, 11, 12], 3: [7]}
+    # чат 3 ниже порога, но его загрузка была остановлена (count_lower_bound) - не кандидат, нужен новый анализ
+    assert meta["candidate"] == ["chat", None, None] and meta["threshold"] == 3
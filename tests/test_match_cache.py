@@ -0,0 +1,33 @@
+# tests/test_match_cache.py
+from telethon_client.matcher import TermMatcher
+from telethon_client.match_cache import MatchCache, ENTRY_BYTES, text_key
+
+
+def test_key_is_digest_of_text():
+    assert text_key("скам") == text_key("скам")
+    assert text_key("скам") != text_key("скам ")
+    assert len(text_key("скам")) == 16
+
+
+def test_hits_and_chats():
+    cache = MatchCache(TermMatcher(["скам"]), 10 ** 6)
+    assert cache.match("это скам", chat_id=1) == ("скам",)
+    assert cache.match("это скам", chat_id=2) == ("скам",)
+    assert cache.match("привет", chat_id=1) == ()
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.duplicates(2) == [{"text": "это скам", "chats": 2, "terms": ["скам"]}]
+
+
+def test_size_limit_in_bytes():
+    cache = MatchCache(TermMatcher(["скам"]), ENTRY_BYTES * 2)
+    for i in range(5): cache.match(f"текст {i}")
+    assert len(cache.entries) == 2 and cache.size <= ENTRY_BYTES * 2
+    assert cache.evictions == 3
+
+
+def test_batch_matches_single():
+    cache = MatchCache(TermMatcher(["скам"]), 10 ** 6)
+    cache.match("это скам")
+    results, misses = cache.split_batch(["это скам", "", "еще скам"])
+    assert results == [("скам",), (), None] and misses == [(2, "еще скам")]
+    assert cache.fill_batch(results, misses, [{"скам"}]) == [("скам",), (), ("скам",)]
@@ -0,0 +1,58 @@
+# tests/test_normalizer.py
+import os
+
+from telethon_client.matcher import TermMatcher
+from telethon_client.normalizer import normalize_text, normalize_batch
+
+from conftest import ROOT
+
+# "дроп" с латинскими p и o, "paypal" с кириллическими а
+MIXED_DROP = "д" + "po" + "п"
+MIXED_PAYPAL = "p" + "а" + "yp" + "а" + "l"
+
+
+def load_terms():
+    with open(os.path.join(ROOT, "terms.txt"), encoding="utf-8") as f:
+        return [line.strip().lower() for line in f if line.strip()]
+
+
+def test_latin_term_does_not_match_cyrillic_word():
+    assert TermMatcher(["bot"]).match("вот это да") == set()
+    assert TermMatcher(["вот"]).match("bot") == set()
+
+
+def test_shipped_terms_do_not_fire_on_plain_russian():
+    matcher = TermMatcher(load_terms())
+    assert "bot" in matcher.terms
+    assert matcher.match("вот это да") == set()
+    assert matcher.match("то сам сделаю") == set()
+
+
+def test_single_script_words_are_not_folded():
+    for word in ("bot", "scam", "to card", "вот", "сам", "після"):
+        assert normalize_text(word) == word
+
+
+def test_mixed_word_folds_to_its_script():
+    assert MIXED_DROP != "дроп" and normalize_text(MIXED_DROP) == "дроп"
+    assert MIXED_PAYPAL != "paypal" and normalize_text(MIXED_PAYPAL) == "paypal"
+    assert TermMatcher(["дроп"]).match(f"ищу {MIXED_DROP.upper()}!") == {"дроп"}
+    assert TermMatcher(["paypal"]).match(f"оплата через {MIXED_PAYPAL}") == {"paypal"}
+
+
+def test_case_yo_punctuation_and_invisible():
+    assert normalize_text("ЁЛКА, Кто-то!") == "елка кто-то"
+    assert normalize_text("др\u200bоп 🔥") == "дроп "
+    assert normalize_text("ｓｃａｍ") == "scam"
+
+
+def test_phrases_match_whole_words():
+    matcher = TermMatcher(["как дела", "дроп"])
+    assert matcher.match("привет, как дела?") == {"как дела"}
+    assert matcher.match("дропшиппинг") == set()
+
+
+def test_batch_equals_single():
+    texts = ["вот bot", MIXED_DROP, "", None, "строка\nс переводом", "ЁЖ " + MIXED_PAYPAL]
+    # переводы строк внутри текста пачка заменяет пробелом - сравниваются слова
+    assert [cleaned.split() for cleaned in normalize_batch(texts)] == [normalize_text(text).split() for text in texts]
@@ -0,0 +1,35 @@
+# tests/test_prescan.py
+from telethon.extensions import markdown
+from telethon.tl import types
+
+from telethon_client.matcher import TermMatcher
+from telethon_client.prescan import _sample_from_response
+from telethon_client.scan_strategies import ChatScan
+
+
+class Client:
+    parse_mode = markdown
+
+
+def message(message_id, text, out=False, entities=None):
+    return types.Message(id=message_id, peer_id=types.PeerUser(1), date=None, message=text, out=out, entities=entities)
+
+
+def test_sample_texts_and_seed():
+    response = types.messages.Messages(messages=[
+        message(3, "это скам", out=True, entities=[types.MessageEntityBold(4, 4)]),
+        types.MessageEmpty(id=2, peer_id=None),
+        message(1, "привет"),
+    ], topics=[], chats=[], users=[])
+    sample = _sample_from_response(Client(), 1, 0, 10, response, TermMatcher(["скам"]))
+    assert sample.complete
+    assert sample.found == [{"скам"}, set()]
+    assert sample.density == 0.5
+    scan = ChatScan()
+    sample.seed(scan)
+    assert (scan.message_count, list(scan.trigger_ids), scan.min_clean_id, scan.offset_id) == (2, [3], 1, 1)
+
+
+def test_sliced_sample_is_incomplete():
+    response = types.messages.MessagesSlice(count=50, messages=[message(50, "a"), message(49, "b")], topics=[], chats=[], users=[])
+    assert not _sample_from_response(Client(), 1, 0, 2, response, TermMatcher(["скам"])).complete
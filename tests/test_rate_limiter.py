@@ -0,0 +1,43 @@
+# tests/test_rate_limiter.py
+import asyncio
+
+import pytest
+from telethon import errors
+
+from telethon_client.rate_limiter import RateScheduler
+
+
+class Pages:
+    # итератор в духе RequestIter: после floodwait повторяет ту же страницу
+    def __init__(self, count, flood_at):
+        self.index = 0
+        self.count = count
+        self.flood_at = set(flood_at)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.index in self.flood_at:
+            self.flood_at.discard(self.index)
+            raise errors.FloodWaitError(None, capture=0)
+        if self.index >= self.count: raise StopAsyncIteration
+        self.index += 1
+        return self.index
+
+
+async def collect(scheduler, pages, **kwargs):
+    return [item async for item in scheduler.paced("GetHistory", pages, 10, **kwargs)]
+
+
+def test_paced_retries_page_after_flood_wait():
+    scheduler = RateScheduler({"GetHistory": (1000, 1000)})
+    assert asyncio.run(collect(scheduler, Pages(25, [10]))) == list(range(1, 26))
+    bucket = scheduler.bucket("GetHistory")
+    assert bucket.flood_waits == 1 and bucket.ceiling == 1000
+
+
+def test_paced_raises_after_retries():
+    scheduler = RateScheduler({"GetHistory": (1000, 1000)})
+    with pytest.raises(errors.FloodWaitError):
+        asyncio.run(collect(scheduler, Pages(25, [0]), retries=0))
@@ -0,0 +1,73 @@
+# tests/test_report.py
+import asyncio
+import gzip
+import os
+
+import pytest
+
+import config
+from telethon_client.analysis_store import AnalysisStore
+from telethon_client.results import AnalysisResults, ChatResult
+from telethon_client.utils import PartialReport, ReportDocument, ReportWriter
+
+
+@pytest.fixture
+def reports_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "REPORTS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "REPORT_FILENAME_TEMPLATE", str(tmp_path / "report_{timestamp}.html"))
+    return tmp_path
+
+
+def chat(chat_id, count=0):
+    return ChatResult(chat_id, f"чат {chat_id}", count, 100, ("дроп",) if count else ())
+
+
+def test_writer_plain_and_gzip(tmp_path):
+    parts = ["<html>", "строка", "</html>"]
+    with ReportWriter(str(tmp_path / "a.html")) as writer:
+        writer.write_all(parts)
+    with ReportWriter(str(tmp_path / "b.html"), compress=True) as compressed:
+        compressed.write_all(parts)
+    assert compressed.path.endswith(".html.gz")
+    assert (tmp_path / "a.html").read_text(encoding="utf-8") == "".join(parts)
+    assert gzip.decompress((tmp_path / "b.html.gz").read_bytes()).decode("utf-8") == "".join(parts)
+
+
+@pytest.mark.parametrize("virtual", [False, True])
+@pytest.mark.parametrize("compress", [False, True])
+def test_save_in_worker_thread_matches_render(tmp_path, reports_dir, virtual, compress):
+    store = AnalysisStore(str(tmp_path / "store.sqlite3"))
+    results = AnalysisResults()
+    for chat_id in range(1, 60):
+        results.add_chat(chat(chat_id, chat_id % 7))
+    run_id = store.save_run(results)
+    report = ReportDocument(store, run_id, set(), [], ["дроп"], virtual=virtual)
+    assert store.report_state(run_id) is None # отчет в хранилище создается уже в рабочем потоке
+    path = asyncio.run(asyncio.to_thread(report.save, compress))
+    assert report.rendered_rows == 59 and report.chat_count == 59
+    assert store.report_state(run_id)["virtual"] == virtual
+    saved = gzip.decompress(open(path, "rb").read()).decode("utf-8") if compress else open(path, encoding="utf-8").read()
+    assert saved == report.render()
+    assert report.rendered_rows == 0 # строки уже в хранилище
+    store.conn.close()
+
+
+def test_partial_report_grows_during_analysis(reports_dir, monkeypatch):
+    monkeypatch.setattr(config, "REPORT_PARTIAL_ROWS", 2)
+
+    async def run():
+        partial = PartialReport(1)
+        await partial.open()
+        for chat_id in range(1, 6):
+            await partial.add(chat(chat_id, chat_id))
+        # две пачки уже на диске, пятая строка - в буфере
+        with open(partial.path, encoding="utf-8") as f:
+            assert f.read().count("<tr class=") == 4
+        path = await partial.finish()
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        assert html.count("<tr class=") == 5 and html.endswith("</html>")
+        partial.discard()
+        assert not os.path.exists(path)
+
+    asyncio.run(run())
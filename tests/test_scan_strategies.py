@@ -0,0 +1,58 @@
+# tests/test_scan_strategies.py
+import asyncio
+from types import SimpleNamespace
+
+from telethon.tl import types
+
+from telethon_client.matcher import TermMatcher
+from telethon_client.scan_strategies import choose_strategy
+
+
+class Client:
+    # get_messages(limit=1) -> список с total, как TotalList у telethon
+    def __init__(self, total):
+        self.total = total
+        self.calls = 0
+
+    async def get_messages(self, chat_id, limit=None):
+        self.calls += 1
+        if isinstance(self.total, Exception): raise self.total
+        return SimpleNamespace(total=self.total)
+
+
+def context(total, terms=10, fetch_limit=None):
+    return SimpleNamespace(strategy_mode="auto", client=Client(total), fetch_limit=fetch_limit,
+                           matcher=TermMatcher([f"слово{i}" for i in range(terms)]))
+
+
+def choose(ctx, entity=None, top_message=None, min_id=0):
+    return asyncio.run(choose_strategy(ctx, 1, entity or types.User(id=1), top_message, min_id)).name
+
+
+def test_unknown_size_small_chat_is_downloaded():
+    ctx = context(total=300, terms=240)
+    assert choose(ctx) == "full"
+    assert ctx.client.calls == 1
+
+
+def test_unknown_size_large_chat_is_searched():
+    ctx = context(total=100_000, terms=240)
+    assert choose(ctx) == "search"
+
+
+def test_search_needs_clear_margin():
+    # 1 + 10 запросов поиска против 15 страниц - выигрыш меньше SEARCH_COST_MARGIN
+    assert choose(context(total=1500)) == "full"
+    assert choose(context(total=2300)) == "search"
+
+
+def test_unknown_size_count_failure_falls_back_to_full():
+    assert choose(context(total=ConnectionError("нет сети"))) == "full"
+
+
+def test_channel_size_is_estimated_without_requests():
+    ctx = context(total=0)
+    channel = types.Channel(id=2, title="канал", photo=types.ChatPhotoEmpty(), date=None)
+    assert choose(ctx, channel, top_message=50_000) == "search"
+    assert choose(ctx, channel, top_message=500) == "full"
+    assert ctx.client.calls == 0
@@ -0,0 +1,59 @@
+# tests/test_thresholds.py
+import pytest
+
+from telethon_client.thresholds import ChatColumns, ThresholdPolicy, np
+
+
+@pytest.mark.parametrize("args, mode, value", [
+    (["5"], "count", 5),
+    (["count", "7"], "count", 7),
+    (["DENSITY", "0.02"], "density", 0.02),
+    (["density", "2%"], "density", 0.02),
+])
+def test_parse(args, mode, value):
+    policy = ThresholdPolicy.parse(args)
+    assert (policy.mode, policy.value) == (mode, pytest.approx(value))
+
+
+@pytest.mark.parametrize("args", [[], ["count"], ["count", "x"], ["ratio", "1"], ["density", "150%"], ["count", "-1"], ["1", "2", "3"]])
+def test_parse_rejects(args):
+    with pytest.raises(ValueError):
+        ThresholdPolicy.parse(args)
+
+
+def test_dict_round_trip():
+    policy = ThresholdPolicy("density", 0.05)
+    assert ThresholdPolicy.from_dict(policy.to_dict()) == policy
+
+
+def test_exceeds():
+    assert ThresholdPolicy("count", 3).exceeds(4, 1000)
+    assert not ThresholdPolicy("count", 3).exceeds(3, 1)
+    assert ThresholdPolicy("density", 0.1).exceeds(2, 10)
+    assert not ThresholdPolicy("density", 0.1).exceeds(2, 20)
+
+
+ROWS = [
+    # chat_id, count, message_count, trigger_messages, count_lower_bound
+    (1, 10, 100, 10, False),
+    (2, 2, 10, 2, False),
+    (3, 2, 1000, 2, False),
+    (4, 1, 50, 1, True),
+    (5, 0, 500, 0, False),
+]
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+@pytest.mark.parametrize("policy, full, messages, uncertain", [
+    (ThresholdPolicy("count", 3), [1], {2: 2, 3: 2}, [4]),
+    (ThresholdPolicy("density", 0.05), [1, 2], {3: 2}, [4]),
+])
+def test_classify(vectorized, policy, full, messages, uncertain):
+    if vectorized and np is None: pytest.skip("numpy не установлен")
+    columns = ChatColumns(1, ROWS, total=len(ROWS) + 2)
+    if not vectorized: columns._np = None
+    split = columns.classify(policy)
+    assert split.full == full
+    assert split.messages == messages
+    assert split.uncertain == uncertain
+    assert split.clean == 7 - len(full) - len(messages) - len(uncertain)